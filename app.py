@@ -1,15 +1,33 @@
-from src.ui.icons import Icons
 import streamlit as st
-import pandas as pd
+
+from src.ui.icons import Icons
+
 try:
     import plotly.express as px
     PLOTLY_AVAILABLE = True
 except ImportError:
     PLOTLY_AVAILABLE = False
     st.error(" Plotly não está instalado. Execute: pip install plotly")
-from src.database.repository import buscar_empresas_dto, buscar_cnae_por_texto, listar_cidades_do_banco, buscar_dados_dashboard_executivo
+import json
+import os
+import time
+
 from src.database.crm_repository import adicionar_lista_ao_crm
-from src.services.excel_service import gerar_excel_de_dtos
+from src.database.repository import (
+    LIMITE_BUSCA_EMPRESAS,
+    buscar_cnae_por_texto,
+    buscar_dados_dashboard_executivo,
+    buscar_empresas_dto,
+    cursor_busca_empresas,
+    listar_cidades_do_banco,
+)
+from src.services.excel_service import gerar_excel_de_dtos, gerar_excel_streaming
+from src.services.export_service import (
+    FORMATOS_EXPORTACAO,
+    arquivo_temporario,
+    exportar_empresas,
+    exportar_leads_enriquecidos,
+)
 from src.ui.tab_crm import render_tab_crm
 from src.ui.tab_rota import render_tab_rota
 
@@ -34,6 +52,44 @@ st.markdown("""
     }
 </style>
 """, unsafe_allow_html=True)
+MIME_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+EXPORTACOES_GUARDADAS = 4  # cada planilha de 50k linhas tem alguns MB
+
+
+def descartar_excel_completo():
+    """Apaga o arquivo temporário do Excel completo (se houver) e limpa a referência."""
+    anterior = st.session_state.get('excel_completo')
+    if anterior and os.path.exists(anterior[0]):
+        os.remove(anterior[0])
+    st.session_state.excel_completo = None
+
+
+def excel_sob_demanda(chave, gerar, rotulo, nome_arquivo):
+    """
+    Gera o Excel só quando o usuário pede e guarda o resultado por chave
+    (filtros, seleção): clicar na tabela não refaz a planilha a cada rerun.
+    """
+    cache = st.session_state.setdefault('exportacoes_excel', {})
+    if chave not in cache:
+        if st.button(Icons.DOWNLOAD + f" PREPARAR {rotulo}", key=f"preparar_{nome_arquivo}", width='stretch'):
+            inicio = time.perf_counter()
+            with st.spinner(Icons.CARREGANDO + " Gerando planilha..."):
+                dados = gerar()
+            cache[chave] = (dados, time.perf_counter() - inicio)
+            while len(cache) > EXPORTACOES_GUARDADAS:
+                cache.pop(next(iter(cache)))
+    if chave in cache:
+        dados, segundos = cache[chave]
+        st.download_button(
+            label=Icons.DOWNLOAD + f" BAIXAR {rotulo}",
+            data=dados,
+            file_name=nome_arquivo,
+            mime=MIME_XLSX,
+            width='stretch'
+        )
+        st.caption(f"Planilha gerada em {segundos:.2f}s")
+
+
 # BARRA LATERAL 
 with st.sidebar:
     st.image("https://cdn-icons-png.flaticon.com/512/107/107799.png", width=100)
@@ -61,6 +117,36 @@ with st.sidebar:
     clicou_buscar = st.button(" GERAR LISTA DE PROSPECÇÃO")
 
     st.caption(f"ℹ️ Limite de segurança: 50.000 resultados")
+
+    # EXPORTAÇÃO DIRETA (BI / discador): o DuckDB grava o arquivo, sem limite de linhas
+    with st.expander(Icons.DOWNLOAD + " Exportar CSV / Parquet / JSONL"):
+        formato_export = st.selectbox("Formato:", list(FORMATOS_EXPORTACAO), key="formato_export")
+        export_completo = st.checkbox("Dados completos (endereço, CNAE, abertura)", key="export_completo")
+        if st.button("Gerar arquivo", key="gerar_export"):
+            cnaes_export = [c.strip() for c in cnae_input.split(',') if c.strip()]
+            if not cnaes_export:
+                st.warning(Icons.ALERTA + " Informe o CNAE acima.")
+            else:
+                with st.spinner(Icons.CARREGANDO + " Exportando..."):
+                    if export_completo:
+                        caminho = exportar_leads_enriquecidos(cnaes_export, estado, cidade, formato=formato_export)
+                    else:
+                        caminho = exportar_empresas(cnaes_export, estado, cidade, formato=formato_export)
+                anterior = st.session_state.get('arquivo_export')
+                if anterior and os.path.exists(anterior[0]):
+                    os.remove(anterior[0])
+                st.session_state.arquivo_export = (caminho, formato_export) if caminho else None
+        if st.session_state.get('arquivo_export') and os.path.exists(st.session_state.arquivo_export[0]):
+            caminho, formato = st.session_state.arquivo_export
+            extensao, _, mime = FORMATOS_EXPORTACAO[formato]
+            with open(caminho, 'rb') as f:
+                st.download_button(
+                    label=Icons.DOWNLOAD + f" BAIXAR {formato}",
+                    data=f,
+                    file_name=f"Leads.{extensao}",
+                    mime=mime,
+                    width='stretch'
+                )
     
     with st.expander(Icons.ALERTA + " Ler sobre o Limite e Riscos"):
         st.warning("""
@@ -72,6 +158,9 @@ with st.sidebar:
         * **Acima de 500k:** Pode estourar a memória RAM (16GB) e fechar o programa.
         
         *Recomendação:* Mantenha em 50k e use filtros de Cidade ou CNAE para segmentar melhor.
+        
+        Para baixar a lista inteira use **Excel completo (sem limite)** depois da busca: as linhas vão
+        direto do banco para o arquivo, sem passar pela tabela, e a memória fica constante.
         """)
 
 # AREA PRINCIPAL 
@@ -121,6 +210,8 @@ with aba2:
                 resultados = buscar_empresas_dto(lista_cnaes, estado, cidade)
                 # Salva os resultados no session_state
                 st.session_state.resultados_busca = resultados
+                descartar_excel_completo()
+                st.session_state.exportacoes_excel = {}
                 st.session_state.filtros_busca = {
                     'lista_cnaes': lista_cnaes,
                     'estado': estado,
@@ -133,8 +224,8 @@ with aba2:
     if resultados:
         # PARTE A: MÉTRICAS
         total = len(resultados)
-        com_email = sum(1 for r in resultados if r.email)
-        com_tel = sum(1 for r in resultados if r.telefone_principal)
+        com_email = resultados.contar_preenchidos('email')
+        com_tel = resultados.contar_preenchidos('telefone_principal')
         
         c1, c2, c3 = st.columns(3)
         c1.metric(Icons.LOGO_PAGINA + " Total de Empresas", total)
@@ -147,24 +238,49 @@ with aba2:
         col_txt, col_btn = st.columns([3, 1])
         with col_txt:
             st.info(Icons.BUSCAR + " Selecione as empresas na tabela para enviar ao CRM ou baixar separado.")
+        # Identifica a busca atual nas chaves das exportações guardadas
+        hash_filtros = hash(json.dumps(st.session_state.filtros_busca, sort_keys=True))
         with col_btn:
-            excel_total = gerar_excel_de_dtos(resultados)
-            st.download_button(
-                label=Icons.DOWNLOAD + " BAIXAR TUDO",
-                data=excel_total,
-                file_name="Lista_Completa.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                width='stretch'
+            excel_sob_demanda(
+                (hash_filtros, None), lambda: gerar_excel_de_dtos(resultados.df),
+                "TUDO", "Lista_Completa.xlsx"
             )
         
+        # Lista cortada no limite: exportação completa lendo direto do banco
+        if total >= LIMITE_BUSCA_EMPRESAS:
+            filtros = st.session_state.filtros_busca
+            st.caption(f"A tabela mostra só os primeiros {LIMITE_BUSCA_EMPRESAS:,} resultados.")
+            if st.button(Icons.DOWNLOAD + " Gerar Excel completo (sem limite)", width='stretch'):
+                inicio = time.perf_counter()
+                descartar_excel_completo()
+                with st.spinner(Icons.CARREGANDO + " Gerando planilha completa..."):
+                    arquivo = arquivo_temporario("xlsx")
+                    with cursor_busca_empresas(filtros['lista_cnaes'], filtros['estado'], filtros['cidade']) as cur:
+                        if cur:
+                            gerar_excel_streaming(cur, arquivo)
+                    st.session_state.excel_completo = (arquivo, time.perf_counter() - inicio)
+            # O arquivo pode ter vencido (sessão parada por horas): aí é só gerar de novo
+            if st.session_state.get('excel_completo') and os.path.exists(st.session_state.excel_completo[0]):
+                caminho, segundos = st.session_state.excel_completo
+                with open(caminho, 'rb') as f:
+                    st.download_button(
+                        label=Icons.DOWNLOAD + " BAIXAR LISTA COMPLETA",
+                        data=f,
+                        file_name="Lista_Completa_Sem_Limite.xlsx",
+                        mime=MIME_XLSX,
+                        width='stretch'
+                    )
+                st.caption(f"Planilha gerada em {segundos:.2f}s")
+
         # Botão para limpar resultados
         if st.button(Icons.BUSCAR + " Nova Busca", width='stretch'):
             st.session_state.resultados_busca = None
             st.session_state.filtros_busca = None
+            descartar_excel_completo()
             st.rerun()
 
         #  PARTE C: TABELA COM CHECKBOX
-        df_view = pd.DataFrame([vars(r) for r in resultados])
+        df_view = resultados.df
         
         # Filtra colunas visíveis
         cols = ['nome_fantasia', 'cnpj', 'cidade', 'telefone_principal', 'email']
@@ -187,28 +303,23 @@ with aba2:
             st.success(Icons.SUCESSO + f" **{len(indices)} empresas selecionadas.**")
             
             # Pega os dados dos selecionados
-            lista_selecionados_dto = [resultados[i] for i in indices]
-            lista_selecionados_dict = [vars(r) for r in lista_selecionados_dto]
+            selecionados = resultados.selecionar(indices)
             
             col_a, col_b = st.columns(2)
             
             # Botão 1: CRM
             with col_a:
                 if st.button(" ENVIAR PARA CRM LEADS ", type="primary", width='stretch'):
-                    if adicionar_lista_ao_crm(lista_selecionados_dict):
+                    if adicionar_lista_ao_crm(selecionados.df.to_dict('records')):
                         st.toast("Enviado para o Pipeline!", icon=Icons.SUCESSO)
                     else:
                         st.error("Erro ao salvar.")
             
             # Botão 2: Baixar Selecionados
             with col_b:
-                excel_parcial = gerar_excel_de_dtos(lista_selecionados_dto)
-                st.download_button(
-                    label=Icons.DOWNLOAD + " BAIXAR SELECIONADOS",
-                    data=excel_parcial,
-                    file_name="Selecionados.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    width='stretch'
+                excel_sob_demanda(
+                    (hash_filtros, hash(tuple(indices))), lambda: gerar_excel_de_dtos(selecionados.df),
+                    "SELECIONADOS", "Selecionados.xlsx"
                 )
 
 #ABA 3: pipeline
@@ -94,7 +94,7 @@ def recriar_banco() -> tuple[bool, str]:
     """
     try:
         proc = subprocess.run(
-            ["python", "setup_banco_completo.py"],
+            ["python", "setup_banco_completo.py", "--ordenar"],
             capture_output=True,
             text=True,
             check=False,
@@ -1,108 +1,367 @@
+import argparse
 import duckdb
+import glob
 import pandas as pd
 import os
+import shutil
+import tempfile
 import time
 import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-print("---  IMPORTAÇÃO (VIA PANDAS CHUNKS) ---")
+from src.config.settings import CRM_DB_FILE, DB_FILE
+from src.database.schema import (
+    COLUNAS_RECEITA,
+    CRM_ALIAS,
+    DDL_ESTABELECIMENTOS,
+    ORDEM_CLUSTER,
+    SELECT_TIPADO,
+    TABELA_ATIVOS,
+    TABELA_CRM_ENRIQUECIDO,
+    TABELA_CUBO,
+    atualizar_crm_enriquecido,
+    criar_cubo_mercado,
+    criar_tabela_ativos,
+    incrementar_versao,
+    normalizar_tabelas_referencia,
+    ordenar_estabelecimentos,
+    relatorio_row_groups,
+)
 
 # 1. Configuração Inicial
-db_file = 'hunter_leads.db'
-if os.path.exists(db_file):
-    print("  ATENÇÃO: O arquivo hunter_leads.db já existe!")
-    print("    Para evitar duplicidade, pare agora e apague o arquivo db.")
-    print("    Continuando em 5 segundos...")
-    time.sleep(5)
-
-con = duckdb.connect(db_file)
+pasta_dados = 'dados'
 
 # 2. Definindo as Colunas (Importante para o Pandas não se perder)
-colunas_empresas = [
-    'cnpj_basico', 'cnpj_ordem', 'cnpj_dv', 'matriz_filial', 'nome_fantasia',
-    'situacao_cadastral', 'data_situacao_cadastral', 'motivo_situacao_cadastral',
-    'nome_cidade_exterior', 'pais', 'data_inicio_atividade', 'cnae_principal',
-    'cnae_secundaria', 'tipo_logradouro', 'logradouro', 'numero', 'complemento',
-    'bairro', 'cep', 'uf', 'municipio', 'ddd_1', 'telefone_1', 'ddd_2',
-    'telefone_2', 'ddd_fax', 'fax', 'correio_eletronico', 'situacao_especial',
-    'data_situacao_especial'
-]
-
-
-# PARTE 1: CNAES 
-
-print("\n 1. Importando CNAEs...")
-try:
-    con.execute("DROP TABLE IF EXISTS cnaes")
-    # Lê usando Pandas para garantir encoding correto
-    with zipfile.ZipFile("dados/CNAECNV.zip") as z:
-        with z.open(z.namelist()[0]) as f:
-            df_cnae = pd.read_csv(f, sep=';', encoding='latin1', header=None, names=['codigo', 'descricao'], dtype=str)
-            con.execute("CREATE TABLE cnaes AS SELECT * FROM df_cnae")
-            print(f"    {len(df_cnae)} CNAEs importados.")
-except Exception as e:
-    print(f"    Erro CNAE: {e}")
+colunas_empresas = COLUNAS_RECEITA
+
+# Leitor CSV nativo do DuckDB (paralelo). As colunas são mapeadas por nome e
+# strict_mode/ignore_errors reproduzem o on_bad_lines='skip' do Pandas.
+colunas_csv_sql = "{" + ", ".join(f"'{c}': 'VARCHAR'" for c in colunas_empresas) + "}"
+leitura_csv_sql = f"""
+    read_csv(
+        ?,
+        delim=';',
+        quote='"',
+        escape='"',
+        header=false,
+        encoding='latin-1',
+        auto_detect=false,
+        columns={colunas_csv_sql},
+        strict_mode=false,
+        ignore_errors=true
+    )
+"""
+
+
+# PARTE 1: CNAES
+
+def importar_cnaes(con):
+    print("\n 1. Importando CNAEs...")
+    try:
+        con.execute("DROP TABLE IF EXISTS cnaes")
+        # Lê usando Pandas para garantir encoding correto
+        with zipfile.ZipFile(f"{pasta_dados}/CNAECNV.zip") as z:
+            with z.open(z.namelist()[0]) as f:
+                df_cnae = pd.read_csv(f, sep=';', encoding='latin1', header=None, names=['codigo', 'descricao'], dtype=str)
+                con.execute("""
+                    CREATE TABLE cnaes AS
+                    SELECT TRY_CAST(REGEXP_REPLACE(codigo, '[^0-9]', '', 'g') AS INTEGER) AS codigo, descricao
+                    FROM df_cnae
+                """)
+                print(f"    {len(df_cnae)} CNAEs importados.")
+    except Exception as e:
+        print(f"    Erro CNAE: {e}")
 
 
 # PARTE 2: EMPRESAS
 
-print("\n 2. Importando Empresas (Modo Chunk - Isso é robusto)...")
+def _importar_zip_pandas(con, arquivo_zip):
+    """Modo legado: decodifica o CSV em blocos de 100 mil linhas via Pandas."""
+    with zipfile.ZipFile(arquivo_zip) as z:
+        # Pega o nome do arquivo CSV dentro do ZIP
+        nome_csv = z.namelist()[0]
 
-# tabela vazia 
-con.execute(f"CREATE TABLE IF NOT EXISTS estabelecimentos ({', '.join([f'{c} VARCHAR' for c in colunas_empresas])})")
+        # Abre o arquivo CSV dentro do ZIP sem extrair
+        with z.open(nome_csv) as f:
+            chunks = pd.read_csv(
+                f,
+                sep=';',
+                encoding='latin1',
+                header=None,
+                names=colunas_empresas,
+                dtype=str,
+                quotechar='"',
+                chunksize=100000,
+                on_bad_lines='skip'
+            )
 
-total_geral = 0
-inicio_geral = time.time()
+            contador_arquivo = 0
+            print(f"\n      ↳ Processando blocos:", end=" ")
 
-for i in range(10):
-    arquivo_zip = f"dados/ESTABELE{i}.zip"
-    
-    if os.path.exists(arquivo_zip):
-        print(f"    Abrindo {arquivo_zip}...", end=" ")
-        
-        try:
-            with zipfile.ZipFile(arquivo_zip) as z:
-                # Pega o nome do arquivo CSV dentro do ZIP
-                nome_csv = z.namelist()[0]
-                
-                # Abre o arquivo CSV dentro do ZIP sem extrair 
-                with z.open(nome_csv) as f:
-                    
-                    
-                   
-                    chunks = pd.read_csv(
-                        f, 
-                        sep=';', 
-                        encoding='latin1', 
-                        header=None, 
-                        names=colunas_empresas, 
-                        dtype=str, 
-                        quotechar='"',
-                        chunksize=100000, 
-                        on_bad_lines='skip' 
-                    )
-                    
-                    contador_arquivo = 0
-                    print(f"\n      ↳ Processando blocos:", end=" ")
-                    
-                    for chunk in chunks:
-                        #bloco Pandas no DuckDB
-                        con.execute("INSERT INTO estabelecimentos SELECT * FROM chunk")
-                        contador_arquivo += len(chunk)
-                        print(".", end="", flush=True) 
-                    
-                    total_geral += contador_arquivo
-                    print(f" OK! (+{contador_arquivo:,} empresas)")
+            for chunk in chunks:
+                #bloco Pandas no DuckDB (já convertido para o esquema tipado)
+                con.execute(f"INSERT INTO estabelecimentos BY NAME SELECT {SELECT_TIPADO} FROM chunk")
+                contador_arquivo += len(chunk)
+                print(".", end="", flush=True)
+
+            return contador_arquivo
+
+
+def _extrair_csv(arquivo_zip, pasta_destino):
+    """
+    Copia o CSV de dentro do ZIP para disco em streaming (sem carregar na memória).
+    O leitor paralelo do DuckDB precisa de um arquivo com acesso aleatório.
+    """
+    with zipfile.ZipFile(arquivo_zip) as z:
+        nome_csv = z.namelist()[0]
+        caminho_csv = os.path.join(pasta_destino, os.path.basename(nome_csv))
+        with z.open(nome_csv) as origem, open(caminho_csv, 'wb') as destino:
+            shutil.copyfileobj(origem, destino, length=16 * 1024 * 1024)
+    return caminho_csv
+
+
+def _importar_zip_duckdb(con, arquivo_zip):
+    """Modo nativo: o CSV vai direto para o leitor paralelo do DuckDB."""
+    with tempfile.TemporaryDirectory(dir=pasta_dados) as pasta_tmp:
+        caminho_csv = _extrair_csv(arquivo_zip, pasta_tmp)
+        res = con.execute(
+            f"INSERT INTO estabelecimentos BY NAME SELECT {SELECT_TIPADO} FROM {leitura_csv_sql}",
+            [caminho_csv]
+        ).fetchone()
+        return res[0] if res else 0
+
+
+def _converter_zip_para_parquet(arquivo_zip, arquivo_parquet, memoria_worker, threads_worker):
+    """
+    Tarefa de um worker do modo paralelo: decodifica e tipa um ZIP num DuckDB
+    em memória próprio e grava o resultado como Parquet de staging.
+    Retorna (linhas, segundos).
+    """
+    inicio = time.time()
+    pasta_staging = os.path.dirname(arquivo_parquet)
+    con = duckdb.connect()
+    try:
+        con.execute(f"SET memory_limit = '{memoria_worker}'")
+        con.execute(f"SET threads = {int(threads_worker)}")
+        con.execute(f"SET temp_directory = '{pasta_staging}'")
+        con.execute("SET preserve_insertion_order = false")
+
+        with tempfile.TemporaryDirectory(dir=pasta_staging) as pasta_tmp:
+            caminho_csv = _extrair_csv(arquivo_zip, pasta_tmp)
+            res = con.execute(
+                f"COPY (SELECT {SELECT_TIPADO} FROM {leitura_csv_sql}) TO '{arquivo_parquet}' (FORMAT parquet)",
+                [caminho_csv]
+            ).fetchone()
+        return (res[0] if res else 0), time.time() - inicio
+    except Exception:
+        # Parquet pela metade não pode entrar no merge final
+        if os.path.exists(arquivo_parquet):
+            os.remove(arquivo_parquet)
+        raise
+    finally:
+        con.close()
+
+
+def _importar_paralelo(con, arquivos, workers, memoria_worker):
+    """
+    Modo paralelo: cada ZIP vira um Parquet de staging num processo separado
+    e um único INSERT junta tudo em estabelecimentos no final.
+    """
+    threads_worker = max(1, (os.cpu_count() or 1) // workers)
+    pasta_staging = tempfile.mkdtemp(prefix='staging_', dir=pasta_dados)
+    print(f"    {len(arquivos)} arquivos | {workers} workers x {threads_worker} threads | {memoria_worker} por worker")
+
+    total_geral = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            tarefas = {
+                pool.submit(
+                    _converter_zip_para_parquet,
+                    arquivo_zip,
+                    os.path.join(pasta_staging, f"{os.path.splitext(os.path.basename(arquivo_zip))[0]}.parquet"),
+                    memoria_worker,
+                    threads_worker,
+                ): arquivo_zip
+                for arquivo_zip in arquivos
+            }
+            for tarefa in as_completed(tarefas):
+                arquivo_zip = tarefas[tarefa]
+                try:
+                    linhas, duracao = tarefa.result()
+                    print(f"    {arquivo_zip} OK! (+{linhas:,} empresas em {duracao:.1f}s, {linhas / max(duracao, 1e-6):,.0f} linhas/s)")
+                except Exception as e:
+                    print(f"    Erro crítico no arquivo {arquivo_zip}: {e}")
+
+        staging = glob.glob(os.path.join(pasta_staging, '*.parquet'))
+        if staging:
+            print("    Juntando staging em estabelecimentos...", end=" ")
+            inicio_merge = time.time()
+            res = con.execute(
+                "INSERT INTO estabelecimentos BY NAME SELECT * FROM read_parquet(?)",
+                [staging]
+            ).fetchone()
+            total_geral = res[0] if res else 0
+            print(f"OK! ({total_geral:,} empresas em {time.time() - inicio_merge:.1f}s)")
+    finally:
+        shutil.rmtree(pasta_staging, ignore_errors=True)
+
+    return total_geral
+
+
+def importar_estabelecimentos(con, modo, workers=None, memoria_worker='2GB'):
+    print(f"\n 2. Importando Empresas (modo {modo})...")
+
+    # tabela vazia, já com as colunas tipadas/normalizadas (src/database/schema.py)
+    con.execute(DDL_ESTABELECIMENTOS)
+
+    if modo == 'paralelo':
+        arquivos = [f"{pasta_dados}/ESTABELE{i}.zip" for i in range(10)]
+        for arquivo_zip in arquivos:
+            if not os.path.exists(arquivo_zip):
+                print(f"     Arquivo {arquivo_zip} não encontrado.")
+        arquivos = [a for a in arquivos if os.path.exists(a)]
+        if not arquivos:
+            return 0
+        workers = min(workers or os.cpu_count() or 1, len(arquivos))
+        return _importar_paralelo(con, arquivos, workers, memoria_worker)
+
+    importar_zip = _importar_zip_duckdb if modo == 'duckdb' else _importar_zip_pandas
+    total_geral = 0
+
+    for i in range(10):
+        arquivo_zip = f"{pasta_dados}/ESTABELE{i}.zip"
 
+        if os.path.exists(arquivo_zip):
+            print(f"    Abrindo {arquivo_zip}...", end=" ")
+
+            try:
+                inicio_arquivo = time.time()
+                contador_arquivo = importar_zip(con, arquivo_zip)
+                duracao = max(time.time() - inicio_arquivo, 1e-6)
+
+                total_geral += contador_arquivo
+                print(f" OK! (+{contador_arquivo:,} empresas em {duracao:.1f}s, {contador_arquivo / duracao:,.0f} linhas/s)")
+
+            except Exception as e:
+                print(f"\n    Erro crítico no arquivo {i}: {e}")
+
+        else:
+            print(f"     Arquivo {arquivo_zip} não encontrado.")
+
+    return total_geral
+
+
+# PARTE 3: PÓS-PROCESSAMENTO
+
+def reordenar_estabelecimentos(con):
+    print(f"\n 3. Reordenando estabelecimentos por ({', '.join(ORDEM_CLUSTER)})...", end=" ")
+    inicio = time.time()
+    ordenar_estabelecimentos(con)
+    con.execute("CHECKPOINT")
+    print(f"OK! ({time.time() - inicio:.1f}s)")
+
+    print("    Row groups lidos por consulta típica:")
+    for consulta, lidos, total in relatorio_row_groups(con):
+        print(f"      {consulta}: lê {lidos} de {total} row groups (pula {(1 - lidos / total) * 100:.1f}%)")
+
+
+def criar_tabelas_derivadas(con):
+    print(f"\n 4. Criando {TABELA_ATIVOS} (só ativas, colunas usadas pelo app)...", end=" ")
+    inicio = time.time()
+    total_ativos = criar_tabela_ativos(con)
+    print(f"OK! ({total_ativos:,} empresas ativas em {time.time() - inicio:.1f}s)")
+
+    print(f" 5. Criando {TABELA_CUBO} (contagens para o Dashboard)...", end=" ")
+    inicio = time.time()
+    total_celulas = criar_cubo_mercado(con)
+    print(f"OK! ({total_celulas:,} combinações em {time.time() - inicio:.1f}s)")
+
+    # Nova versão da base: os caches do app (chaveados por ela) deixam de valer
+    incrementar_versao(con, 'main')
+
+    # Os dados de exibição do CRM vêm de estabelecimentos: recalcula com a base nova
+    if os.path.exists(CRM_DB_FILE):
+        print(f" 6. Atualizando {TABELA_CRM_ENRIQUECIDO} ({CRM_DB_FILE})...", end=" ")
+        inicio = time.time()
+        try:
+            con.execute(f"ATTACH IF NOT EXISTS '{CRM_DB_FILE}' AS {CRM_ALIAS}")
+            total_crm = atualizar_crm_enriquecido(con)
+            print(f"OK! ({total_crm:,} leads em {time.time() - inicio:.1f}s)")
         except Exception as e:
-            print(f"\n    Erro crítico no arquivo {i}: {e}")
-            
+            print(f"ERRO: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cria o banco da Receita (HUNTER_DB, padrão hunter_leads.db) a partir dos ZIPs da Receita.")
+    parser.add_argument(
+        '--modo',
+        choices=['duckdb', 'paralelo', 'pandas'],
+        default='duckdb',
+        help=(
+            "duckdb = leitor CSV nativo e paralelo (padrão); "
+            "paralelo = um processo por ZIP com staging em Parquet; "
+            "pandas = blocos de 100 mil linhas (legado)"
+        )
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help="Modo paralelo: quantidade de processos (padrão: núcleos da máquina, até 10)"
+    )
+    parser.add_argument(
+        '--memoria-worker',
+        default='2GB',
+        help="Modo paralelo: memory_limit do DuckDB em cada worker (ex: 2GB, 512MB)"
+    )
+    parser.add_argument(
+        '--ordenar',
+        action='store_true',
+        help="Grava estabelecimentos ordenada por situação, UF, CNAE e município (zone maps) e mostra os row groups pulados"
+    )
+    parser.add_argument(
+        '--sem-importacao',
+        action='store_true',
+        help="Não lê os ZIPs; só executa os passos pedidos (ex: --ordenar) sobre o banco existente"
+    )
+    args = parser.parse_args()
+
+    con = None
+    inicio_geral = time.time()
+    total_geral = 0
+
+    if args.sem_importacao:
+        print("---  PÓS-PROCESSAMENTO DO BANCO EXISTENTE ---")
+        con = duckdb.connect(DB_FILE)
     else:
-        print(f"     Arquivo {arquivo_zip} não encontrado.")
+        print(f"---  IMPORTAÇÃO (MODO {args.modo.upper()}) ---")
+
+        if os.path.exists(DB_FILE):
+            print(f"  ATENÇÃO: O arquivo {DB_FILE} já existe!")
+            print("    A tabela estabelecimentos será recriada (CRM e municípios são mantidos).")
+            print("    Continuando em 5 segundos...")
+            time.sleep(5)
+
+        con = duckdb.connect(DB_FILE)
+
+        importar_cnaes(con)
+        total_geral = importar_estabelecimentos(con, args.modo, args.workers, args.memoria_worker)
+        normalizar_tabelas_referencia(con)
+
+    if args.ordenar:
+        reordenar_estabelecimentos(con)
+
+    # Sempre refeitas, para nunca ficarem defasadas em relação a estabelecimentos
+    criar_tabelas_derivadas(con)
+
+    # FINALIZAÇÃO
+    tempo_total = (time.time() - inicio_geral) / 60
+    print(f"\n FIM! Processamento concluído em {tempo_total:.1f} minutos.")
+    if not args.sem_importacao:
+        print(f" Total de empresas importadas: {total_geral:,}")
 
+    con.close()
 
-# FINALIZAÇÃO
-tempo_total = (time.time() - inicio_geral) / 60
-print(f"\n FIM! Processamento concluído em {tempo_total:.1f} minutos.")
-print(f" Total de empresas importadas: {total_geral:,}")
 
-con.close()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+"""Configurações lidas das variáveis de ambiente."""
+import os
+
+# Caminho do banco analítico (dados da Receita)
+DB_FILE = os.getenv("HUNTER_DB", "hunter_leads.db")
+
+# Banco pequeno só com o CRM, anexado ao analítico
+CRM_DB_FILE = os.getenv("HUNTER_CRM_DB", "hunter_crm.db")
+
+# Modo serviço: HUNTER_SOMENTE_LEITURA=1 abre o banco da Receita em read_only, permitindo
+# vários processos do Streamlit (atrás de um proxy) lendo o mesmo arquivo.
+# O CRM continua editável: cada escrita abre uma conexão curta só com o arquivo do CRM.
+SOMENTE_LEITURA = os.getenv("HUNTER_SOMENTE_LEITURA", "0") == "1"
+
+# Limite (em MB) do cache de resultados das buscas do repository (0 desliga)
+CACHE_RESULTADOS_MB = int(os.getenv("HUNTER_CACHE_MB", "256"))
@@ -0,0 +1,95 @@
+"""
+Cache em memória dos resultados das buscas do repository, sem depender do Streamlit
+(vale também para scripts). Limitado pelo total de bytes, com descarte LRU.
+
+A chave leva a versão da base da Receita: quando a base é recriada a versão muda,
+e o cache antigo é descartado por inteiro na próxima consulta.
+Os resultados são compartilhados entre as chamadas: quem for alterar, copie antes.
+"""
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any
+
+import pandas as pd
+
+from src.config.settings import CACHE_RESULTADOS_MB
+
+LIMITE_BYTES = CACHE_RESULTADOS_MB * 1024 * 1024
+
+_itens: OrderedDict[Any, tuple[Any, int]] = OrderedDict()  # chave -> (valor, bytes), do menos para o mais usado
+_bytes = 0
+_versao: Any = None
+_contadores = {'acertos': 0, 'falhas': 0, 'descartes': 0}
+_trava = threading.Lock()
+
+
+def _tamanho(valor) -> int:
+    """Bytes aproximados do resultado (DataFrames medidos pelo pandas)."""
+    if isinstance(valor, pd.DataFrame):
+        return int(valor.memory_usage(deep=True).sum())
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(_tamanho(v) for v in valor.values())
+    if hasattr(valor, 'df'):  # ResultadoEmpresas / LeadBatch
+        return _tamanho(valor.df)
+    return sys.getsizeof(valor)
+
+
+def _descartar_tudo():
+    global _bytes
+    _itens.clear()
+    _bytes = 0
+
+
+def buscar_em_cache(versao, chave, calcular):
+    """
+    Devolve o resultado guardado para (versao, chave) ou calcula com calcular() e guarda.
+    Se calcular() levantar erro nada é guardado. Resultados maiores que o limite não entram.
+    """
+    global _bytes, _versao
+    with _trava:
+        if versao != _versao:
+            _descartar_tudo()
+            _versao = versao
+        if chave in _itens:
+            _itens.move_to_end(chave)
+            _contadores['acertos'] += 1
+            return _itens[chave][0]
+        _contadores['falhas'] += 1
+
+    valor = calcular()
+    tamanho = _tamanho(valor)
+    if tamanho > LIMITE_BYTES:
+        return valor
+
+    with _trava:
+        if versao != _versao:  # a base mudou enquanto calculava
+            return valor
+        if chave in _itens:
+            _bytes -= _itens.pop(chave)[1]
+        _itens[chave] = (valor, tamanho)
+        _bytes += tamanho
+        while _bytes > LIMITE_BYTES:
+            _, (_, liberado) = _itens.popitem(last=False)
+            _bytes -= liberado
+            _contadores['descartes'] += 1
+    return valor
+
+
+def limpar_cache():
+    """Esvazia o cache e zera os contadores."""
+    with _trava:
+        _descartar_tudo()
+        for nome in _contadores:
+            _contadores[nome] = 0
+
+
+def estatisticas_cache() -> dict:
+    """Acertos, falhas e descartes desde o início, mais itens e bytes ocupados agora."""
+    with _trava:
+        return {
+            **_contadores,
+            'itens': len(_itens),
+            'bytes': _bytes,
+            'limite_bytes': LIMITE_BYTES,
+        }
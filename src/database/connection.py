@@ -1,16 +1,154 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 import duckdb
 import streamlit as st
 
+from src.config.settings import CRM_DB_FILE, DB_FILE, SOMENTE_LEITURA
+from src.database.schema import CRM_ALIAS, ler_versao
+
+# Uma única instância do DuckDB por processo: o cache de páginas e o catálogo
+# ficam quentes entre as buscas e as sessões do Streamlit não disputam o arquivo.
+_instancia = None
+_geracao = 0  # sobe a cada instância aberta (ex: depois de fechar_instancia)
+_trava = threading.Lock()
+
+# Modo serviço: o CRM não fica anexado à instância (a trava do arquivo impediria
+# qualquer processo de escrever). Cada acesso abre uma conexão curta só para ele.
+# Duas conexões do mesmo processo não podem anexar o mesmo arquivo: uma de cada vez.
+_trava_crm = threading.Lock()
+TENTATIVAS_TRAVA_CRM = 20
+ESPERA_TRAVA_CRM = 0.1  # segundos; dobra a cada tentativa, até 2s
+
+
+def _obter_instancia():
+    global _instancia, _geracao
+    with _trava:
+        if _instancia is None:
+            _instancia = duckdb.connect(DB_FILE, read_only=SOMENTE_LEITURA)
+            _anexar_crm(_instancia)
+            _geracao += 1
+        return _instancia
+
+
+def geracao_instancia() -> int:
+    """Identifica a instância aberta: o que for memorizado por instância usa isso na chave."""
+    return _geracao
+
+
+def _anexar_crm(instancia):
+    """Anexa o banco do CRM para permitir JOIN com os estabelecimentos (só no modo normal)."""
+    if SOMENTE_LEITURA:
+        return
+    instancia.execute(f"ATTACH IF NOT EXISTS '{CRM_DB_FILE}' AS {CRM_ALIAS}")
+
+
+def _abrir_conexao_crm(escrita):
+    """
+    Conexão curta do modo serviço: a base da Receita em read_only (tabelas sem prefixo,
+    como na instância compartilhada) e o CRM anexado como CRM_ALIAS.
+    Se outro processo estiver com o arquivo do CRM, tenta de novo por alguns segundos.
+    """
+    con = duckdb.connect()
+    try:
+        con.execute(f"ATTACH '{DB_FILE}' AS receita (READ_ONLY)")
+        con.execute("USE receita")
+        # Leitura em read_only, a não ser que o arquivo ainda não exista (aí é criado)
+        modo = "" if escrita or not os.path.exists(CRM_DB_FILE) else " (READ_ONLY)"
+        espera = ESPERA_TRAVA_CRM
+        for tentativa in range(TENTATIVAS_TRAVA_CRM):
+            try:
+                con.execute(f"ATTACH '{CRM_DB_FILE}' AS {CRM_ALIAS}{modo}")
+                return con
+            except duckdb.IOException as e:
+                if "lock" not in str(e).lower() or tentativa == TENTATIVAS_TRAVA_CRM - 1:
+                    raise
+                time.sleep(espera)
+                espera = min(espera * 2, 2)
+    except Exception:
+        con.close()
+        raise
+
+
+def fechar_instancia():
+    """Fecha a instância compartilhada (ex: antes de recriar o banco)."""
+    global _instancia
+    with _trava:
+        if _instancia is not None:
+            _instancia.close()
+            _instancia = None
+
+
 def get_connection():
     """
-    Cria uma conexão com o banco DuckDB.
-    Configura read_only=False para permitir criar tabelas e salvar CRM.
+    Devolve um cursor da instância compartilhada do DuckDB.
+    Cada cursor é independente (pode ser usado em outra thread) e fechá-lo
+    não fecha o banco. Prefira o context manager conexao().
     """
     try:
-        
-        con = duckdb.connect("hunter_leads.db", read_only=False)
-        return con
+        return _obter_instancia().cursor()
     except Exception as e:
         st.error(f" Erro ao conectar no banco: {e}")
         st.warning("Dica: Verifique se o banco não está aberto em outro programa (DBeaver, terminal, etc).")
-        return None
\ No newline at end of file
+        return None
+
+
+@contextmanager
+def conexao():
+    """
+    Uso: with conexao() as con: ...
+    Entrega um cursor por requisição (ou None se o banco não abriu) e o fecha no final.
+    """
+    con = get_connection()
+    try:
+        yield con
+    finally:
+        if con:
+            con.close()
+
+
+@contextmanager
+def conexao_crm(escrita=False):
+    """
+    Uso: with conexao_crm() as con: ...  (escrita=True para alterar o CRM)
+    Conexão com o CRM anexado como CRM_ALIAS e a base da Receita sem prefixo.
+    No modo normal é um cursor da instância compartilhada. No modo serviço é uma conexão
+    curta, que só trava o arquivo do CRM enquanto dura. Entrega None se não abrir.
+    """
+    if not SOMENTE_LEITURA:
+        with conexao() as con:
+            yield con
+        return
+    with _trava_crm:
+        try:
+            con = _abrir_conexao_crm(escrita)
+        except Exception as e:
+            st.error(f" Erro ao abrir o banco do CRM: {e}")
+            yield None
+            return
+        try:
+            yield con
+        finally:
+            con.close()
+
+
+@contextmanager
+def conexao_escrita():
+    """Caminho das escritas (CRM). Uso: with conexao_escrita() as con: ..."""
+    with conexao_crm(escrita=True) as con:
+        yield con
+
+
+def versao_dados():
+    """
+    (versão da base da Receita, versão do CRM). Use como parte da chave dos caches:
+    qualquer escrita em outra sessão/processo muda o par e o cache antigo deixa de ser usado.
+    """
+    with conexao() as con:
+        if not con:
+            return (0, 0)
+        versao_receita = ler_versao(con, 'main')
+    with conexao_crm() as con:
+        return (versao_receita, ler_versao(con, CRM_ALIAS) if con else 0)
@@ -1,297 +1,462 @@
-from src.database.connection import get_connection
+from src.config.settings import SOMENTE_LEITURA
+from src.database.connection import conexao_crm, conexao_escrita, versao_dados
+from src.database.schema import (
+    CRM_ALIAS,
+    STATUS_CRM,
+    TABELA_CRM,
+    TABELA_CRM_ENRIQUECIDO,
+    TABELA_CRM_EVENTOS,
+    TABELA_CRM_FUNIL,
+    TIPO_STATUS_CRM,
+    atualizar_crm_enriquecido,
+    incrementar_versao,
+    preencher_crm_enriquecido,
+    sql_normalizar_status,
+    tabela_existe,
+)
 import streamlit as st
 import pandas as pd
 
+# Modo serviço: inicializa uma vez por processo (cada vez travaria o arquivo do CRM para escrita)
+_crm_inicializado = False
+
 def inicializar_crm():
     """Cria a tabela CRM e índices para performance."""
-    con = get_connection()
-    if not con: return
-    try:
+    global _crm_inicializado
+    if SOMENTE_LEITURA and _crm_inicializado:
+        return
+    with conexao_escrita() as con:
+        if not con: return
+        try:
+            opcoes_status = ", ".join(f"'{s}'" for s in STATUS_CRM)
+            con.execute(f"CREATE TYPE IF NOT EXISTS {TIPO_STATUS_CRM} AS ENUM ({opcoes_status})")
+        
+            con.execute(f"""
+                CREATE TABLE IF NOT EXISTS {TABELA_CRM} (
+                    cnpj TEXT PRIMARY KEY,
+                    status {TIPO_STATUS_CRM} DEFAULT 'Novo',
+                    anotacao TEXT,
+                    valor DECIMAL(10,2) DEFAULT 0.0,
+                    data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    data_atualizacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
         
-        con.execute("""
-            CREATE TABLE IF NOT EXISTS crm (
-                cnpj TEXT PRIMARY KEY,
-                status TEXT DEFAULT 'Novo',
-                anotacao TEXT,
-                valor DECIMAL(10,2) DEFAULT 0.0,
-                data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                data_atualizacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+       
+            # O índice em data_atualizacao não ajuda o ORDER BY no DuckDB e deixava cada
+            # UPDATE em lote muito lento (a coluna muda em todo salvamento). Remove se existir.
+            try:
+                con.execute("DROP INDEX IF EXISTS crm_db.idx_crm_data_atualizacao")
+            except:
+                pass  
+
+            if not SOMENTE_LEITURA:  # no modo serviço a base da Receita está em read_only
+                _migrar_crm_legado(con)
+            _converter_status_para_enum(con)
+            # Falha no histórico não impede o crm_enriched abaixo (sem ele o pipeline não abre)
+            try:
+                _criar_historico(con)
+            except Exception as e:
+                print(f"Erro ao criar o histórico do CRM: {e}")
+
+            # Primeira execução com crm_enriched (ou sem a coluna uf): preenche a partir do CRM
+            desatualizado = not con.execute(
+                "SELECT COUNT(*) FROM duckdb_columns() WHERE database_name = ? "
+                "AND table_name = 'crm_enriched' AND column_name = 'uf'",
+                [CRM_ALIAS]
+            ).fetchone()[0]
+            if desatualizado:
+                atualizar_crm_enriquecido(con)
+            _crm_inicializado = True
+        
+        except Exception as e:
+            print(f"Erro ao inicializar CRM: {e}")
+
+def _migrar_crm_legado(con):
+    """
+    Migração única: bancos antigos guardavam a tabela crm dentro do hunter_leads.db.
+    Copia os leads para o banco do CRM e remove a tabela antiga.
+    """
+    if not tabela_existe(con, 'crm'):
+        return
+    # Dois comandos separados: o DuckDB não escreve em dois bancos na mesma transação.
+    # Se o DROP falhar, a próxima execução repete a cópia sem duplicar (OR IGNORE).
+    con.execute(f"""
+        INSERT OR IGNORE INTO {TABELA_CRM} BY NAME
+        SELECT * REPLACE ({sql_normalizar_status('status')} AS status) FROM main.crm
+    """)
+    con.execute("DROP TABLE main.crm")
+    print(f"CRM migrado para o banco próprio ({TABELA_CRM}).")
+
+def _converter_status_para_enum(con):
+    """CRMs criados com status TEXT passam para o ENUM, normalizando o texto livre."""
+    tipo = con.execute(
+        "SELECT data_type FROM duckdb_columns() WHERE database_name = ? "
+        "AND table_name = 'crm' AND column_name = 'status'",
+        [CRM_ALIAS]
+    ).fetchone()
+    if tipo and tipo[0] == 'VARCHAR':
+        con.execute(f"""
+            ALTER TABLE {TABELA_CRM} ALTER status TYPE {TIPO_STATUS_CRM}
+            USING ({sql_normalizar_status('status')})
+        """)
+        con.execute(f"ALTER TABLE {TABELA_CRM} ALTER status SET DEFAULT 'Novo'")
+
+def _criar_historico(con):
+    """
+    Cria o log de eventos e o funil diário. Na primeira vez, monta o histórico
+    inicial a partir do estado atual (entrada em data_criacao e a fase atual em
+    data_atualizacao) e calcula o funil a partir dele.
+    """
+    existia = con.execute(
+        "SELECT COUNT(*) FROM duckdb_tables() WHERE database_name = ? AND table_name = 'crm_eventos'",
+        [CRM_ALIAS]
+    ).fetchone()[0]
+    if existia:
+        return
+
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"""
+            CREATE TABLE {TABELA_CRM_EVENTOS} (
+                data TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                cnpj TEXT,
+                status_anterior {TIPO_STATUS_CRM},  -- NULL = lead entrou no CRM
+                status {TIPO_STATUS_CRM},
+                valor DECIMAL(10,2)
             )
         """)
-        
-       
-        try:
-            con.execute("CREATE INDEX IF NOT EXISTS idx_crm_data_atualizacao ON crm(data_atualizacao DESC)")
-        except:
-            pass  
-        
-        con.close()
-    except Exception as e:
-        if con:
-            con.close()
-        print(f"Erro ao inicializar CRM: {e}")
+        con.execute(f"""
+            CREATE TABLE IF NOT EXISTS {TABELA_CRM_FUNIL} (
+                dia DATE,
+                status {TIPO_STATUS_CRM},
+                entradas BIGINT,       -- leads que passaram para esta fase no dia
+                valor DECIMAL(18,2),   -- valor desses leads no momento da mudança
+                PRIMARY KEY (dia, status)
+            )
+        """)
+        # CRMs antigos podem ter datas nulas; o funil precisa de um dia para cada evento
+        historico = f"""(
+            SELECT COALESCE(data_criacao, data_atualizacao, CURRENT_TIMESTAMP) AS data,
+                   cnpj, NULL AS status_anterior, 'Novo' AS status, 0 AS valor
+            FROM {TABELA_CRM}
+            UNION ALL
+            SELECT COALESCE(data_atualizacao, data_criacao, CURRENT_TIMESTAMP), cnpj, 'Novo', status, valor
+            FROM {TABELA_CRM}
+            WHERE status != 'Novo'
+        )"""
+        _registrar_eventos(con, historico)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
+def _registrar_eventos(con, eventos_sql):
+    """
+    Grava eventos (data, cnpj, status_anterior, status, valor) no log e soma no funil
+    diário só o que eles trazem, sem reler o histórico. Rodar na mesma transação da escrita.
+    """
+    con.execute(f"""
+        INSERT INTO {TABELA_CRM_EVENTOS} (data, cnpj, status_anterior, status, valor)
+        SELECT data, cnpj, status_anterior, status, valor FROM {eventos_sql}
+    """)
+    con.execute(f"""
+        INSERT INTO {TABELA_CRM_FUNIL} (dia, status, entradas, valor)
+        SELECT CAST(data AS DATE), status, COUNT(*), COALESCE(SUM(valor), 0)
+        FROM {eventos_sql}
+        WHERE status_anterior IS DISTINCT FROM status
+        GROUP BY ALL
+        ON CONFLICT DO UPDATE SET
+            entradas = entradas + excluded.entradas,
+            valor = valor + excluded.valor
+    """)
 
 def adicionar_lista_ao_crm(lista_leads):
     """
     Recebe uma lista de dicionários (leads) e salva apenas o CNPJ na tabela CRM.
     Usa 'INSERT OR IGNORE' para não duplicar se você selecionar o mesmo cara duas vezes.
-    OTIMIZADO: Limpa cache após adicionar.
+    Já grava nome, telefone, email e local em crm_enriched para a aba do pipeline.
+    OTIMIZADO: sobe a versão do CRM, o que invalida os caches de todas as sessões.
     """
-    con = get_connection()
-    if not con: return False
-    
     inicializar_crm()
-    try:
-       
-        dados = [(l['cnpj'], 'Novo', '', 0.0) for l in lista_leads]
-        
-       
-        con.executemany("""
-            INSERT OR IGNORE INTO crm (cnpj, status, anotacao, valor) 
-            VALUES (?, ?, ?, ?)
-        """, dados)
-        
-        con.close()
-        
-       
-        _buscar_pipeline_interno.clear()
-        
-        return True
-    except Exception as e:
-        st.error(f"Erro ao importar: {e}")
-        return False
+    with conexao_escrita() as con:
+        if not con: return False
+    
+        try:
+            con.execute("BEGIN TRANSACTION")
+            con.register('lote_novos', pd.DataFrame({'cnpj': [l['cnpj'] for l in lista_leads]}))
+            # Evento de entrada só para quem ainda não estava no CRM
+            _registrar_eventos(con, f"""(
+                SELECT DISTINCT CURRENT_TIMESTAMP AS data, cnpj, NULL AS status_anterior,
+                       'Novo' AS status, 0 AS valor
+                FROM lote_novos
+                WHERE cnpj NOT IN (SELECT cnpj FROM {TABELA_CRM})
+            )""")
+            con.execute(f"""
+                INSERT OR IGNORE INTO {TABELA_CRM} (cnpj, status, anotacao, valor) 
+                SELECT DISTINCT cnpj, 'Novo', '', 0.0 FROM lote_novos
+            """)
+            # Nomes e versão na mesma transação: nenhuma sessão guarda em cache a lista
+            # sem os nomes, e uma falha não deixa dado novo com a versão antiga
+            preencher_crm_enriquecido(con, 'lote_novos')
+            incrementar_versao(con, CRM_ALIAS)
+            con.execute("COMMIT")
+            con.unregister('lote_novos')
+        
+            return True
+        except Exception as e:
+            con.execute("ROLLBACK")
+            st.error(f"Erro ao importar: {e}")
+            return False
 
 def atualizar_lead_crm(cnpj, campo, valor):
-    """Atualiza um campo específico (ex: mudar só o status)."""
-    con = get_connection()
-    if not con: return False
-    try:
-       
-        campos_permitidos = ['status', 'valor', 'anotacao']
-        if campo not in campos_permitidos:
+    """
+    Atualiza um campo específico (ex: mudar só o status).
+    Passa pelo atualizar_leads_em_lote para registrar o evento no histórico.
+    """
+    campos_permitidos = ['status', 'valor', 'anotacao']
+    if campo not in campos_permitidos:
+        return False
+
+    with conexao_crm() as con:
+        if not con: return False
+        try:
+            atual = con.execute(
+                f"SELECT CAST(status AS VARCHAR), valor, anotacao FROM {TABELA_CRM} WHERE cnpj = ?", [cnpj]
+            ).fetchone()
+        except Exception as e:
+            print(f"Erro ao atualizar {campo}: {e}")
             return False
-        
-        query = f"UPDATE crm SET {campo} = ?, data_atualizacao = CURRENT_TIMESTAMP WHERE cnpj = ?"
-        con.execute(query, [valor, cnpj])
-        con.close()
-        return True
-    except Exception as e:
-        if con:
-            con.close()
-        print(f"Erro ao atualizar {campo}: {e}")
+    if not atual:
         return False
 
+    lead = dict(zip(campos_permitidos, atual))
+    lead[campo] = valor
+    return atualizar_leads_em_lote([(cnpj, lead['status'], lead['valor'], lead['anotacao'])])
+
 def atualizar_leads_em_lote(updates):
     """
     Atualiza múltiplos leads de uma vez (muito mais rápido).
     Recebe lista de tuplas: [(cnpj, status, valor, anotacao), ...]
-    OTIMIZADO: Limpa cache após atualização.
+    OTIMIZADO: o lote vira um DataFrame registrado no DuckDB e é aplicado
+    com um único UPDATE ... FROM. Mudanças de status/valor vão para o histórico
+    na mesma transação, junto com a versão do CRM (invalida os caches).
     """
-    con = get_connection()
-    if not con: return False
-    
-    try:
-        con.execute("BEGIN TRANSACTION")
-        
-        for cnpj, status, valor, anotacao in updates:
-            con.execute("""
-                UPDATE crm 
-                SET status = ?, valor = ?, anotacao = ?, data_atualizacao = CURRENT_TIMESTAMP 
-                WHERE cnpj = ?
-            """, [status, valor, anotacao, cnpj])
-        
-        con.execute("COMMIT")
-        con.close()
-        
-        
-        _buscar_pipeline_interno.clear()
-        
+    if not updates:
         return True
-    except Exception as e:
-        if con:
+
+    with conexao_escrita() as con:
+        if not con: return False
+    
+        try:
+            # BEGIN primeiro: qualquer erro daqui em diante cai no ROLLBACK
+            con.execute("BEGIN TRANSACTION")
+            df_lote = pd.DataFrame(updates, columns=['cnpj', 'status', 'valor', 'anotacao'])
+            con.register('lote_crm', df_lote)
+            # Antes do UPDATE: compara com o estado atual para saber o que mudou
+            _registrar_eventos(con, f"""(
+                SELECT CURRENT_TIMESTAMP AS data, l.cnpj, c.status AS status_anterior,
+                       CAST(l.status AS {TIPO_STATUS_CRM}) AS status,
+                       CAST(l.valor AS DECIMAL(10,2)) AS valor
+                FROM lote_crm l
+                JOIN {TABELA_CRM} c ON c.cnpj = l.cnpj
+                WHERE c.status IS DISTINCT FROM CAST(l.status AS {TIPO_STATUS_CRM})
+                   OR c.valor IS DISTINCT FROM CAST(l.valor AS DECIMAL(10,2))
+            )""")
+            con.execute(f"""
+                UPDATE {TABELA_CRM} AS crm
+                SET status = l.status,
+                    valor = CAST(l.valor AS DECIMAL(10,2)),
+                    anotacao = l.anotacao,
+                    data_atualizacao = CURRENT_TIMESTAMP
+                FROM lote_crm l
+                WHERE crm.cnpj = l.cnpj
+            """)
+            incrementar_versao(con, CRM_ALIAS)
+            con.execute("COMMIT")
+            con.unregister('lote_crm')
+        
+            return True
+        except Exception as e:
             con.execute("ROLLBACK")
-            con.close()
-        print(f"Erro ao atualizar em lote: {e}")
-        return False
+            print(f"Erro ao atualizar em lote: {e}")
+            return False
+
+# Ordenações da aba do pipeline: (expressão da chave, direção). O desempate é sempre pelo cnpj.
+# A chave nunca é nula: o cursor compara com < / =, e NULL sumiria das páginas seguintes
+# (CRMs antigos têm datas nulas).
+DATA_PIPELINE = "COALESCE(c.data_atualizacao, c.data_criacao, TIMESTAMP '1970-01-01')"
+ORDENS_PIPELINE = {
+    "Mais recentes": (DATA_PIPELINE, "DESC"),
+    "Mais antigos": (DATA_PIPELINE, "ASC"),
+    "Maior valor": ("COALESCE(c.valor, 0)", "DESC"),
+}
+TAMANHO_PAGINA_PIPELINE = 500
 
-@st.cache_data(ttl=300, show_spinner=False)  
-def _buscar_pipeline_interno():
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def _buscar_pipeline_interno(versao, status=None, uf=None, texto=None, ordem="Mais recentes",
+                             apos=None, tamanho=TAMANHO_PAGINA_PIPELINE):
     """
-    Função interna com cache do Streamlit.
-    Cache de 5 minutos para evitar queries repetidas.
-    OTIMIZADO: Query mais rápida, apenas colunas necessárias.
+    Função interna com cache do Streamlit, chaveado pela versão dos dados:
+    vale até alguém escrever no CRM (ou recriar a base), sem TTL nem clear().
+    OTIMIZADO: lê só uma página (paginação por keyset em chave de ordenação + cnpj)
+    de crm + crm_enriched, sem JOIN com estabelecimentos.
+    Retorna (df, proximo) onde proximo é o cursor da página seguinte ou None.
     """
     inicializar_crm() 
 
-    con = get_connection()
-    if not con: return pd.DataFrame()
+    with conexao_crm() as con:
+        if not con: return pd.DataFrame(), None
     
-    try:
-        
-        
-        query_crm = """
-            SELECT 
-                cnpj,
-                status,
-                valor,
-                anotacao,
-                data_atualizacao
-            FROM crm
-            ORDER BY data_atualizacao DESC
-            LIMIT 10000
-        """
-        
-        df_crm = con.execute(query_crm).df()
-        
-        if df_crm.empty:
-            con.close()
-            return pd.DataFrame()
-        
-        
-        
-        if len(df_crm) > 0:
-            
-            query_estab = """
+        try:
+            chave, direcao = ORDENS_PIPELINE.get(ordem, ORDENS_PIPELINE["Mais recentes"])
+            filtros = ""
+            params = []
+
+            if status:
+                filtros += f" AND c.status IN ({', '.join('?' for _ in status)})"
+                params += list(status)
+            if uf and uf != "TODAS":
+                filtros += " AND x.uf = ?"
+                params.append(uf)
+            if texto:
+                filtros += """ AND (x.nome_fantasia ILIKE ? OR c.cnpj LIKE ?
+                                    OR c.anotacao ILIKE ? OR x.local ILIKE ?)"""
+                params += [f"%{texto}%"] * 4
+            if apos is not None:
+                comparador = "<" if direcao == "DESC" else ">"
+                filtros += f" AND ({chave} {comparador} ? OR ({chave} = ? AND c.cnpj {comparador} ?))"
+                params += [apos[0], apos[0], apos[1]]
+
+            query = f"""
                 SELECT 
-                    (e.cnpj_basico || e.cnpj_ordem || e.cnpj_dv) AS cnpj,
-                    e.nome_fantasia,
-                    e.ddd_1,
-                    e.telefone_1,
-                    e.correio_eletronico AS email,
-                    e.uf,
-                    e.municipio
-                FROM estabelecimentos e
-                INNER JOIN (
-                    SELECT cnpj FROM crm ORDER BY data_atualizacao DESC LIMIT 10000
-                ) c ON (e.cnpj_basico || e.cnpj_ordem || e.cnpj_dv) = c.cnpj
+                    c.cnpj,
+                    x.nome_fantasia,
+                    CAST(c.status AS VARCHAR) AS status,
+                    c.valor,
+                    c.anotacao,
+                    COALESCE(x.telefone, '') AS telefone,
+                    x.email,
+                    COALESCE(x.local, 'N/A') AS local,
+                    {chave} AS _chave
+                FROM {TABELA_CRM} c
+                LEFT JOIN {TABELA_CRM_ENRIQUECIDO} x ON x.cnpj = c.cnpj
+                WHERE TRUE {filtros}
+                ORDER BY {chave} {direcao}, c.cnpj {direcao}
+                LIMIT ?
             """
-            
-            try:
-                df_estab = con.execute(query_estab).df()
-            except Exception as e:
-                
-                print(f"Erro ao buscar estabelecimentos: {e}")
-                df_estab = pd.DataFrame()
-        else:
-            df_estab = pd.DataFrame()
-        
-        
-        df_municipios = pd.DataFrame()
-        try:
-            if not df_estab.empty and 'municipio' in df_estab.columns:
-                municipios_codigos = df_estab['municipio'].dropna().unique().tolist()
-                if municipios_codigos:
-                    query_mun = f"""
-                        SELECT codigo, descricao
-                        FROM municipios
-                        WHERE codigo IN ({','.join([f"'{m}'" for m in municipios_codigos[:500]])})
-                    """
-                    try:
-                        df_municipios = con.execute(query_mun).df()
-                    except:
-                        pass
-        except:
-            pass
-        
-        con.close()
-        
-        
-        df = df_crm.copy()
-        
-        if not df_estab.empty:
-            df = df.merge(df_estab, on='cnpj', how='left')
-            
-            
-            df['telefone'] = df.apply(
-                lambda row: f"{row['ddd_1']} {row['telefone_1']}" 
-                if pd.notna(row.get('ddd_1')) and pd.notna(row.get('telefone_1')) 
-                else '', axis=1
-            )
-            
-            
-            if not df_municipios.empty and 'municipio' in df.columns:
-                df = df.merge(df_municipios, left_on='municipio', right_on='codigo', how='left')
-                df['local'] = df.apply(
-                    lambda row: f"{row['descricao']}-{row['uf']}" 
-                    if pd.notna(row.get('descricao')) and pd.notna(row.get('uf'))
-                    else (row['uf'] if pd.notna(row.get('uf')) else 'N/A'), axis=1
-                )
-            else:
-                df['local'] = df['uf'].fillna('N/A')
-        else:
-            
-            df['nome_fantasia'] = 'N/A'
-            df['telefone'] = ''
-            df['email'] = ''
-            df['local'] = 'N/A'
-        
-        
-        colunas_esperadas = ['cnpj', 'nome_fantasia', 'status', 'valor', 'anotacao', 'telefone', 'email', 'local']
-        for col in colunas_esperadas:
-            if col not in df.columns:
-                df[col] = ''
+            # Uma linha a mais só para saber se existe próxima página
+            df = con.execute(query, params + [tamanho + 1]).df()
         
+            if df.empty:
+                return pd.DataFrame(), None
+
+            proximo = None
+            if len(df) > tamanho:
+                df = df.iloc[:tamanho]
+                proximo = (df['_chave'].iloc[-1], df['cnpj'].iloc[-1])
+            df = df.drop(columns=['_chave'])
         
-        df['valor'] = pd.to_numeric(df['valor'], errors='coerce').fillna(0.0)
-        df['status'] = df['status'].fillna('Novo')
-        df['anotacao'] = df['anotacao'].fillna('')
+            df['valor'] = pd.to_numeric(df['valor'], errors='coerce').fillna(0.0)
+            df['status'] = df['status'].fillna('Novo')
+            df['anotacao'] = df['anotacao'].fillna('')
         
-        return df[colunas_esperadas]  
+            return df, proximo
         
-    except Exception as e:
+        except Exception as e:
         
-        if con:
-            con.close()
-        print(f"Erro ao buscar pipeline: {e}")
-        return pd.DataFrame()
+            print(f"Erro ao buscar pipeline: {e}")
+            return pd.DataFrame(), None
 
-def buscar_meu_pipeline():
+def buscar_meu_pipeline(status=None, uf=None, texto=None, ordem="Mais recentes",
+                        apos=None, tamanho=TAMANHO_PAGINA_PIPELINE):
     """
-    Busca TODOS os leads que estão no CRM.
+    Busca uma página dos leads do CRM com filtros (status, UF, texto) e ordenação.
+    Passe em 'apos' o cursor devolvido pela página anterior.
     OTIMIZADO: Usa cache interno + session_state para máxima performance.
     """
-    return _buscar_pipeline_interno()
+    return _buscar_pipeline_interno(
+        versao_dados(), tuple(status) if status else None, uf, texto or None, ordem, apos, tamanho
+    )
+
+def resumo_pipeline():
+    """KPIs do CRM inteiro (não só da página carregada) e UFs presentes, para os filtros."""
+    return _resumo_pipeline(versao_dados())
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _resumo_pipeline(versao):
+    inicializar_crm()
+
+    with conexao_crm() as con:
+        if not con: return {}
+
+        try:
+            kpis = con.execute(f"""
+                SELECT
+                    COUNT(*) AS total,
+                    COALESCE(SUM(valor), 0) AS valor_total,
+                    COUNT(*) FILTER (WHERE status = 'Vendido') AS vendas,
+                    COALESCE(SUM(valor) FILTER (WHERE status = 'Vendido'), 0) AS valor_vendas,
+                    COUNT(*) FILTER (WHERE status = 'Em Negociação') AS em_negociacao,
+                    COALESCE(SUM(valor) FILTER (WHERE status = 'Em Negociação'), 0) AS valor_negociacao,
+                    COUNT(*) FILTER (WHERE status = 'Novo') AS novos
+                FROM {TABELA_CRM}
+            """).df().iloc[0].to_dict()
+            ufs = con.execute(f"""
+                SELECT DISTINCT x.uf
+                FROM {TABELA_CRM} c
+                JOIN {TABELA_CRM_ENRIQUECIDO} x ON x.cnpj = c.cnpj
+                WHERE x.uf IS NOT NULL
+                ORDER BY x.uf
+            """).fetchall()
+            kpis['ufs'] = [u[0] for u in ufs]
+            return kpis
+        except Exception as e:
+            print(f"Erro ao resumir pipeline: {e}")
+            return {}
+
+
 def excluir_do_crm(cnpj):
     """Remove um lead da tabela CRM pelo CNPJ."""
-    con = get_connection()
-    if not con: return False
+    with conexao_escrita() as con:
+        if not con: return False
     
-    try:
-        
-        con.execute("DELETE FROM crm WHERE cnpj = ?", [cnpj])
-        con.close()
-        return True
-    except Exception as e:
-        if con:
-            con.close()
-        print(f"Erro ao excluir: {e}")
-        return False
+        try:
+            con.execute("BEGIN TRANSACTION")
+            con.execute(f"DELETE FROM {TABELA_CRM} WHERE cnpj = ?", [cnpj])
+            con.execute(f"DELETE FROM {TABELA_CRM_ENRIQUECIDO} WHERE cnpj = ?", [cnpj])
+            incrementar_versao(con, CRM_ALIAS)
+            con.execute("COMMIT")
+            return True
+        except Exception as e:
+            con.execute("ROLLBACK")
+            print(f"Erro ao excluir: {e}")
+            return False
 
 def excluir_leads_em_lote(cnpjs):
     """
     Remove múltiplos leads de uma vez (mais rápido).
-    OTIMIZADO: Limpa cache após exclusão.
+    OTIMIZADO: um único DELETE com a lista de CNPJs registrada como tabela.
+    Sobe a versão do CRM na mesma transação.
     """
     if not cnpjs:
         return True
         
-    con = get_connection()
-    if not con: return False
+    with conexao_escrita() as con:
+        if not con: return False
     
-    try:
-        con.execute("BEGIN TRANSACTION")
-        for cnpj in cnpjs:
-            con.execute("DELETE FROM crm WHERE cnpj = ?", [cnpj])
-        con.execute("COMMIT")
-        con.close()
-        
-        
-        _buscar_pipeline_interno.clear()
-        
-        return True
-    except Exception as e:
-        if con:
+        try:
+            con.execute("BEGIN TRANSACTION")
+            con.register('lote_excluir', pd.DataFrame({'cnpj': list(cnpjs)}))
+            con.execute(f"DELETE FROM {TABELA_CRM} WHERE cnpj IN (SELECT cnpj FROM lote_excluir)")
+            con.execute(f"DELETE FROM {TABELA_CRM_ENRIQUECIDO} WHERE cnpj IN (SELECT cnpj FROM lote_excluir)")
+            incrementar_versao(con, CRM_ALIAS)
+            con.execute("COMMIT")
+            con.unregister('lote_excluir')
+        
+            return True
+        except Exception as e:
             con.execute("ROLLBACK")
-            con.close()
-        print(f"Erro ao excluir em lote: {e}")
-        return False
\ No newline at end of file
+            print(f"Erro ao excluir em lote: {e}")
+            return False
\ No newline at end of file
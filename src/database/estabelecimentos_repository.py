@@ -5,23 +5,113 @@ Todas as queries são parametrizadas para evitar SQL injection.
 from __future__ import annotations
 
 import os
-from datetime import date
 from time import perf_counter
+
+import pandas as pd
 from typing import List, Optional, Dict, Any
 
-from src.database.connection import get_connection
+from src.database.connection import conexao
+from src.database.municipios import resolver_municipios
+from src.models.lead import Lead, LeadBatch
+from src.database.schema import (
+    MATRIZ,
+    SITUACAO_ATIVA,
+    fonte_estabelecimentos_ativos,
+    normalizar_cnaes,
+    sql_cnae_formatado,
+)
 
 
 DEBUG_ROTA = os.getenv("DEBUG_ROTA", "0") == "1"
 
 
+def sql_leads_enriquecidos(
+    con,
+    lista_cnaes: List[str],
+    uf: Optional[str] = None,
+    cidade: Optional[str] = None,
+    somente_matriz: bool = False,
+) -> Optional[tuple[str, List[str | int | List[str]]]]:
+    """
+    Monta a consulta da busca enriquecida (sem LIMIT) e seus parâmetros.
+    Usada pela busca e pelas exportações via COPY (export_service).
+    
+    Returns:
+        (query, params) ou None se não houver CNAE válido
+    """
+    lista_cnaes_normalizada = normalizar_cnaes(lista_cnaes)
+    if not lista_cnaes_normalizada:
+        return None
+
+    placeholders_cnae = ", ".join(["?" for _ in lista_cnaes_normalizada])
+
+    params: List[str | int | List[str]] = list(lista_cnaes_normalizada)
+
+    filtro_uf = ""
+    if uf and uf != "BRASIL":
+        filtro_uf = "AND e.uf = ?"
+        params.append(uf)
+
+    filtro_cidade = ""
+    if cidade and cidade != "TODAS":
+        # Nome dentro da UF filtrada; sem UF entram todos os homônimos
+        codigos_cidade = resolver_municipios(con, [cidade], [uf] if uf and uf != "BRASIL" else None)
+    
+        if codigos_cidade:
+            filtro_cidade = "AND e.municipio = ANY(?)"
+            params.append(codigos_cidade)
+        
+            if DEBUG_ROTA:
+                count_municipio = con.execute(
+                    "SELECT COUNT(*) FROM estabelecimentos WHERE uf = ? AND municipio = ANY(?)",
+                    [uf, codigos_cidade]
+                ).fetchone()[0]
+                print(f"[DEBUG_ROTA] Total para cidade={cidade} (cod={codigos_cidade}): {count_municipio}")
+
+    filtro_matriz = ""
+    if somente_matriz:
+        filtro_matriz = "AND e.matriz_filial = ?"
+        params.append(MATRIZ)
+
+    query = f"""
+        SELECT 
+            e.cnpj,
+            e.cnpj_basico,
+            e.nome_fantasia,
+            {sql_cnae_formatado('e.cnae_principal')} AS cnae_principal,
+            c.descricao AS descricao_cnae,
+            CASE WHEN e.matriz_filial = {MATRIZ} THEN 'MATRIZ' ELSE 'FILIAL' END AS matriz_filial,
+            e.logradouro,
+            e.numero,
+            e.bairro,
+            e.cep,
+            e.complemento,
+            m.descricao AS cidade,
+            e.uf,
+            CASE WHEN NULLIF(e.ddd_1, '') IS NOT NULL AND NULLIF(e.telefone_1, '') IS NOT NULL
+                 THEN e.ddd_1 || ' ' || e.telefone_1 END AS telefone_principal,
+            CASE WHEN NULLIF(e.ddd_2, '') IS NOT NULL AND NULLIF(e.telefone_2, '') IS NOT NULL
+                 THEN e.ddd_2 || ' ' || e.telefone_2 END AS telefone_secundario,
+            e.correio_eletronico AS email,
+            e.data_inicio_atividade
+        FROM {fonte_estabelecimentos_ativos(con)} e
+        LEFT JOIN municipios m ON e.municipio = m.codigo
+        LEFT JOIN cnaes c ON e.cnae_principal = c.codigo
+        WHERE e.cnae_principal IN ({placeholders_cnae})
+        {filtro_uf}
+        {filtro_cidade}
+        {filtro_matriz}
+    """
+    return query, params
+
+
 def buscar_leads_enriquecidos(
     lista_cnaes: List[str],
     uf: Optional[str] = None,
     cidade: Optional[str] = None,
     somente_matriz: bool = False,
     limite: int = 50000
-) -> List[Lead]:
+) -> LeadBatch:
     """
     Busca leads enriquecidos com todos os dados necessários.
     
@@ -33,225 +123,65 @@ def buscar_leads_enriquecidos(
         limite: Limite de resultados
         
     Returns:
-        Lista de objetos Lead enriquecidos
+        LeadBatch (colunas do Lead/Endereco; cada lead[i] é um Lead montado na hora)
     """
     t0 = perf_counter()
-    con = get_connection()
-    if not con:
-        return []
+    with conexao() as con:
+        if not con:
+            return LeadBatch.vazio()
     
-    try:
-        t_conn = perf_counter() - t0
+        try:
+            t_conn = perf_counter() - t0
         
         
-        if DEBUG_ROTA:
-            count_total = con.execute("SELECT COUNT(*) FROM estabelecimentos").fetchone()[0]
-            print(f"[DEBUG_ROTA] Total em estabelecimentos: {count_total}")
+            if DEBUG_ROTA:
+                count_total = con.execute("SELECT COUNT(*) FROM estabelecimentos").fetchone()[0]
+                print(f"[DEBUG_ROTA] Total em estabelecimentos: {count_total}")
             
-            if uf and uf != "BRASIL":
-                count_uf = con.execute("SELECT COUNT(*) FROM estabelecimentos WHERE uf = ?", [uf]).fetchone()[0]
-                print(f"[DEBUG_ROTA] Total filtrado por UF={uf}: {count_uf}")
+                if uf and uf != "BRASIL":
+                    count_uf = con.execute("SELECT COUNT(*) FROM estabelecimentos WHERE uf = ?", [uf]).fetchone()[0]
+                    print(f"[DEBUG_ROTA] Total filtrado por UF={uf}: {count_uf}")
                 
-                count_uf_sit = con.execute(
-                    "SELECT COUNT(*) FROM estabelecimentos WHERE uf = ? AND situacao_cadastral = '02'", 
-                    [uf]
-                ).fetchone()[0]
-                print(f"[DEBUG_ROTA] Total filtrado por UF={uf} + situacao='02': {count_uf_sit}")
-        
-        
-        placeholders_cnae = ", ".join(["?" for _ in lista_cnaes])
-        
-        lista_cnaes_normalizada = [c.replace(".", "").replace("-", "").replace("/", "") for c in lista_cnaes]
-        
-        params: List[str | int] = list(lista_cnaes_normalizada)
-        
-        MUNICIPIO_CODE_LENGTH = 7
-        
-        filtro_uf = ""
-        if uf and uf != "BRASIL":
-            filtro_uf = "AND e.uf = ?"
-            params.append(uf)
-        
-        filtro_cidade = ""
-        if cidade and cidade != "TODAS":
-            codigo_cidade = con.execute(
-                "SELECT codigo FROM municipios WHERE TRIM(UPPER(descricao)) = TRIM(UPPER(?)) LIMIT 1",
-                [cidade]
-            ).fetchone()
-            
-            if codigo_cidade:
-                codigo_str = str(codigo_cidade[0]).strip()
-                codigo_normalizado = codigo_str.zfill(MUNICIPIO_CODE_LENGTH)
-                filtro_cidade = f"AND e.municipio_norm = ?"
-                params.append(codigo_normalizado)
-                
-                if DEBUG_ROTA:
-                       
-                    len_dist = con.execute(
-                        "SELECT LENGTH(CAST(municipio AS VARCHAR)) as len, COUNT(*) as cnt FROM estabelecimentos WHERE uf = ? GROUP BY len ORDER BY len",
-                        [uf]
-                    ).fetchall()
-                    len_dict = {row[0]: row[1] for row in len_dist[:10]}
-                    print(f"[DEBUG_ROTA] Distribuição LENGTH(municipio) para UF={uf}: {len_dict}")
-                    
-                    count_municipio = con.execute(
-                        f"SELECT COUNT(*) FROM estabelecimentos e JOIN municipios m ON LPAD(TRIM(CAST(e.municipio AS VARCHAR)), {MUNICIPIO_CODE_LENGTH}, '0') = LPAD(TRIM(CAST(m.codigo AS VARCHAR)), {MUNICIPIO_CODE_LENGTH}, '0') WHERE e.uf = ? AND LPAD(TRIM(CAST(m.codigo AS VARCHAR)), {MUNICIPIO_CODE_LENGTH}, '0') = LPAD(TRIM(CAST(? AS VARCHAR)), {MUNICIPIO_CODE_LENGTH}, '0')",
-                        [uf, codigo_str]
+                    count_uf_sit = con.execute(
+                        "SELECT COUNT(*) FROM estabelecimentos WHERE uf = ? AND situacao_cadastral = ?", 
+                        [uf, SITUACAO_ATIVA]
                     ).fetchone()[0]
-                    print(f"[DEBUG_ROTA] Total no JOIN municipios para cidade={cidade} (cod={codigo_str}): {count_municipio}")
-        
-        filtro_matriz = ""
-        if somente_matriz:
-            filtro_matriz = "AND e.matriz_filial = ?"
-            params.append("1")
-        
-        if DEBUG_ROTA:
-            debug_query = f"""
-                SELECT COUNT(*) FROM estabelecimentos e
-                WHERE REPLACE(REPLACE(REPLACE(e.cnae_principal, '.', ''), '-', ''), '/', '') IN ({placeholders_cnae})
-                AND e.situacao_cadastral = '02'
-                {filtro_uf}
-                {filtro_cidade}
-                {filtro_matriz}
-            """
-            debug_params = params[:-1] if limite in params else params
-            try:
-                count_final = con.execute(debug_query, debug_params).fetchone()[0]
-                print(f"[DEBUG_ROTA] Total com todos os filtros (antes JOINs): {count_final}")
-                print(f"[DEBUG_ROTA] CNAEs normalizados: {lista_cnaes_normalizada[:3]}... (total={len(lista_cnaes_normalizada)})")
-            except Exception as debug_e:
-                print(f"[DEBUG_ROTA] Erro na contagem debug: {debug_e}")
-        
-        t_query_start = perf_counter()
-        query = f"""
-            WITH estabelecimentos_norm AS (
-                SELECT 
-                    e.*,
-                    REPLACE(REPLACE(REPLACE(e.cnae_principal, '.', ''), '-', ''), '/', '') AS cnae_norm,
-                    LPAD(TRIM(CAST(e.municipio AS VARCHAR)), {MUNICIPIO_CODE_LENGTH}, '0') AS municipio_norm
-                FROM estabelecimentos e
-                WHERE e.situacao_cadastral = '02'
-                {filtro_uf}
-                {filtro_matriz}
-            )
-            SELECT 
-                e.cnpj_basico || e.cnpj_ordem || e.cnpj_dv AS cnpj,
-                e.cnpj_basico,
-                e.nome_fantasia,
-                e.cnae_principal,
-                c.descricao AS descricao_cnae,
-                e.matriz_filial,
-                e.logradouro,
-                e.numero,
-                e.bairro,
-                e.cep,
-                e.complemento,
-                m.descricao AS cidade,
-                e.uf,
-                e.ddd_1,
-                e.telefone_1,
-                e.ddd_2,
-                e.telefone_2,
-                e.correio_eletronico AS email,
-                e.data_inicio_atividade
-            FROM estabelecimentos_norm e
-            LEFT JOIN municipios m ON e.municipio_norm = LPAD(TRIM(CAST(m.codigo AS VARCHAR)), {MUNICIPIO_CODE_LENGTH}, '0')
-            LEFT JOIN cnaes c ON e.cnae_norm = REPLACE(REPLACE(REPLACE(c.codigo, '.', ''), '-', ''), '/', '')
-            WHERE e.cnae_norm IN ({placeholders_cnae})
-            {filtro_cidade}
-            LIMIT ?
-        """
-        
-        params.append(limite)
+                    print(f"[DEBUG_ROTA] Total filtrado por UF={uf} + situacao={SITUACAO_ATIVA}: {count_uf_sit}")
         
-        rows = con.execute(query, params).fetchall()
-        t_query = perf_counter() - t_query_start
+            consulta = sql_leads_enriquecidos(con, lista_cnaes, uf, cidade, somente_matriz)
+            if consulta is None:
+                return LeadBatch.vazio()
+            query, params = consulta
         
-        if DEBUG_ROTA:
-            print(f"[DEBUG_ROTA] Query retornou {len(rows)} linhas em {t_query:.2f}s (conn: {t_conn:.3f}s)")
-        
-        con.close()
-        
-        leads: List[Lead] = []
-        for row in rows:
-            endereco = None
-            if row[6]:  # logradouro
-                endereco = Endereco(
-                    logradouro=row[6] or "",
-                    numero=row[7] or "",
-                    bairro=row[8] or "",
-                    cep=row[9] or "",
-                    complemento=row[10] or None,
-                    cidade=row[11] or "",
-                    uf=row[12] or ""
-                )
-            
-            # Formata telefones
-            telefone_principal = None
-            if row[13] and row[14]:  # ddd_1 e telefone_1
-                telefone_principal = f"{row[13]} {row[14]}"
-            
-            telefone_secundario = None
-            if row[15] and row[16]:  # ddd_2 e telefone_2
-                telefone_secundario = f"{row[15]} {row[16]}"
-            
-            # Converte data de início de atividade
-            data_inicio = None
-            if row[18]:
+            if DEBUG_ROTA:
                 try:
-                    
-                    data_str = str(row[18])
-                    if len(data_str) == 8:
-                        data_inicio = date(
-                            int(data_str[0:4]),
-                            int(data_str[4:6]),
-                            int(data_str[6:8])
-                        )
-                    else:
-                        from datetime import datetime
-                        data_inicio = datetime.fromisoformat(str(row[18])).date()
-                except (ValueError, TypeError):
-                    pass
-            
-            matriz_filial = "MATRIZ" if row[5] == "1" else "FILIAL"
-            
-            lead = Lead(
-                cnpj=row[0],
-                cnpj_basico=row[1],
-                nome_fantasia=row[2] or "",
-                razao_social=None,
-                cnae_principal=row[3],
-                descricao_cnae=row[4] or "",
-                matriz_filial=matriz_filial,
-                endereco=endereco,
-                cidade=row[11] or "",
-                uf=row[12] or "",
-                telefone_principal=telefone_principal,
-                telefone_secundario=telefone_secundario,
-                email=row[17] or None,
-                data_inicio_atividade=data_inicio
-            )
-            
-            leads.append(lead)
-        
-        t_map = perf_counter() - t_map_start
-        t_total = perf_counter() - t0
-        
-        if DEBUG_ROTA:
-            print(f"[DEBUG_ROTA] Mapeamento: {t_map:.2f}s | Total: {t_total:.2f}s | Leads: {len(leads)}")
-        
-        return leads
-        
-    except Exception as e:
-        if con:
-            con.close()
-        print(f"Erro ao buscar leads enriquecidos: {e} -- params_len={len(params) if 'params' in locals() else 'n/a'}")
-        import traceback
-        traceback.print_exc()
-        return []
+                    count_final = con.execute(f"SELECT COUNT(*) FROM ({query})", params).fetchone()[0]
+                    print(f"[DEBUG_ROTA] Total com todos os filtros: {count_final}")
+                except Exception as debug_e:
+                    print(f"[DEBUG_ROTA] Erro na contagem debug: {debug_e}")
+        
+            t_query_start = perf_counter()
+            query += "\n                LIMIT ?"
+            params.append(limite)
+        
+            # Resultado em colunas (telefones e matriz/filial já formatados no SQL)
+            df = con.execute(query, params).df()
+            t_query = perf_counter() - t_query_start
+            t_total = perf_counter() - t0
+        
+            if DEBUG_ROTA:
+                print(f"[DEBUG_ROTA] Query retornou {len(df)} linhas em {t_query:.2f}s (conn: {t_conn:.3f}s) | Total: {t_total:.2f}s")
+        
+            return LeadBatch(df)
+        
+        except Exception as e:
+            print(f"Erro ao buscar leads enriquecidos: {e} -- params_len={len(params) if 'params' in locals() else 'n/a'}")
+            import traceback
+            traceback.print_exc()
+            return LeadBatch.vazio()
 
 
-def dedupe_leads_por_cnpj_basico(leads: List[Lead]) -> List[Lead]:
+def dedupe_leads_por_cnpj_basico(leads: LeadBatch | List[Lead]) -> LeadBatch | List[Lead]:
     """
     Remove duplicatas por CNPJ básico, mantendo a melhor opção.
     
@@ -263,11 +193,28 @@ def dedupe_leads_por_cnpj_basico(leads: List[Lead]) -> List[Lead]:
     5. Primeiro encontrado
     
     Args:
-        leads: Lista de leads a dedupe
+        leads: LeadBatch (dedupe vetorizado) ou lista de leads
         
     Returns:
-        Lista de leads sem duplicatas
+        Leads sem duplicatas, no mesmo formato da entrada
     """
+    if isinstance(leads, LeadBatch):
+        df = leads.df
+
+        def preenchido(col):
+            return df[col].fillna('') != ''
+
+        prioridade = pd.DataFrame({
+            'matriz': df['matriz_filial'] == 'MATRIZ',
+            'visitavel': preenchido('logradouro') & preenchido('cidade'),
+            'telefone': preenchido('telefone_principal'),
+            'email': preenchido('email'),
+        })
+        # sort estável: no empate fica o primeiro encontrado
+        ordem = prioridade.sort_values(list(prioridade.columns), ascending=False, kind='stable').index
+        melhores = df.loc[ordem].drop_duplicates('cnpj_basico')
+        return LeadBatch(melhores.sort_index().reset_index(drop=True))
+
     grupos: dict[str, List[Lead]] = {}
     for lead in leads:
         if lead.cnpj_basico not in grupos:
@@ -305,30 +252,28 @@ def buscar_cnae_por_texto_seguro(termo: str, limite: int = 15) -> List[tuple[str
     Returns:
         Lista de tuplas (codigo, descricao)
     """
-    con = get_connection()
-    if not con:
-        return []
+    with conexao() as con:
+        if not con:
+            return []
     
-    try:
-        query = """
-            SELECT codigo, descricao 
-            FROM cnaes 
-            WHERE descricao LIKE ? 
-            LIMIT ?
-        """
+        try:
+            # Código como texto de 7 dígitos, igual às outras buscas de CNAE
+            query = f"""
+                SELECT {sql_cnae_formatado('codigo')} AS codigo, descricao 
+                FROM cnaes 
+                WHERE descricao LIKE ? 
+                LIMIT ?
+            """
         
-        termo_like = f"%{termo}%"
+            termo_like = f"%{termo}%"
         
-        rows = con.execute(query, [termo_like, limite]).fetchall()
-        con.close()
+            rows = con.execute(query, [termo_like, limite]).fetchall()
         
-        return [(row[0], row[1]) for row in rows]
+            return [(row[0], row[1]) for row in rows]
         
-    except Exception as e:
-        if con:
-            con.close()
-        print(f"Erro ao buscar CNAE: {e}")
-        return []
+        except Exception as e:
+            print(f"Erro ao buscar CNAE: {e}")
+            return []
 
 
 def listar_cidades_por_uf_seguro(uf: str) -> List[str]:
@@ -341,31 +286,28 @@ def listar_cidades_por_uf_seguro(uf: str) -> List[str]:
     Returns:
         Lista de nomes de cidades
     """
-    con = get_connection()
-    if not con:
-        return []
+    with conexao() as con:
+        if not con:
+            return []
     
-    try:
-        if uf == "TODAS" or uf == "BRASIL":
-            query = "SELECT DISTINCT descricao FROM municipios ORDER BY descricao"
-            params: List[str] = []
-        else:
-            query = """
-                SELECT DISTINCT m.descricao 
-                FROM estabelecimentos e
-                JOIN municipios m ON e.municipio = m.codigo
-                WHERE e.uf = ?
-                ORDER BY m.descricao
-            """
-            params = [uf]
-        
-        rows = con.execute(query, params).fetchall()
-        con.close()
-        
-        return [row[0] for row in rows]
-        
-    except Exception as e:
-        if con:
-            con.close()
-        print(f"Erro ao listar cidades: {e}")
-        return []
+        try:
+            if uf == "TODAS" or uf == "BRASIL":
+                query = "SELECT DISTINCT descricao FROM municipios ORDER BY descricao"
+                params: List[str] = []
+            else:
+                query = f"""
+                    SELECT DISTINCT m.descricao 
+                    FROM {fonte_estabelecimentos_ativos(con)} e
+                    JOIN municipios m ON e.municipio = m.codigo
+                    WHERE e.uf = ?
+                    ORDER BY m.descricao
+                """
+                params = [uf]
+        
+            rows = con.execute(query, params).fetchall()
+        
+            return [row[0] for row in rows]
+        
+        except Exception as e:
+            print(f"Erro ao listar cidades: {e}")
+            return []
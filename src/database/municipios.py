@@ -0,0 +1,117 @@
+"""
+Índice dos municípios em memória, compartilhado pelo processo: nome + UF -> código
+e código -> (nome, UF). É carregado na primeira consulta e recarregado quando a base
+da Receita muda, então resolver uma lista de cidades não vai ao banco.
+
+A tabela municipios da Receita só tem código e nome; a UF de cada código vem das
+empresas ativas (cubo_mercado). É ela que separa os homônimos (ex: BOM JESUS existe
+em vários estados).
+"""
+import threading
+from collections.abc import Iterable
+from typing import Any
+
+from src.database.connection import geracao_instancia
+from src.database.schema import fonte_cubo_mercado, ler_versao
+
+# Rótulo de cidade com UF usado nas telas: 'FEIRA DE SANTANA - BA'
+SEPARADOR_UF = " - "
+
+_indice: dict[str, dict[Any, Any]] | None = None
+_chave_indice: tuple[int, int] | None = None
+_trava = threading.Lock()
+
+
+def _normalizar_nome(nome) -> str:
+    return str(nome).strip().upper()
+
+
+def rotulo_municipio(nome: str, uf: str | None) -> str:
+    """'NOME - UF' (só o nome quando a UF não é conhecida)."""
+    return f"{nome}{SEPARADOR_UF}{uf}" if uf else nome
+
+
+def separar_rotulo(cidade: str) -> tuple[str, str | None]:
+    """('NOME', 'UF') de um rótulo 'NOME - UF'; ('NOME', None) se vier só o nome."""
+    nome, separador, uf = str(cidade).rpartition(SEPARADOR_UF)
+    uf = uf.strip().upper()
+    if separador and len(uf) == 2 and uf.isalpha():
+        return _normalizar_nome(nome), uf
+    return _normalizar_nome(cidade), None
+
+
+def _carregar(con) -> dict[str, dict]:
+    # UF de cada código: a que mais tem empresas (protege contra código repetido em outra UF)
+    linhas = con.execute(f"""
+        WITH por_uf AS (
+            SELECT municipio, uf, SUM(total) AS total
+            FROM {fonte_cubo_mercado(con)}
+            GROUP BY municipio, uf
+        ),
+        uf_principal AS (
+            SELECT municipio, arg_max(uf, total) AS uf
+            FROM por_uf
+            GROUP BY municipio
+        )
+        SELECT m.codigo, m.descricao, u.uf
+        FROM municipios m
+        LEFT JOIN uf_principal u ON u.municipio = m.codigo
+        ORDER BY m.descricao, u.uf
+    """).fetchall()
+
+    por_codigo: dict[str, tuple[str, str | None]] = {}  # código -> (nome, UF)
+    por_nome_uf: dict[tuple[str, str], str] = {}         # (nome, UF) -> código
+    por_nome: dict[str, list[str]] = {}                  # nome -> [códigos] (todos os homônimos)
+    for codigo, descricao, uf in linhas:
+        nome = _normalizar_nome(descricao)
+        por_codigo[codigo] = (descricao, uf)
+        por_nome.setdefault(nome, []).append(codigo)
+        if uf:
+            por_nome_uf[(nome, uf)] = codigo
+    return {'por_codigo': por_codigo, 'por_nome_uf': por_nome_uf, 'por_nome': por_nome}
+
+
+def _indice_atual(con) -> dict[str, dict]:
+    global _indice, _chave_indice
+    chave = (geracao_instancia(), ler_versao(con, 'main'))
+    with _trava:
+        if _indice is None or chave != _chave_indice:
+            _indice = _carregar(con)
+            _chave_indice = chave
+        return _indice
+
+
+def resolver_municipios(con, cidades: Iterable[str], ufs: Iterable[str] | None = None) -> list[str]:
+    """
+    Códigos dos municípios de uma lista de cidades, numa chamada só.
+    Cada cidade vem como rótulo 'NOME - UF' (um município) ou só pelo nome: aí entram
+    os homônimos das UFs em ufs (de todas, se ufs for None). Cidades não encontradas ficam de fora.
+    """
+    indice = _indice_atual(con)
+    ufs = {u.upper() for u in ufs} if ufs else None
+    codigos = []
+    for cidade in cidades:
+        nome, uf = separar_rotulo(cidade)
+        if uf:
+            encontrados = [indice['por_nome_uf'].get((nome, uf))]
+        else:
+            encontrados = [
+                c for c in indice['por_nome'].get(nome, [])
+                if ufs is None or indice['por_codigo'][c][1] in ufs
+            ]
+        for codigo in encontrados:
+            if codigo and codigo not in codigos:
+                codigos.append(codigo)
+    return codigos
+
+
+def nomes_municipios(con, uf: str | None = None) -> list[str]:
+    """Nomes das cidades sem repetição, em ordem alfabética. Com uf, só as que têm empresas ativas na UF."""
+    por_codigo = _indice_atual(con)['por_codigo']
+    return sorted({nome for nome, uf_cidade in por_codigo.values() if uf is None or uf_cidade == uf})
+
+
+def rotulos_municipios(con) -> list[str]:
+    """Todas as cidades como 'NOME - UF', em ordem alfabética (homônimos separados pela UF)."""
+    por_codigo = _indice_atual(con)['por_codigo']
+    return sorted({rotulo_municipio(nome, uf) for nome, uf in por_codigo.values()})
@@ -1,387 +1,400 @@
-import streamlit as st
+from contextlib import contextmanager
+
 import pandas as pd
-from src.database.connection import get_connection
-from src.models.empresa_dto import EmpresaDTO
+from src.database.cache_resultados import buscar_em_cache
+from src.database.connection import conexao, conexao_crm, geracao_instancia
+from src.database.municipios import nomes_municipios, resolver_municipios, rotulos_municipios
+from src.database.schema import (
+    TABELA_CRM,
+    TABELA_CRM_ENRIQUECIDO,
+    TABELA_CRM_FUNIL,
+    fonte_cubo_mercado,
+    fonte_estabelecimentos_ativos,
+    ler_versao,
+    normalizar_cnaes,
+    sql_cnae_formatado,
+)
+from src.models.empresa_dto import ResultadoEmpresas
 
-# BUSCAR EMPRESAS DTO 
-def buscar_empresas_dto(lista_cnaes, estado, cidade="TODAS"):
-    con = get_connection()
-    if not con: return []
+# Contagem de empresas sobre o cubo_mercado (cada linha já traz seu total)
+SOMA_TOTAL = "CAST(SUM(total) AS BIGINT)"
 
-    # PREPARA FILTROS
-    cnaes_sql = "', '".join(lista_cnaes)
-    
-    filtro_uf = "" if estado == "BRASIL" else f"AND uf = '{estado}'"
-    
-    filtro_cidade = ""
-    if cidade != "TODAS" and estado != "BRASIL":
-        try:
-            cidade_safe = cidade.replace("'", "''")
-            res = con.execute(f"SELECT codigo FROM municipios WHERE descricao = '{cidade_safe}' LIMIT 1").fetchone()
-            if res: filtro_cidade = f"AND estabelecimentos.municipio = '{res[0]}'"
-        except: pass
+# Colunas da busca de empresas, na ordem dos campos do EmpresaDTO
+COLUNAS_BUSCA_EMPRESAS = [
+    'nome_fantasia', 'cnpj', 'telefone_principal', 'telefone_secundario',
+    'email', 'cidade', 'uf', 'cnae',
+]
+LIMITE_BUSCA_EMPRESAS = 50000
+
+# Textos SQL já montados, por (geração da instância do banco, nome).
+# Os filtros entram como parâmetros ($nome, listas com = ANY), então cada consulta
+# tem um texto só, e a escolha da fonte (cubo/tabela ativa) não é refeita a cada chamada.
+_consultas: dict[tuple[int, str], str] = {}
 
-    # QUERY PRINCIPAL
-    query = f"""
+
+def _consulta(con, nome, montar):
+    """Texto SQL 'nome', montado com montar(con) uma vez por instância do banco."""
+    chave = (geracao_instancia(), nome)
+    sql = _consultas.get(chave)
+    if sql is None:
+        sql = _consultas[chave] = montar(con)
+    return sql
+
+
+def _em_cache(con, nome, filtros, calcular):
+    """
+    Resultado de calcular() pelo cache de resultados (cache_resultados), com a chave
+    montada dos filtros já normalizados: listas viram conjuntos ordenados, então a ordem
+    e as repetições dos CNAEs/UFs/cidades escolhidos não geram entradas diferentes.
+    """
+    chave = (nome,) + tuple(
+        (campo, tuple(sorted(set(valor))) if isinstance(valor, list) else valor)
+        for campo, valor in sorted(filtros.items())
+    )
+    return buscar_em_cache(ler_versao(con, 'main'), chave, calcular)
+
+
+def _sql_busca_empresas(con):
+    return f"""
         SELECT 
             nome_fantasia,
-            cnpj_basico || cnpj_ordem || cnpj_dv,
-            ddd_1 || ' ' || telefone_1,
-            ddd_2 || ' ' || telefone_2,
-            correio_eletronico,
-            m.descricao,
+            CAST(cnpj AS VARCHAR) AS cnpj,
+            ddd_1 || ' ' || telefone_1 AS telefone_principal,
+            ddd_2 || ' ' || telefone_2 AS telefone_secundario,
+            correio_eletronico AS email,
+            m.descricao AS cidade,
             uf,
-            cnae_principal
-        FROM estabelecimentos 
-        LEFT JOIN municipios m ON estabelecimentos.municipio = m.codigo
-        WHERE cnae_principal IN ('{cnaes_sql}') 
-        {filtro_uf}
-        AND situacao_cadastral = '02'
-        {filtro_cidade}
-        LIMIT 50000 
+            {sql_cnae_formatado('cnae_principal')} AS cnae
+        FROM {fonte_estabelecimentos_ativos(con)} e
+        LEFT JOIN municipios m ON e.municipio = m.codigo
+        WHERE cnae_principal = ANY($cnaes)
+        AND ($uf IS NULL OR uf = $uf)
+        AND ($municipio IS NULL OR e.municipio = $municipio)
     """
-    
-    # CONVERSÃO PARA DTO
-    rows = con.execute(query).fetchall()
-    con.close()
-
-    lista_final = []
-    for row in rows:
-        empresa = EmpresaDTO(
-            nome_fantasia=row[0],
-            cnpj=str(row[1]),
-            telefone_principal=row[2],
-            telefone_secundario=row[3],
-            email=row[4],
-            cidade=row[5],
-            uf=row[6],
-            cnae=row[7]
-        )
-        lista_final.append(empresa)
-        
-    return lista_final 
+
+
+def sql_busca_empresas(con, lista_cnaes, estado, cidade="TODAS"):
+    """
+    Monta a busca de empresas (sem LIMIT): (query, params), com os filtros como parâmetros nomeados.
+    Retorna None se não houver CNAE válido.
+    """
+    # PREPARA FILTROS
+    cnaes = normalizar_cnaes(lista_cnaes)
+    if not cnaes:
+        return None
+
+    # Cidade pelo nome dentro da UF escolhida (homônimos de outros estados não entram)
+    municipio = None
+    if cidade != "TODAS" and estado != "BRASIL":
+        codigos = resolver_municipios(con, [cidade], [estado])
+        if codigos: municipio = codigos[0]
+
+    params = {
+        'cnaes': cnaes,
+        'uf': None if estado == "BRASIL" else estado,
+        'municipio': municipio,
+    }
+    return _consulta(con, 'busca_empresas', _sql_busca_empresas), params
+
+
+# BUSCAR EMPRESAS DTO 
+def buscar_empresas_dto(lista_cnaes, estado, cidade="TODAS"):
+    """
+    Busca as empresas ativas por CNAE/UF/cidade (até LIMITE_BUSCA_EMPRESAS).
+    Retorna ResultadoEmpresas: colunar em .df e indexável como lista de EmpresaDTO.
+    """
+    with conexao() as con:
+        if not con: return []
+
+        consulta = sql_busca_empresas(con, lista_cnaes, estado, cidade)
+        if consulta is None:
+            return []
+        query, params = consulta
+
+        # Resultado em colunas: DTOs só para as linhas acessadas
+        return _em_cache(con, 'busca_empresas', params, lambda: ResultadoEmpresas(
+            con.execute(f"{query} LIMIT $limite", {**params, 'limite': LIMITE_BUSCA_EMPRESAS}).df()
+        ))
+
+
+@contextmanager
+def cursor_busca_empresas(lista_cnaes, estado, cidade="TODAS", limite=None):
+    """
+    Mesma busca do buscar_empresas_dto, mas sem materializar nada: entrega o cursor
+    já executado para ser lido em blocos (fetchmany). Sem limite por padrão (exportação).
+    Uso: with cursor_busca_empresas(cnaes, uf) as cur: ...  (cur é None se não houver busca)
+    """
+    with conexao() as con:
+        consulta = sql_busca_empresas(con, lista_cnaes, estado, cidade) if con else None
+        if consulta is None:
+            yield None
+            return
+        query, params = consulta
+        if limite:
+            query, params = f"{query} LIMIT $limite", {**params, 'limite': int(limite)}
+        con.execute(query, params)
+        yield con
 
 # BUSCAR CNAE POR TEXTO 
 def buscar_cnae_por_texto(termo):
-    con = get_connection()
-    if not con: return None
+    with conexao() as con:
+        if not con: return None
     
-    query = f"SELECT codigo, descricao FROM cnaes WHERE descricao ILIKE '%{termo}%' LIMIT 15"
-    df = con.execute(query).df()
-    con.close()
-    return df
+        query = f"SELECT {sql_cnae_formatado('codigo')} AS codigo, descricao FROM cnaes WHERE descricao ILIKE ? LIMIT 15"
+        return _em_cache(con, 'cnae_por_texto', {'termo': termo},
+                         lambda: con.execute(query, [f"%{termo}%"]).df())
 
-# LISTAR CIDADES  
-@st.cache_data
+# LISTAR CIDADES (do índice de municípios em memória)
 def listar_cidades_do_banco(uf_filtro="TODAS"):
-    con = get_connection()
-    if not con: return []
-    try:
-        if uf_filtro == "TODAS" or uf_filtro == "BRASIL":
-            
-            query = "SELECT DISTINCT descricao FROM municipios ORDER BY descricao"
-        else:
-           
-            query = f"""
-                SELECT DISTINCT m.descricao 
-                FROM estabelecimentos e
-                JOIN municipios m ON e.municipio = m.codigo
-                WHERE e.uf = '{uf_filtro}'
-                ORDER BY m.descricao
-            """
-            
-        cidades = con.execute(query).fetchall()
-        con.close()
-        return [c[0] for c in cidades]
-    except:
-        return []
+    with conexao() as con:
+        if not con: return []
+        try:
+            if uf_filtro == "TODAS" or uf_filtro == "BRASIL":
+                return nomes_municipios(con)
+            return nomes_municipios(con, uf_filtro)
+        except Exception as e:
+            print(f"Erro ao listar cidades: {e}")
+            return []
 
 # DASHBOARD Top 10
 def buscar_top_cidades(lista_cnaes, estado):
-    con = get_connection()
-    if not con: return None
-
-    # Prepara filtros
-    cnaes_sql = "', '".join(lista_cnaes)
-    filtro_uf = "" if estado == "BRASIL" else f"AND uf = '{estado}'"
-
-    try:
-        query = f"""
-            SELECT 
-                m.descricao AS "Cidade",
-                COUNT(*) AS "Total"
-            FROM estabelecimentos
-            JOIN municipios m ON estabelecimentos.municipio = m.codigo
-            WHERE cnae_principal IN ('{cnaes_sql}')
-            {filtro_uf}
-            AND situacao_cadastral = '02'
-            GROUP BY m.descricao
-            ORDER BY "Total" DESC
-            LIMIT 10
-        """
-        # Retornar DataFrame pro gráfico
-        df = con.execute(query).df()
-        con.close()
-        return df
-    except:
-        return None
+    with conexao() as con:
+        if not con: return None
+
+        # Prepara filtros (sem CNAE válido a lista vazia não traz nada)
+        params = {
+            'cnaes': normalizar_cnaes(lista_cnaes),
+            'uf': None if estado == "BRASIL" else estado,
+        }
+
+        try:
+            query = _consulta(con, 'top_cidades', lambda con: f"""
+                SELECT 
+                    m.descricao AS "Cidade",
+                    {SOMA_TOTAL} AS "Total"
+                FROM {fonte_cubo_mercado(con)} e
+                JOIN municipios m ON e.municipio = m.codigo
+                WHERE cnae_principal = ANY($cnaes)
+                AND ($uf IS NULL OR uf = $uf)
+                GROUP BY m.descricao
+                ORDER BY "Total" DESC
+                LIMIT 10
+            """)
+            # Retornar DataFrame pro gráfico
+            return _em_cache(con, 'top_cidades', params, lambda: con.execute(query, params).df())
+        except:
+            return None
 
 # ANÁLISE DETALHADA DE MERCADO
-def analise_detalhada_mercado(lista_cnaes, estado):
-    """Retorna múltiplas análises do mercado para insights avançados."""
-    con = get_connection()
-    if not con: return {}
-    
-    cnaes_sql = "', '".join(lista_cnaes)
-    filtro_uf = "" if estado == "BRASIL" else f"AND uf = '{estado}'"
-    
-    try:
-        # Distribuição por UF
-        query_uf = f"""
-            SELECT 
-                uf AS "UF",
-                COUNT(*) AS "Total"
-            FROM estabelecimentos
-            WHERE cnae_principal IN ('{cnaes_sql}')
-            {filtro_uf}
-            AND situacao_cadastral = '02'
-            GROUP BY uf
-            ORDER BY "Total" DESC
-        """
-        df_uf = con.execute(query_uf).df()
-        
-        # Distribuição por CNAE
-        query_cnae = f"""
-            SELECT 
-                c.descricao AS "Atividade",
-                COUNT(*) AS "Total"
-            FROM estabelecimentos e
-            JOIN cnaes c ON e.cnae_principal = c.codigo
-            WHERE e.cnae_principal IN ('{cnaes_sql}')
-            {filtro_uf}
-            AND e.situacao_cadastral = '02'
-            GROUP BY c.descricao
-            ORDER BY "Total" DESC
-            LIMIT 10
-        """
-        df_cnae = con.execute(query_cnae).df()
-        
-        # Empresas com contato
-        query_contato = f"""
-            SELECT 
-                COUNT(*) AS total,
-                SUM(CASE WHEN (ddd_1 IS NOT NULL AND telefone_1 IS NOT NULL) THEN 1 ELSE 0 END) AS com_telefone,
-                SUM(CASE WHEN correio_eletronico IS NOT NULL AND correio_eletronico != '' THEN 1 ELSE 0 END) AS com_email,
-                SUM(CASE WHEN (ddd_1 IS NOT NULL AND telefone_1 IS NOT NULL) 
-                          AND (correio_eletronico IS NOT NULL AND correio_eletronico != '') THEN 1 ELSE 0 END) AS com_ambos
-            FROM estabelecimentos
-            WHERE cnae_principal IN ('{cnaes_sql}')
-            {filtro_uf}
-            AND situacao_cadastral = '02'
-        """
-        df_contato = con.execute(query_contato).df()
-
-        # Top 20 cidades
-        query_top20 = f"""
-            SELECT 
-                m.descricao || '-' || e.uf AS "Cidade",
-                COUNT(*) AS "Total",
-                SUM(CASE WHEN e.ddd_1 IS NOT NULL AND e.telefone_1 IS NOT NULL THEN 1 ELSE 0 END) AS "Com Telefone",
-                SUM(CASE WHEN e.correio_eletronico IS NOT NULL AND e.correio_eletronico != '' THEN 1 ELSE 0 END) AS "Com Email"
-            FROM estabelecimentos e
-            JOIN municipios m ON e.municipio = m.codigo
-            WHERE e.cnae_principal IN ('{cnaes_sql}')
-            {filtro_uf}
-            AND e.situacao_cadastral = '02'
-            GROUP BY m.descricao, e.uf
-            ORDER BY "Total" DESC
-            LIMIT 20
-        """
-        df_top20 = con.execute(query_top20).df()
-        
-        # Estatísticas gerais    
-        query_stats = f"""
-            SELECT 
-                COUNT(*) AS total_empresas,
+# Níveis do GROUPING(uf, municipio, cnae_principal): bit ligado = coluna agregada
+NIVEL_CIDADE = 0b001
+NIVEL_UF = 0b011
+NIVEL_CNAE = 0b110
+NIVEL_GERAL = 0b111
+
+
+def _agregar_mercado(con, cnaes=None, ufs=None, municipios=None):
+    """
+    Lê a fonte (cubo ou empresas ativas) uma única vez com os filtros dados e devolve,
+    via GROUPING SETS, os totais geral, por UF, por cidade e por CNAE.
+    Cada filtro é uma lista: None não filtra, lista vazia não traz nada.
+    A coluna 'nivel' indica a que recorte cada linha pertence.
+    """
+    query = _consulta(con, 'agregar_mercado', _sql_agregar_mercado)
+    df = con.execute(query, {'cnaes': cnaes, 'ufs': ufs, 'municipios': municipios}).df()
+    # No recorte por cidade, total_cnaes é a quantidade de CNAEs diferentes da cidade
+    return df.assign(cnaes_diferentes=df['total_cnaes'])
+
+
+def _sql_agregar_mercado(con):
+    return f"""
+        WITH filtrado AS (
+            SELECT * FROM {fonte_cubo_mercado(con)}
+            WHERE ($cnaes IS NULL OR cnae_principal = ANY($cnaes))
+            AND ($ufs IS NULL OR uf = ANY($ufs))
+            AND ($municipios IS NULL OR municipio = ANY($municipios))
+        ),
+        agregado AS (
+            SELECT
+                GROUPING(uf, municipio, cnae_principal) AS nivel,
+                uf,
+                municipio,
+                cnae_principal,
+                CAST(COALESCE(SUM(total), 0) AS BIGINT) AS total,
+                CAST(COALESCE(SUM(CASE WHEN tem_telefone THEN total ELSE 0 END), 0) AS BIGINT) AS com_telefone,
+                CAST(COALESCE(SUM(CASE WHEN tem_email THEN total ELSE 0 END), 0) AS BIGINT) AS com_email,
+                CAST(COALESCE(SUM(CASE WHEN tem_telefone AND tem_email THEN total ELSE 0 END), 0) AS BIGINT) AS com_ambos,
                 COUNT(DISTINCT uf) AS total_estados,
                 COUNT(DISTINCT municipio) AS total_cidades,
                 COUNT(DISTINCT cnae_principal) AS total_cnaes
-            FROM estabelecimentos
-            WHERE cnae_principal IN ('{cnaes_sql}')
-            {filtro_uf}
-            AND situacao_cadastral = '02'
-        """
-        df_stats = con.execute(query_stats).df()
-        
-        con.close()
+            FROM filtrado
+            GROUP BY GROUPING SETS ((), (uf), (uf, municipio), (cnae_principal))
+        )
+        SELECT a.*, m.descricao AS cidade, c.descricao AS atividade
+        FROM agregado a
+        LEFT JOIN municipios m ON a.municipio = m.codigo
+        LEFT JOIN cnaes c ON a.cnae_principal = c.codigo
+    """
+
+
+def _ranking(df, colunas, limite=None):
+    """Ordena pelo total (maior primeiro), renomeia as colunas e aplica o limite."""
+    df = df.sort_values('total', ascending=False, kind='stable')
+    if limite:
+        df = df.head(limite)
+    return df[list(colunas)].rename(columns=colunas).reset_index(drop=True)
+
+def analise_detalhada_mercado(lista_cnaes, estado):
+    """Retorna múltiplas análises do mercado para insights avançados."""
+    with conexao() as con:
+        if not con: return {}
+    
+        try:
+            # Sem CNAE válido a lista vazia não traz nada
+            df = _agregar_mercado(
+                con,
+                cnaes=normalizar_cnaes(lista_cnaes),
+                ufs=None if estado == "BRASIL" else [estado],
+            )
+
+            geral = df[df['nivel'] == NIVEL_GERAL]
+            por_uf = df[df['nivel'] == NIVEL_UF]
+            por_cidade = df[(df['nivel'] == NIVEL_CIDADE) & df['cidade'].notna()]
+            por_cnae = df[(df['nivel'] == NIVEL_CNAE) & df['atividade'].notna()]
+
+            # Distribuição por UF
+            df_uf = _ranking(por_uf, {'uf': 'UF', 'total': 'Total'})
+
+            # Distribuição por CNAE
+            df_cnae = _ranking(
+                por_cnae.groupby('atividade', as_index=False)['total'].sum(),
+                {'atividade': 'Atividade', 'total': 'Total'}, 10
+            )
+
+            # Empresas com contato
+            df_contato = geral[['total', 'com_telefone', 'com_email', 'com_ambos']].reset_index(drop=True)
+
+            # Top 20 cidades
+            por_cidade = por_cidade.assign(cidade=por_cidade['cidade'] + '-' + por_cidade['uf'])
+            df_top20 = _ranking(
+                por_cidade,
+                {'cidade': 'Cidade', 'total': 'Total', 'com_telefone': 'Com Telefone', 'com_email': 'Com Email'}, 20
+            )
+
+            # Estatísticas gerais
+            df_stats = geral.rename(columns={'total': 'total_empresas'})[
+                ['total_empresas', 'total_estados', 'total_cidades', 'total_cnaes']
+            ].reset_index(drop=True)
         
-        return {
-            'distribuicao_uf': df_uf,
-            'distribuicao_cnae': df_cnae,
-            'contatos': df_contato,
-            'top20_cidades': df_top20,
-            'estatisticas': df_stats
-        }
-    except Exception as e:
-        print(f"Erro na análise detalhada: {e}")
-        return {}
+            return {
+                'distribuicao_uf': df_uf,
+                'distribuicao_cnae': df_cnae,
+                'contatos': df_contato,
+                'top20_cidades': df_top20,
+                'estatisticas': df_stats
+            }
+        except Exception as e:
+            print(f"Erro na análise detalhada: {e}")
+            return {}
 
 # ANÁLISE DO PIPELINE
 def analise_pipeline():
-    """Retorna análises detalhadas do pipeline/CRM."""
-    from src.database.connection import get_connection
+    """
+    Retorna análises detalhadas do pipeline/CRM.
+    A evolução mensal vem do funil diário (mantido a cada mudança de fase),
+    não de data_atualizacao, que muda em toda edição.
+    """
     from src.database.crm_repository import inicializar_crm
-    import pandas as pd
-    
-    
+
     inicializar_crm()
     
-    con = get_connection()
-    if not con: return {}
+    with conexao_crm() as con:
+        if not con: return {}
     
-    try:
-        count_check = con.execute("SELECT COUNT(*) as total FROM crm").fetchone()
-        if not count_check or count_check[0] == 0:
-            con.close()
-            return {}
-        
-        
-        query_status = """
-            SELECT 
-                UPPER(TRIM(COALESCE(status, 'Sem Status'))) AS "Status",
-                COUNT(*) AS "Quantidade",
-                SUM(COALESCE(valor,0)) AS "Valor Total"
-            FROM crm
-            GROUP BY 1
-            ORDER BY "Quantidade" DESC
-        """
-        df_status = con.execute(query_status).df()
         try:
-            print("DEBUG - df_status head:")
-            print(df_status.head())
-        except Exception:
-            pass
-        
+            count_check = con.execute(f"SELECT COUNT(*) as total FROM {TABELA_CRM}").fetchone()
+            if not count_check or count_check[0] == 0:
+                return {}
         
-        query_temporal = """
-            SELECT 
-                strftime('%Y-%m', data_atualizacao) AS "Mês",
-                COUNT(*) AS "Leads",
-                SUM(CASE WHEN status = 'Vendido' THEN 1 ELSE 0 END) AS "Vendas",
-                SUM(CASE WHEN status = 'Vendido' THEN valor ELSE 0 END) AS "Valor Vendido"
-            FROM crm
-            WHERE data_atualizacao >= date('now', '-12 months')
-            GROUP BY strftime('%Y-%m', data_atualizacao)
-            ORDER BY "Mês" DESC
-        """
-        query_temporal = """
-            SELECT 
-                strftime('%Y-%m', data_atualizacao) AS "Mês",
-                COUNT(*) AS "Leads",
-                SUM(CASE WHEN UPPER(status) LIKE '%VENDID%' THEN 1 ELSE 0 END) AS "Vendas",
-                SUM(CASE WHEN UPPER(status) LIKE '%VENDID%' THEN valor ELSE 0 END) AS "Valor Vendido"
-            FROM crm
-            WHERE data_atualizacao >= date('now', '-12 months')
-            GROUP BY strftime('%Y-%m', data_atualizacao)
-            ORDER BY "Mês" DESC
-        """
-        df_temporal = con.execute(query_temporal).df()
         
+            query_status = f"""
+                SELECT 
+                    UPPER(COALESCE(CAST(status AS VARCHAR), 'Sem Status')) AS "Status",
+                    COUNT(*) AS "Quantidade",
+                    SUM(COALESCE(valor,0)) AS "Valor Total"
+                FROM {TABELA_CRM}
+                GROUP BY 1
+                ORDER BY "Quantidade" DESC
+            """
+            df_status = con.execute(query_status).df()
         
-        query_top_valor = """
-            SELECT 
-                c.cnpj,
-                COALESCE(e.nome_fantasia, 'N/A') AS "Empresa",
-                c.status,
-                c.valor AS "Valor",
-                c.data_atualizacao AS "Última Atualização"
-            FROM crm c
-            LEFT JOIN estabelecimentos e ON c.cnpj = (e.cnpj_basico || e.cnpj_ordem || e.cnpj_dv)
-            ORDER BY c.valor DESC
-            LIMIT 10
-        """
-        df_top_valor = con.execute(query_top_valor).df()
-        try:
-            print("DEBUG - df_top_valor head:")
-            print(df_top_valor.head())
-        except Exception:
-            pass
-        
+            # Leads = entradas na fase Novo; Vendas = passagens para Vendido no mês
+            query_temporal = f"""
+                SELECT 
+                    strftime(dia, '%Y-%m') AS "Mês",
+                    CAST(COALESCE(SUM(entradas) FILTER (WHERE status = 'Novo'), 0) AS BIGINT) AS "Leads",
+                    CAST(COALESCE(SUM(entradas) FILTER (WHERE status = 'Vendido'), 0) AS BIGINT) AS "Vendas",
+                    COALESCE(SUM(valor) FILTER (WHERE status = 'Vendido'), 0) AS "Valor Vendido"
+                FROM {TABELA_CRM_FUNIL}
+                WHERE dia >= CURRENT_DATE - INTERVAL 12 MONTH
+                GROUP BY 1
+                ORDER BY "Mês" DESC
+            """
+            df_temporal = con.execute(query_temporal).df()
         
-        query_conversao = """
-            SELECT 
-                UPPER(TRIM(COALESCE(status, 'Sem Status'))) AS "Fase",
-                COUNT(*) AS "Total",
-                ROUND(COUNT(*) * 100.0 / (SELECT COUNT(*) FROM crm), 2) AS "Percentual"
-            FROM crm
-            GROUP BY 1
-            ORDER BY "Total" DESC
-        """
-        df_conversao = con.execute(query_conversao).df()
-        try:
-            print("DEBUG - df_conversao head:")
-            print(df_conversao.head())
-        except Exception:
-            pass
         
+            query_top_valor = f"""
+                SELECT 
+                    c.cnpj,
+                    COALESCE(x.nome_fantasia, 'N/A') AS "Empresa",
+                    CAST(c.status AS VARCHAR) AS status,
+                    c.valor AS "Valor",
+                    c.data_atualizacao AS "Última Atualização"
+                FROM {TABELA_CRM} c
+                LEFT JOIN {TABELA_CRM_ENRIQUECIDO} x ON x.cnpj = c.cnpj
+                ORDER BY c.valor DESC
+                LIMIT 10
+            """
+            df_top_valor = con.execute(query_top_valor).df()
         
-        query_stats = """
-            SELECT 
-                COUNT(*) AS total_leads,
-                SUM(CASE WHEN status = 'Vendido' THEN 1 ELSE 0 END) AS vendas,
-                SUM(CASE WHEN status = 'Em Negociação' THEN 1 ELSE 0 END) AS em_negociacao,
-                SUM(CASE WHEN status = 'Novo' THEN 1 ELSE 0 END) AS novos,
-                SUM(valor) AS valor_total,
-                SUM(CASE WHEN status = 'Vendido' THEN valor ELSE 0 END) AS valor_vendido,
-                AVG(CASE WHEN status = 'Vendido' THEN valor ELSE NULL END) AS ticket_medio
-            FROM crm
-        """
         
-        query_stats = """
-            SELECT 
-                COUNT(*) AS total_leads,
-                SUM(CASE WHEN UPPER(status) LIKE '%VENDID%' THEN 1 ELSE 0 END) AS vendas,
-                SUM(CASE WHEN UPPER(status) LIKE '%NEGOC%' THEN 1 ELSE 0 END) AS em_negociacao,
-                SUM(CASE WHEN UPPER(status) LIKE '%NOVO%' THEN 1 ELSE 0 END) AS novos,
-                SUM(valor) AS valor_total,
-                SUM(CASE WHEN UPPER(status) LIKE '%VENDID%' THEN valor ELSE 0 END) AS valor_vendido,
-                AVG(CASE WHEN UPPER(status) LIKE '%VENDID%' THEN valor ELSE NULL END) AS ticket_medio
-            FROM crm
-        """
-        df_stats = con.execute(query_stats).df()
-        try:
-            print("DEBUG - df_stats head:")
-            print(df_stats.head())
-        except Exception:
-            pass
+            query_conversao = f"""
+                SELECT 
+                    UPPER(COALESCE(CAST(status AS VARCHAR), 'Sem Status')) AS "Fase",
+                    COUNT(*) AS "Total",
+                    ROUND(COUNT(*) * 100.0 / SUM(COUNT(*)) OVER (), 2) AS "Percentual"
+                FROM {TABELA_CRM}
+                GROUP BY 1
+                ORDER BY "Total" DESC
+            """
+            df_conversao = con.execute(query_conversao).df()
         
-        con.close()
         
-        if df_status is None:
-            df_status = pd.DataFrame()
-        if df_temporal is None:
-            df_temporal = pd.DataFrame()
-        if df_top_valor is None:
-            df_top_valor = pd.DataFrame()
-        if df_conversao is None:
-            df_conversao = pd.DataFrame()
-        if df_stats is None:
-            df_stats = pd.DataFrame()
+            query_stats = f"""
+                SELECT 
+                    COUNT(*) AS total_leads,
+                    COUNT(*) FILTER (WHERE status = 'Vendido') AS vendas,
+                    COUNT(*) FILTER (WHERE status = 'Em Negociação') AS em_negociacao,
+                    COUNT(*) FILTER (WHERE status = 'Novo') AS novos,
+                    SUM(valor) AS valor_total,
+                    COALESCE(SUM(valor) FILTER (WHERE status = 'Vendido'), 0) AS valor_vendido,
+                    AVG(valor) FILTER (WHERE status = 'Vendido') AS ticket_medio
+                FROM {TABELA_CRM}
+            """
+            df_stats = con.execute(query_stats).df()
         
-        return {
-            'distribuicao_status': df_status,
-            'evolucao_temporal': df_temporal,
-            'top_valor': df_top_valor,
-            'taxa_conversao': df_conversao,
-            'estatisticas': df_stats
-        }
-    except Exception as e:
-        if con:
-            con.close()
-        print(f"Erro na análise do pipeline: {e}")
-        import traceback
-        traceback.print_exc()
-        return {}
+            return {
+                'distribuicao_status': df_status,
+                'evolucao_temporal': df_temporal,
+                'top_valor': df_top_valor,
+                'taxa_conversao': df_conversao,
+                'estatisticas': df_stats
+            }
+        except Exception as e:
+            print(f"Erro na análise do pipeline: {e}")
+            import traceback
+            traceback.print_exc()
+            return {}
 
 # DADOS PARA DASHBOARD
 def buscar_dados_dashboard_executivo(lista_estados=None, lista_cidades=None, lista_cnaes=None):
@@ -389,267 +402,149 @@ def buscar_dados_dashboard_executivo(lista_estados=None, lista_cidades=None, lis
     Busca dados agregados para o dashboard executivo.
     Retorna dados para KPIs, mapa e gráficos.
     """
-    con = get_connection()
-    if not con: return {}
+    with conexao() as con:
+        if not con: return {}
     
-    try:
-        # Prepara filtros
-        filtro_uf = ""
-        if lista_estados and len(lista_estados) > 0 and "BRASIL" not in lista_estados:
-            ufs_sql = "', '".join(lista_estados)
-            filtro_uf = f"AND uf IN ('{ufs_sql}')"
-        
-        filtro_cidade = ""
-        if lista_cidades and len(lista_cidades) > 0 and "TODAS" not in lista_cidades:
-            # Busca códigos das cidades
-            cidades_codigos = []
-            for cidade in lista_cidades:
-                try:
-                    cidade_safe = cidade.replace("'", "''")
-                    res = con.execute(f"SELECT codigo FROM municipios WHERE descricao = '{cidade_safe}' LIMIT 1").fetchone()
-                    if res:
-                        cidades_codigos.append(str(res[0]))
-                except:
-                    pass
-            if cidades_codigos:
-                codigos_sql = "', '".join(cidades_codigos)
-                filtro_cidade = f"AND municipio IN ('{codigos_sql}')"
-        
-        filtro_cnae = ""
-        if lista_cnaes and len(lista_cnaes) > 0:
-            cnaes_sql = "', '".join(lista_cnaes)
-            filtro_cnae = f"AND cnae_principal IN ('{cnaes_sql}')"
-        
-        # KPIs Total de empresas, cidades únicas, setor predominante
-        query_kpis = f"""
-            SELECT 
-                COUNT(*) AS total_empresas,
-                COUNT(DISTINCT municipio) AS total_cidades,
-                COUNT(DISTINCT uf) AS total_estados,
-                COUNT(DISTINCT cnae_principal) AS total_cnaes
-            FROM estabelecimentos
-            WHERE situacao_cadastral = '02'
-            {filtro_uf}
-            {filtro_cidade}
-            {filtro_cnae}
-        """
-        df_kpis = con.execute(query_kpis).df()
-        
-        # Setor predominante
-        query_setor = f"""
-            SELECT 
-                c.descricao AS setor,
-                COUNT(*) AS total
-            FROM estabelecimentos e
-            JOIN cnaes c ON e.cnae_principal = c.codigo
-            WHERE e.situacao_cadastral = '02'
-            {filtro_uf}
-            {filtro_cidade}
-            {filtro_cnae}
-            GROUP BY c.descricao
-            ORDER BY total DESC
-            LIMIT 1
-        """
-        df_setor = con.execute(query_setor).df()
-        setor_predominante = df_setor.iloc[0]['setor'] if not df_setor.empty else "N/A"
-        
-        
-        query_mapa = f"""
-            SELECT 
-                m.descricao AS cidade,
-                e.uf,
-                COUNT(*) AS quantidade,
-                COUNT(DISTINCT e.cnae_principal) AS cnaes_diferentes
-            FROM estabelecimentos e
-            LEFT JOIN municipios m ON e.municipio = m.codigo
-            WHERE e.situacao_cadastral = '02'
-            {filtro_uf}
-            {filtro_cidade}
-            {filtro_cnae}
-            AND m.descricao IS NOT NULL
-            GROUP BY m.descricao, e.uf
-            HAVING COUNT(*) >= 5
-            ORDER BY quantidade DESC
-            LIMIT 500
-        """
-        df_mapa = con.execute(query_mapa).df()
-        
-        # Top 10 Cidades
-        query_top10 = f"""
-            SELECT 
-                m.descricao || ' - ' || e.uf AS cidade_uf,
-                COUNT(*) AS total
-            FROM estabelecimentos e
-            LEFT JOIN municipios m ON e.municipio = m.codigo
-            WHERE e.situacao_cadastral = '02'
-            {filtro_uf}
-            {filtro_cidade}
-            {filtro_cnae}
-            AND m.descricao IS NOT NULL
-            GROUP BY m.descricao, e.uf
-            ORDER BY total DESC
-            LIMIT 10
-        """
-        df_top10 = con.execute(query_top10).df()
-        
-        # Distribuição por CNAE/Setor
-        query_cnae_dist = f"""
-            SELECT 
-                c.descricao AS setor,
-                COUNT(*) AS total
-            FROM estabelecimentos e
-            JOIN cnaes c ON e.cnae_principal = c.codigo
-            WHERE e.situacao_cadastral = '02'
-            {filtro_uf}
-            {filtro_cidade}
-            {filtro_cnae}
-            GROUP BY c.descricao
-            ORDER BY total DESC
-            LIMIT 15
-        """
-        df_cnae_dist = con.execute(query_cnae_dist).df()
+        try:
+            # Prepara filtros (None = sem filtro)
+            ufs = None
+            if lista_estados and len(lista_estados) > 0 and "BRASIL" not in lista_estados:
+                ufs = list(lista_estados)
         
-        # Distribuição por Estado
-        query_uf_dist = f"""
-            SELECT 
-                uf,
-                COUNT(*) AS total
-            FROM estabelecimentos
-            WHERE situacao_cadastral = '02'
-            {filtro_uf}
-            {filtro_cidade}
-            {filtro_cnae}
-            GROUP BY uf
-            ORDER BY total DESC
-        """
-        df_uf_dist = con.execute(query_uf_dist).df()
+            municipios = None
+            if lista_cidades and len(lista_cidades) > 0 and "TODAS" not in lista_cidades:
+                # Códigos das cidades (nomes sem UF valem nas UFs filtradas).
+                # Nenhuma encontrada: lista vazia, o painel fica zerado em vez de mostrar tudo
+                municipios = resolver_municipios(con, lista_cidades, ufs)
         
-        con.close()
+            # Sem CNAE informado não filtra; CNAEs todos inválidos filtram por uma lista vazia
+            cnaes = normalizar_cnaes(lista_cnaes) if lista_cnaes else None
         
-        return {
-            'kpis': df_kpis,
-            'setor_predominante': setor_predominante,
-            'mapa': df_mapa,
-            'top10_cidades': df_top10,
-            'distribuicao_cnae': df_cnae_dist,
-            'distribuicao_uf': df_uf_dist
-        }
-    except Exception as e:
-        if con:
-            con.close()
-        print(f"Erro ao buscar dados do dashboard: {e}")
-        return {}
+            filtros = {'cnaes': cnaes, 'ufs': ufs, 'municipios': municipios}
+            return _em_cache(con, 'dashboard_executivo', filtros, lambda: _montar_dashboard(con, **filtros))
+        except Exception as e:
+            print(f"Erro ao buscar dados do dashboard: {e}")
+            return {}
+
+
+def _montar_dashboard(con, cnaes, ufs, municipios):
+    """KPIs, mapa e rankings do dashboard a partir dos filtros já resolvidos."""
+    # Uma única passada sobre a fonte filtrada calcula todos os recortes
+    df = _agregar_mercado(con, cnaes=cnaes, ufs=ufs, municipios=municipios)
+
+    geral = df[df['nivel'] == NIVEL_GERAL]
+    por_uf = df[df['nivel'] == NIVEL_UF]
+    por_cidade = df[(df['nivel'] == NIVEL_CIDADE) & df['cidade'].notna()]
+    por_setor = df[(df['nivel'] == NIVEL_CNAE) & df['atividade'].notna()] \
+        .groupby('atividade', as_index=False)['total'].sum()
+
+    # KPIs Total de empresas, cidades únicas, setor predominante
+    df_kpis = geral.rename(columns={'total': 'total_empresas'})[
+        ['total_empresas', 'total_cidades', 'total_estados', 'total_cnaes']
+    ].reset_index(drop=True)
+
+    # Distribuição por CNAE/Setor
+    df_cnae_dist = _ranking(por_setor, {'atividade': 'setor', 'total': 'total'}, 15)
+    setor_predominante = df_cnae_dist.iloc[0]['setor'] if not df_cnae_dist.empty else "N/A"
+
+    df_mapa = _ranking(
+        por_cidade[por_cidade['total'] >= 5],
+        {'cidade': 'cidade', 'uf': 'uf', 'total': 'quantidade', 'cnaes_diferentes': 'cnaes_diferentes'}, 500
+    )
+
+    # Top 10 Cidades
+    por_cidade = por_cidade.assign(cidade_uf=por_cidade['cidade'] + ' - ' + por_cidade['uf'])
+    df_top10 = _ranking(por_cidade, {'cidade_uf': 'cidade_uf', 'total': 'total'}, 10)
+
+    # Distribuição por Estado
+    df_uf_dist = _ranking(por_uf, {'uf': 'uf', 'total': 'total'})
+
+    return {
+        'kpis': df_kpis,
+        'setor_predominante': setor_predominante,
+        'mapa': df_mapa,
+        'top10_cidades': df_top10,
+        'distribuicao_cnae': df_cnae_dist,
+        'distribuicao_uf': df_uf_dist
+    }
 
 # LISTAR CNAES DISPONÍVEIS
 def listar_cnaes_disponiveis(termo_busca=None, limite=100):
     """Lista CNAEs disponíveis para filtro multiselect."""
-    con = get_connection()
-    if not con: return pd.DataFrame()
+    with conexao() as con:
+        if not con: return pd.DataFrame()
     
-    try:
-        if termo_busca:
-            query = f"""
-                SELECT codigo, descricao
-                FROM cnaes
-                WHERE descricao ILIKE '%{termo_busca}%'
-                ORDER BY descricao
-                LIMIT {limite}
-            """
-        else:
+        try:
             query = f"""
-                SELECT codigo, descricao
+                SELECT {sql_cnae_formatado('codigo')} AS codigo, descricao
                 FROM cnaes
+                WHERE ($termo IS NULL OR descricao ILIKE $termo)
                 ORDER BY descricao
-                LIMIT {limite}
+                LIMIT $limite
             """
-        df = con.execute(query).df()
-        con.close()
-        return df
-    except:
-        if con:
-            con.close()
-        return pd.DataFrame()
+            termo = f"%{termo_busca}%" if termo_busca else None
+            df = con.execute(query, {'termo': termo, 'limite': limite}).df()
+            return df
+        except:
+            return pd.DataFrame()
 
 
 # LISTAR CIDADES DISPONÍVEIS
 def listar_cidades_disponiveis():
     """
-    Retorna lista ordenada de cidades (descrição) disponíveis no banco.
+    Retorna lista ordenada de cidades disponíveis no banco, como 'NOME - UF'
+    (cidades homônimas aparecem uma vez por estado).
     """
-    con = get_connection()
-    if not con:
-        return []
-    try:
-        query = "SELECT DISTINCT descricao FROM municipios ORDER BY descricao"
-        rows = con.execute(query).fetchall()
-        con.close()
-        return [r[0] for r in rows]
-    except Exception:
+    with conexao() as con:
+        if not con:
+            return []
         try:
-            con.close()
-        except:
-            pass
-        return []
+            return rotulos_municipios(con)
+        except Exception as e:
+            print(f"Erro ao listar cidades: {e}")
+            return []
 
 
 def buscar_leads_por_cidade_e_cnae(cidades: list, cnaes: list):
     """
-    Busca leads filtrando por lista de cidades (descrições) e lista de CNAE (descrições).
+    Busca leads filtrando por lista de cidades ('NOME - UF', ou só o nome para todos os
+    homônimos) e lista de CNAE (descrições).
     Retorna um pandas.DataFrame pronto para exibição.
     Se `cnaes` for vazio, busca todos os CNAEs nas cidades fornecidas.
     """
-    con = get_connection()
-    if not con:
-        return pd.DataFrame()
-
-    try:
-        # Filtra cidades
-        cidades_safe = [c.replace("'", "''") for c in cidades]
-        codigos = []
-        for cid in cidades_safe:
-            try:
-                res = con.execute(f"SELECT codigo FROM municipios WHERE descricao = '{cid}' LIMIT 1").fetchone()
-                if res:
-                    codigos.append(str(res[0]))
-            except:
-                pass
-
-        if not codigos:
-            con.close()
+    with conexao() as con:
+        if not con:
             return pd.DataFrame()
 
-        codigos_sql = "', '".join(codigos)
-
-        filtro_cnae = ""
-        if cnaes and len(cnaes) > 0:
-            cnaes_safe = [c.replace("'", "''") for c in cnaes]
-            cnaes_descr_sql = "', '".join(cnaes_safe)
-            filtro_cnae = f"AND c.descricao IN ('{cnaes_descr_sql}')"
-
-        query = f"""
-            SELECT 
-                e.nome_fantasia AS nome_fantasia,
-                e.cnpj_basico || e.cnpj_ordem || e.cnpj_dv AS cnpj,
-                e.ddd_1 || ' ' || e.telefone_1 AS telefone,
-                e.logradouro AS logradouro,
-                e.numero AS numero,
-                COALESCE(m.descricao, '') AS municipio,
-                e.uf AS uf,
-                COALESCE(c.descricao, '') AS cnae
-            FROM estabelecimentos e
-            LEFT JOIN municipios m ON e.municipio = m.codigo
-            LEFT JOIN cnaes c ON e.cnae_principal = c.codigo
-            WHERE e.situacao_cadastral = '02'
-            AND e.municipio IN ('{codigos_sql}')
-            {filtro_cnae}
-            LIMIT 50000
-        """
-        df = con.execute(query).df()
-        con.close()
-        return df
-    except Exception:
         try:
-            con.close()
-        except:
-            pass
-        return pd.DataFrame()
\ No newline at end of file
+            # Filtra cidades
+            codigos = resolver_municipios(con, cidades)
+            if not codigos:
+                return pd.DataFrame()
+
+            params = {
+                'municipios': codigos,
+                'cnaes': list(cnaes) if cnaes and len(cnaes) > 0 else None,
+            }
+
+            query = _consulta(con, 'leads_por_cidade_e_cnae', lambda con: f"""
+                SELECT 
+                    e.nome_fantasia AS nome_fantasia,
+                    e.cnpj AS cnpj,
+                    e.ddd_1 || ' ' || e.telefone_1 AS telefone,
+                    e.logradouro AS logradouro,
+                    e.numero AS numero,
+                    COALESCE(m.descricao, '') AS municipio,
+                    e.uf AS uf,
+                    COALESCE(c.descricao, '') AS cnae
+                FROM {fonte_estabelecimentos_ativos(con)} e
+                LEFT JOIN municipios m ON e.municipio = m.codigo
+                LEFT JOIN cnaes c ON e.cnae_principal = c.codigo
+                WHERE e.municipio = ANY($municipios)
+                AND ($cnaes IS NULL OR c.descricao = ANY($cnaes))
+                LIMIT 50000
+            """)
+            df = con.execute(query, params).df()
+            return df
+        except Exception:
+            return pd.DataFrame()
\ No newline at end of file
@@ -0,0 +1,425 @@
+"""
+Esquema tipado da tabela estabelecimentos.
+
+Os CSVs da Receita chegam como texto puro. A tipagem e a normalização são feitas
+uma única vez na carga (setup_banco_completo.py), assim as consultas do app filtram
+e fazem JOIN direto nas colunas, sem REPLACE/LPAD/CAST por linha.
+"""
+from __future__ import annotations
+
+import re
+from typing import Any
+
+# Colunas na ordem em que aparecem nos arquivos ESTABELE*.zip
+COLUNAS_RECEITA: list[str] = [
+    'cnpj_basico', 'cnpj_ordem', 'cnpj_dv', 'matriz_filial', 'nome_fantasia',
+    'situacao_cadastral', 'data_situacao_cadastral', 'motivo_situacao_cadastral',
+    'nome_cidade_exterior', 'pais', 'data_inicio_atividade', 'cnae_principal',
+    'cnae_secundaria', 'tipo_logradouro', 'logradouro', 'numero', 'complemento',
+    'bairro', 'cep', 'uf', 'municipio', 'ddd_1', 'telefone_1', 'ddd_2',
+    'telefone_2', 'ddd_fax', 'fax', 'correio_eletronico', 'situacao_especial',
+    'data_situacao_especial'
+]
+
+MUNICIPIO_CODE_LENGTH = 7
+CNAE_CODE_LENGTH = 7
+
+# Códigos da Receita para situacao_cadastral e matriz_filial
+SITUACAO_ATIVA = 2
+MATRIZ = 1
+
+
+def _data(coluna: str) -> str:
+    # '0', '00000000' e vazios viram NULL
+    return f"TRY_STRPTIME({coluna}, '%Y%m%d')::DATE"
+
+
+# (nome, tipo, expressão sobre as colunas brutas da Receita)
+COLUNAS_ESTABELECIMENTOS: list[tuple[str, str, str]] = [
+    ('cnpj', 'VARCHAR', "LPAD(cnpj_basico, 8, '0') || LPAD(cnpj_ordem, 4, '0') || LPAD(cnpj_dv, 2, '0')"),
+    ('cnpj_basico', 'VARCHAR', 'cnpj_basico'),
+    ('matriz_filial', 'UTINYINT', 'TRY_CAST(matriz_filial AS UTINYINT)'),
+    ('nome_fantasia', 'VARCHAR', 'nome_fantasia'),
+    ('situacao_cadastral', 'UTINYINT', 'TRY_CAST(situacao_cadastral AS UTINYINT)'),
+    ('data_situacao_cadastral', 'DATE', _data('data_situacao_cadastral')),
+    ('motivo_situacao_cadastral', 'VARCHAR', 'motivo_situacao_cadastral'),
+    ('nome_cidade_exterior', 'VARCHAR', 'nome_cidade_exterior'),
+    ('pais', 'VARCHAR', 'pais'),
+    ('data_inicio_atividade', 'DATE', _data('data_inicio_atividade')),
+    ('cnae_principal', 'INTEGER', "TRY_CAST(REGEXP_REPLACE(cnae_principal, '[^0-9]', '', 'g') AS INTEGER)"),
+    ('cnae_secundaria', 'VARCHAR', 'cnae_secundaria'),
+    ('tipo_logradouro', 'VARCHAR', 'tipo_logradouro'),
+    ('logradouro', 'VARCHAR', 'logradouro'),
+    ('numero', 'VARCHAR', 'numero'),
+    ('complemento', 'VARCHAR', 'complemento'),
+    ('bairro', 'VARCHAR', 'bairro'),
+    ('cep', 'VARCHAR', 'cep'),
+    ('uf', 'VARCHAR', 'uf'),
+    ('municipio', 'VARCHAR', f"LPAD(TRIM(municipio), {MUNICIPIO_CODE_LENGTH}, '0')"),
+    ('ddd_1', 'VARCHAR', 'ddd_1'),
+    ('telefone_1', 'VARCHAR', 'telefone_1'),
+    ('ddd_2', 'VARCHAR', 'ddd_2'),
+    ('telefone_2', 'VARCHAR', 'telefone_2'),
+    ('ddd_fax', 'VARCHAR', 'ddd_fax'),
+    ('fax', 'VARCHAR', 'fax'),
+    ('correio_eletronico', 'VARCHAR', 'correio_eletronico'),
+    ('situacao_especial', 'VARCHAR', 'situacao_especial'),
+    ('data_situacao_especial', 'DATE', _data('data_situacao_especial')),
+]
+
+DDL_ESTABELECIMENTOS = (
+    "CREATE OR REPLACE TABLE estabelecimentos ("
+    + ", ".join(f"{nome} {tipo}" for nome, tipo, _ in COLUNAS_ESTABELECIMENTOS)
+    + ")"
+)
+
+# SELECT que converte uma relação com as colunas brutas (VARCHAR) para o esquema tipado
+SELECT_TIPADO = ",\n    ".join(f"{expr} AS {nome}" for nome, _, expr in COLUNAS_ESTABELECIMENTOS)
+
+
+# Ordem física de estabelecimentos. As consultas do app filtram justamente por
+# esses campos, então cada combinação fica concentrada em poucos row groups e o
+# DuckDB descarta o resto pelos zone maps (min/max de cada row group).
+ORDEM_CLUSTER: list[str] = ['situacao_cadastral', 'uf', 'cnae_principal', 'municipio']
+
+
+def ordenar_estabelecimentos(con) -> None:
+    """Reescreve estabelecimentos ordenada por ORDEM_CLUSTER."""
+    con.execute(f"""
+        CREATE OR REPLACE TABLE estabelecimentos AS
+        SELECT * FROM estabelecimentos
+        ORDER BY {', '.join(ORDEM_CLUSTER)}
+    """)
+
+
+# Estatística de um segmento em pragma_storage_info: '[Min: BA, Max: SP, Has Unicode: ...][Has Null: ...]'
+_ZONA_SEGMENTO = re.compile(r"^\[Min: (.*?), Max: (.*?)(?:, Has Unicode.*?)?\]")
+
+
+def _zonas_row_groups(con, colunas: list[str]) -> dict[int, dict[str, list | None]]:
+    """
+    Zone maps de estabelecimentos: {row group: {coluna: [(min, max) de cada segmento]}},
+    em texto, como o pragma_storage_info mostra. None quando algum segmento não tem min/max.
+    Min/max de VARCHAR são só os 8 primeiros bytes; UF e município cabem inteiros.
+    """
+    zonas: dict[int, dict[str, list | None]] = {}
+    for row_group, coluna, stats in con.execute(
+        """
+        SELECT row_group_id, column_name, stats
+        FROM pragma_storage_info('estabelecimentos')
+        WHERE segment_type != 'VALIDITY' AND column_name = ANY(?)
+        """,
+        [colunas]
+    ).fetchall():
+        faixas = zonas.setdefault(row_group, {}).setdefault(coluna, [])
+        achado = _ZONA_SEGMENTO.match(stats or '')
+        if faixas is None or achado is None:
+            zonas[row_group][coluna] = None
+        else:
+            faixas.append(achado.groups())
+    return zonas
+
+
+def _row_group_pulado(zona: dict[str, list | None], filtros: dict[str, Any]) -> bool:
+    """O filtro de igualdade cai fora do min/max de alguma coluna: o DuckDB nem lê o row group."""
+    for coluna, valor in filtros.items():
+        faixas = zona.get(coluna)
+        if not faixas:
+            continue
+        tipo = type(valor)  # min/max vêm em texto: compara no tipo do valor filtrado
+        minimo = min(tipo(m) for m, _ in faixas)
+        maximo = max(tipo(m) for _, m in faixas)
+        if valor < minimo or valor > maximo:
+            return True
+    return False
+
+
+def relatorio_row_groups(con) -> list[tuple[str, int, int]]:
+    """
+    Mede quantos row groups as consultas típicas do app precisam ler, pelos zone maps
+    (min/max por row group) que o DuckDB usa para pular row groups no scan.
+    Usa a combinação UF/CNAE/cidade ativa mais comum como amostra.
+
+    Returns:
+        Lista de tuplas (consulta, row groups lidos, total de row groups)
+    """
+    amostra = con.execute(
+        """
+        SELECT uf, cnae_principal, municipio
+        FROM estabelecimentos
+        WHERE situacao_cadastral = ?
+        GROUP BY ALL
+        ORDER BY COUNT(*) DESC
+        LIMIT 1
+        """,
+        [SITUACAO_ATIVA]
+    ).fetchone()
+    if not amostra:
+        return []
+
+    uf, cnae, municipio = amostra
+    consultas = [
+        (f"UF + CNAE ({uf}, {cnae:07d})", {'uf': uf, 'cnae_principal': cnae}),
+        (f"UF + CNAE + cidade ({municipio})", {'uf': uf, 'cnae_principal': cnae, 'municipio': municipio}),
+        (f"CNAE no Brasil ({cnae:07d})", {'cnae_principal': cnae}),
+        (f"UF inteira ({uf})", {'uf': uf}),
+    ]
+    zonas = _zonas_row_groups(con, ORDEM_CLUSTER)
+    total = len(zonas)
+    if not total:
+        return []
+
+    relatorio = []
+    for nome, filtros in consultas:
+        filtros = {'situacao_cadastral': SITUACAO_ATIVA, **filtros}
+        lidos = sum(1 for zona in zonas.values() if not _row_group_pulado(zona, filtros))
+        relatorio.append((nome, lidos, total))
+    return relatorio
+
+
+# Tabela compacta só com empresas ativas e as colunas que o app lê.
+# O histórico completo (inativas, datas, motivos...) continua em estabelecimentos.
+TABELA_ATIVOS = 'estabelecimentos_ativos'
+COLUNAS_ATIVOS: list[str] = [
+    'cnpj', 'cnpj_basico', 'nome_fantasia', 'matriz_filial', 'cnae_principal',
+    'logradouro', 'numero', 'complemento', 'bairro', 'cep', 'uf', 'municipio',
+    'ddd_1', 'telefone_1', 'ddd_2', 'telefone_2', 'correio_eletronico',
+    'data_inicio_atividade',
+]
+
+
+def criar_tabela_ativos(con) -> int:
+    """
+    (Re)cria estabelecimentos_ativos a partir de estabelecimentos, já ordenada
+    por UF, CNAE e município. Retorna a quantidade de empresas ativas.
+    """
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {TABELA_ATIVOS} AS
+        SELECT {', '.join(COLUNAS_ATIVOS)}
+        FROM estabelecimentos
+        WHERE situacao_cadastral = {SITUACAO_ATIVA}
+        ORDER BY uf, cnae_principal, municipio
+    """)
+    return int(con.execute(f"SELECT COUNT(*) FROM {TABELA_ATIVOS}").fetchone()[0])
+
+
+def tabela_existe(con, nome: str) -> bool:
+    return int(con.execute(
+        "SELECT COUNT(*) FROM duckdb_tables() WHERE database_name = current_database() AND table_name = ?",
+        [nome]
+    ).fetchone()[0]) > 0
+
+
+def fonte_estabelecimentos_ativos(con) -> str:
+    """
+    Relação a usar no FROM das consultas de empresas ativas: a tabela compacta
+    quando ela existe ou, em bancos antigos, o filtro sobre a tabela completa.
+    """
+    if tabela_existe(con, TABELA_ATIVOS):
+        return TABELA_ATIVOS
+    return f"(SELECT * FROM estabelecimentos WHERE situacao_cadastral = {SITUACAO_ATIVA})"
+
+
+# O CRM fica num arquivo próprio (CRM_DB_FILE), anexado à conexão analítica com
+# este alias. Assim as edições do pipeline não tocam no arquivo grande da Receita.
+CRM_ALIAS = 'crm_db'
+TABELA_CRM = f'{CRM_ALIAS}.crm'
+
+# Contador de versão dos dados, um por banco: 'main' (base da Receita) e CRM_ALIAS (pipeline).
+# Sobe a cada recriação da base / escrita no CRM; os caches usam o par na chave,
+# então podem viver muito tempo sem servir dado velho para nenhuma sessão.
+TABELA_VERSAO = 'versao_dados'
+
+
+def incrementar_versao(con, banco: str) -> None:
+    """Rode dentro da transação da escrita, para a versão subir junto com os dados."""
+    con.execute(f"CREATE TABLE IF NOT EXISTS {banco}.{TABELA_VERSAO} (versao BIGINT)")
+    con.execute(f"""
+        INSERT INTO {banco}.{TABELA_VERSAO}
+        SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM {banco}.{TABELA_VERSAO})
+    """)
+    con.execute(f"UPDATE {banco}.{TABELA_VERSAO} SET versao = versao + 1")
+
+
+def ler_versao(con, banco: str) -> int:
+    """Versão atual do banco (0 se ainda não existe contador)."""
+    try:
+        return int(con.execute(f"SELECT COALESCE(MAX(versao), 0) FROM {banco}.{TABELA_VERSAO}").fetchone()[0])
+    except Exception:
+        return 0
+
+
+# Fases do pipeline. No banco do CRM o status é um ENUM (o DuckDB guarda como inteiro
+# pequeno e devolve o texto), então valores fora desta lista são recusados na escrita.
+STATUS_CRM: list[str] = ['Novo', 'Tentativa', 'Em Negociação', 'Vendido', 'Perdido']
+TIPO_STATUS_CRM = f'{CRM_ALIAS}.status_crm'
+
+# Histórico de mudanças de status/valor (só cresce) e o funil diário mantido a partir dele
+TABELA_CRM_EVENTOS = f'{CRM_ALIAS}.crm_eventos'
+TABELA_CRM_FUNIL = f'{CRM_ALIAS}.crm_funil_diario'
+
+
+def sql_normalizar_status(coluna: str) -> str:
+    """Converte status em texto livre (bancos antigos) para uma das fases de STATUS_CRM."""
+    return f"""
+        CASE
+            WHEN UPPER({coluna}) LIKE '%VENDID%' THEN 'Vendido'
+            WHEN UPPER({coluna}) LIKE '%NEGOC%' THEN 'Em Negociação'
+            WHEN UPPER({coluna}) LIKE '%TENTATIV%' THEN 'Tentativa'
+            WHEN UPPER({coluna}) LIKE '%PERDID%' THEN 'Perdido'
+            ELSE 'Novo'
+        END
+    """
+
+
+# Dados de exibição dos leads do CRM (nome, telefone, email, cidade-UF), copiados de
+# estabelecimentos quando o lead entra e recalculados após cada recriação da base.
+# A aba do pipeline lê só crm + crm_enriched, sem varrer estabelecimentos.
+TABELA_CRM_ENRIQUECIDO = f'{CRM_ALIAS}.crm_enriched'
+DDL_CRM_ENRIQUECIDO = f"""
+    CREATE TABLE IF NOT EXISTS {TABELA_CRM_ENRIQUECIDO} (
+        cnpj TEXT PRIMARY KEY,
+        nome_fantasia TEXT,
+        telefone TEXT,
+        email TEXT,
+        local TEXT,
+        uf TEXT
+    )
+"""
+
+
+def preencher_crm_enriquecido(con, fonte_cnpjs: str | None = None) -> None:
+    """
+    Grava em crm_enriched os CNPJs de fonte_cnpjs (relação com a coluna cnpj,
+    ex: um DataFrame registrado). Sem fonte, recalcula o CRM inteiro.
+    Não abre transação: use dentro da transação de quem chama.
+    """
+    con.execute(DDL_CRM_ENRIQUECIDO)
+    con.execute(f"ALTER TABLE {TABELA_CRM_ENRIQUECIDO} ADD COLUMN IF NOT EXISTS uf TEXT")
+    if fonte_cnpjs is None:
+        fonte_cnpjs = TABELA_CRM
+        con.execute(f"DELETE FROM {TABELA_CRM_ENRIQUECIDO}")
+    con.execute(f"""
+        INSERT OR REPLACE INTO {TABELA_CRM_ENRIQUECIDO} BY NAME
+        SELECT DISTINCT ON (e.cnpj)
+            e.cnpj,
+            e.nome_fantasia,
+            CASE WHEN e.ddd_1 IS NOT NULL AND e.telefone_1 IS NOT NULL
+                 THEN e.ddd_1 || ' ' || e.telefone_1 ELSE '' END AS telefone,
+            e.correio_eletronico AS email,
+            COALESCE(m.descricao || '-' || e.uf, e.uf, 'N/A') AS local,
+            e.uf
+        FROM estabelecimentos e
+        LEFT JOIN municipios m ON e.municipio = m.codigo
+        WHERE e.cnpj IN (SELECT cnpj FROM {fonte_cnpjs})
+    """)
+
+
+def atualizar_crm_enriquecido(con, fonte_cnpjs: str | None = None) -> int:
+    """
+    preencher_crm_enriquecido numa transação própria. Retorna o total de linhas em crm_enriched.
+    O banco do CRM precisa estar anexado como CRM_ALIAS.
+    """
+    con.execute("BEGIN TRANSACTION")
+    try:
+        preencher_crm_enriquecido(con, fonte_cnpjs)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    return int(con.execute(f"SELECT COUNT(*) FROM {TABELA_CRM_ENRIQUECIDO}").fetchone()[0])
+
+
+# Cubo de contagens para o Dashboard: uma linha por combinação de dimensões
+TABELA_CUBO = 'cubo_mercado'
+DIMENSOES_CUBO: list[str] = ['uf', 'municipio', 'cnae_principal', 'matriz_filial', 'tem_telefone', 'tem_email']
+SQL_TEM_TELEFONE = "(ddd_1 IS NOT NULL AND telefone_1 IS NOT NULL)"
+SQL_TEM_EMAIL = "(correio_eletronico IS NOT NULL AND correio_eletronico != '')"
+
+
+def _linhas_cubo(con) -> str:
+    """Empresas ativas linha a linha, já com as colunas do cubo (total = 1)."""
+    return f"""(
+        SELECT
+            uf,
+            municipio,
+            cnae_principal,
+            matriz_filial,
+            {SQL_TEM_TELEFONE} AS tem_telefone,
+            {SQL_TEM_EMAIL} AS tem_email,
+            1 AS total
+        FROM {fonte_estabelecimentos_ativos(con)}
+    )"""
+
+
+def criar_cubo_mercado(con) -> int:
+    """(Re)cria cubo_mercado a partir das empresas ativas. Retorna o número de células."""
+    dimensoes = ', '.join(DIMENSOES_CUBO)
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {TABELA_CUBO} AS
+        SELECT {dimensoes}, COUNT(*) AS total
+        FROM {_linhas_cubo(con)}
+        GROUP BY {dimensoes}
+        ORDER BY uf, cnae_principal, municipio
+    """)
+    return int(con.execute(f"SELECT COUNT(*) FROM {TABELA_CUBO}").fetchone()[0])
+
+
+def fonte_cubo_mercado(con) -> str:
+    """
+    Relação com as colunas do cubo (dimensões + total) para o Dashboard: a tabela
+    pré-agregada quando existe ou, em bancos antigos, as empresas ativas linha a linha.
+    As consultas usam SUM(total) e funcionam igual nos dois casos.
+    """
+    if tabela_existe(con, TABELA_CUBO):
+        return TABELA_CUBO
+    return _linhas_cubo(con)
+
+
+def normalizar_cnaes(lista_cnaes) -> list[int]:
+    """
+    Converte os CNAEs digitados pelo usuário ('4711302', '4711-3/02', ...) para o
+    inteiro gravado em estabelecimentos.cnae_principal. Entradas inválidas são ignoradas.
+    """
+    cnaes: list[int] = []
+    for c in lista_cnaes or []:
+        digitos = "".join(ch for ch in str(c) if ch.isdigit())
+        if digitos:
+            cnaes.append(int(digitos))
+    return cnaes
+
+
+def normalizar_codigo_municipio(codigo) -> str:
+    """Código de município no formato gravado no banco (7 dígitos, zeros à esquerda)."""
+    return str(codigo).strip().zfill(MUNICIPIO_CODE_LENGTH)
+
+
+def sql_cnae_formatado(coluna: str) -> str:
+    """Expressão SQL que devolve o CNAE inteiro como texto de 7 dígitos (ex: 0111301)."""
+    return f"LPAD(CAST({coluna} AS VARCHAR), {CNAE_CODE_LENGTH}, '0')"
+
+
+def normalizar_tabelas_referencia(con) -> None:
+    """
+    Deixa cnaes.codigo como INTEGER e municipios.codigo com 7 dígitos,
+    no mesmo formato das colunas tipadas de estabelecimentos.
+    """
+    tabelas = {r[0] for r in con.execute("SELECT table_name FROM duckdb_tables()").fetchall()}
+
+    if 'cnaes' in tabelas:
+        con.execute("""
+            CREATE OR REPLACE TABLE cnaes AS
+            SELECT
+                TRY_CAST(REGEXP_REPLACE(CAST(codigo AS VARCHAR), '[^0-9]', '', 'g') AS INTEGER) AS codigo,
+                descricao
+            FROM cnaes
+        """)
+
+    if 'municipios' in tabelas:
+        con.execute(f"""
+            CREATE OR REPLACE TABLE municipios AS
+            SELECT
+                LPAD(TRIM(CAST(codigo AS VARCHAR)), {MUNICIPIO_CODE_LENGTH}, '0') AS codigo,
+                * EXCLUDE (codigo)
+            FROM municipios
+        """)
@@ -1,6 +1,10 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
+from typing import Any
 
-@dataclass
+from src.models.lote_colunar import LoteColunar
+
+
+@dataclass(slots=True)
 class EmpresaDTO:
     nome_fantasia: str
     cnpj: str
@@ -14,4 +18,19 @@ class EmpresaDTO:
     
     @property
     def localizacao(self) -> str:
-        return f"{self.cidade} - {self.uf}"
\ No newline at end of file
+        return f"{self.cidade} - {self.uf}"
+
+
+CAMPOS_EMPRESA = [f.name for f in fields(EmpresaDTO)]
+
+
+class ResultadoEmpresas(LoteColunar):
+    """
+    Resultado da busca em colunas (DataFrame vindo direto do DuckDB).
+    Métricas, tabela e exportação usam .df; o EmpresaDTO só é montado
+    para as linhas acessadas por índice ou iteração.
+    """
+
+    def _montar(self, valores: dict[str, Any]) -> EmpresaDTO:
+        campos: dict[str, Any] = {c: valores.get(c) for c in CAMPOS_EMPRESA}
+        return EmpresaDTO(**campos)
@@ -0,0 +1,123 @@
+from dataclasses import dataclass, fields
+from datetime import date
+from typing import Any
+from urllib.parse import quote_plus
+
+import pandas as pd
+
+from src.models.lote_colunar import LoteColunar
+
+
+def formatar_endereco(logradouro, numero, complemento, bairro, cidade, uf, cep) -> str:
+    rua = ", ".join(p for p in (logradouro, numero) if p)
+    if complemento:
+        rua += f" - {complemento}"
+    partes = [rua, bairro, f"{cidade} - {uf}", cep]
+    return ", ".join(p for p in partes if p)
+
+
+def montar_link_maps(endereco_formatado: str | None, nome: str, cidade: str, uf: str) -> str:
+    alvo = endereco_formatado or f"{nome} {cidade} - {uf}"
+    return f"https://www.google.com/maps/search/?api=1&query={quote_plus(alvo)}"
+
+
+@dataclass(slots=True, frozen=True)
+class Endereco:
+    logradouro: str
+    numero: str
+    bairro: str
+    cep: str
+    complemento: str | None
+    cidade: str
+    uf: str
+
+    @property
+    def formatado(self) -> str:
+        return formatar_endereco(self.logradouro, self.numero, self.complemento,
+                                 self.bairro, self.cidade, self.uf, self.cep)
+
+
+@dataclass(slots=True)
+class Lead:
+    cnpj: str
+    cnpj_basico: str
+    nome_fantasia: str
+    razao_social: str | None
+    cnae_principal: str
+    descricao_cnae: str
+    matriz_filial: str
+    endereco: Endereco | None
+    cidade: str
+    uf: str
+    telefone_principal: str | None
+    telefone_secundario: str | None
+    email: str | None
+    data_inicio_atividade: date | None
+
+    @property
+    def visitavel(self) -> bool:
+        """Tem endereço suficiente para entrar num roteiro."""
+        return bool(self.endereco and self.endereco.logradouro and self.endereco.cidade)
+
+    @property
+    def anos_atividade(self) -> int | None:
+        if not self.data_inicio_atividade:
+            return None
+        return (date.today() - self.data_inicio_atividade).days // 365
+
+    @property
+    def link_maps(self) -> str:
+        endereco = self.endereco if self.visitavel else None
+        return montar_link_maps(endereco.formatado if endereco else None,
+                                self.nome_fantasia, self.cidade, self.uf)
+
+
+CAMPOS_LEAD = [f.name for f in fields(Lead) if f.name != 'endereco']
+CAMPOS_ENDERECO = [f.name for f in fields(Endereco)]
+
+
+class LeadBatch(LoteColunar):
+    """
+    Leads enriquecidos em colunas (uma por campo do Lead e do Endereco, sem aninhar).
+    Cada acesso por índice devolve um Lead montado na hora.
+    """
+
+    @classmethod
+    def vazio(cls) -> 'LeadBatch':
+        """Lote sem linhas, mas com todas as colunas (filtros e contagens continuam funcionando)."""
+        return cls(pd.DataFrame(columns=list(dict.fromkeys(CAMPOS_LEAD + CAMPOS_ENDERECO))))
+
+    def _montar(self, valores: dict[str, Any]) -> Lead:
+        endereco = None
+        if valores.get('logradouro'):
+            campos_endereco: dict[str, Any] = {
+                c: (valores.get(c) or None) if c == 'complemento' else (valores.get(c) or "")
+                for c in CAMPOS_ENDERECO
+            }
+            endereco = Endereco(**campos_endereco)
+        dados: dict[str, Any] = {c: valores.get(c) for c in CAMPOS_LEAD}
+        for c in ('nome_fantasia', 'descricao_cnae', 'cidade', 'uf'):
+            dados[c] = dados[c] or ""
+        if hasattr(dados['data_inicio_atividade'], 'date'):
+            dados['data_inicio_atividade'] = dados['data_inicio_atividade'].date()
+        return Lead(endereco=endereco, **dados)
+
+    def com_derivados(self) -> pd.DataFrame:
+        """Colunas com os campos calculados do Lead (endereço formatado, anos, link), para exportar sem montar Leads."""
+        df = self.df.copy()
+
+        def texto(col):
+            return df[col].fillna('').astype(str).tolist()
+
+        log, num, comp, bairro, cidade, uf, cep, nome = (
+            texto(c) for c in ('logradouro', 'numero', 'complemento', 'bairro', 'cidade', 'uf', 'cep', 'nome_fantasia')
+        )
+        formatados = [
+            formatar_endereco(*partes) if partes[0] and partes[4] else None
+            for partes in zip(log, num, comp, bairro, cidade, uf, cep, strict=True)
+        ]
+        df['formatado'] = formatados
+        df['link_maps'] = [montar_link_maps(f, n, c, u) for f, n, c, u in zip(formatados, nome, cidade, uf, strict=True)]
+        inicio = pd.to_datetime(df['data_inicio_atividade'], errors='coerce')
+        df['anos_atividade'] = (pd.Timestamp.today().normalize() - inicio).dt.days // 365
+        return df
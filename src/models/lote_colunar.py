@@ -0,0 +1,42 @@
+from abc import ABC, abstractmethod
+from collections.abc import Sequence
+from typing import Any
+
+import pandas as pd
+
+
+class LoteColunar(Sequence, ABC):
+    """
+    Struct-of-arrays: as linhas ficam em colunas (DataFrame vindo do DuckDB) e o
+    objeto de cada linha só é montado quando ela é acessada. Guardar 50k resultados
+    no session_state custa as colunas, não 50k objetos Python.
+    Subclasses definem _montar(valores) -> objeto da linha.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+
+    @abstractmethod
+    def _montar(self, valores: dict[str, Any]) -> Any:
+        """Objeto da linha a partir de {coluna: valor} (nulos já como None)."""
+
+    def __len__(self) -> int:
+        return len(self.df)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return type(self)(self.df.iloc[i].reset_index(drop=True))
+        linha = self.df.iloc[i]
+        return self._montar({c: (None if pd.isna(v) else v) for c, v in linha.items()})
+
+    def __iter__(self):
+        for i in range(len(self.df)):
+            yield self[i]
+
+    def selecionar(self, indices):
+        """Linhas escolhidas (ex: seleção da tabela), ainda em colunas."""
+        return type(self)(self.df.iloc[list(indices)].reset_index(drop=True))
+
+    def contar_preenchidos(self, coluna: str) -> int:
+        """Quantas linhas têm a coluna preenchida (nem nula nem vazia)."""
+        return int((self.df[coluna].fillna('') != '').sum())
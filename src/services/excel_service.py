@@ -4,10 +4,31 @@ Serviço de exportação de leads para Excel.
 from __future__ import annotations
 
 from io import BytesIO
-from typing import Any, Dict, List
+from typing import Any, BinaryIO, Dict, List
 
 import pandas as pd
-from typing import Any
+import pyarrow as pa
+import pyarrow.compute as pc
+import xlsxwriter
+
+from src.models.lead import LeadBatch
+
+
+# Cabeçalhos da planilha de leads (campos do EmpresaDTO)
+MAPA_COLUNAS = {
+    'nome_fantasia': 'Nome Fantasia', 
+    'cnpj': 'CNPJ',
+    'telefone_principal': 'Telefone 1',
+    'telefone_secundario': 'Telefone 2',
+    'email': 'E-mail',
+    'cidade': 'Cidade',
+    'uf': 'UF',
+    'cnae': 'CNAE'
+}
+
+# Limite do Excel por aba (inclui a linha de cabeçalho)
+LINHAS_POR_ABA = 1_048_576
+LOTE_STREAMING = 10_000
 
 
 def gerar_excel_de_dtos(lista_dtos: List[Any] | pd.DataFrame) -> bytes:
@@ -35,7 +56,7 @@ def gerar_excel_de_dtos(lista_dtos: List[Any] | pd.DataFrame) -> bytes:
                 try:
                     # dataclass -> asdict
                     from dataclasses import asdict, is_dataclass
-                    if is_dataclass(e):
+                    if is_dataclass(e) and not isinstance(e, type):
                         dados.append(asdict(e))
                     else:
                         # objeto genérico: tenta usar __dict__
@@ -46,109 +67,141 @@ def gerar_excel_de_dtos(lista_dtos: List[Any] | pd.DataFrame) -> bytes:
         df = pd.DataFrame(dados)
     
     # Fortama planilha
-    mapa_colunas = {
-        'nome_fantasia': 'Nome Fantasia', 
-        'cnpj': 'CNPJ',
-        'telefone_principal': 'Telefone 1',
-        'telefone_secundario': 'Telefone 2',
-        'email': 'E-mail',
-        'cidade': 'Cidade',
-        'uf': 'UF',
-        'cnae': 'CNAE'
-    }
-    
-    df = df.rename(columns=mapa_colunas)
+    df = df.rename(columns=MAPA_COLUNAS)
 
     with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='Leads')
-        
-        
-        workbook = writer.book
-        worksheet = writer.sheets['Leads']
-        formato = workbook.add_format({'num_format': '@', 'align': 'left', 'valign': 'vcenter'})
-        
-        for i, col in enumerate(df.columns):
-            tam = max(df[col].astype(str).map(len).max(), len(col))
-            worksheet.set_column(i, i, tam + 2, formato)
+        _escrever_aba(writer, df, 'Leads', maximo=None)
             
     return output.getvalue()
 
 
-def gerar_excel_leads_enriquecidos(leads: List[Any]) -> bytes:
+# Planilha enriquecida: cabeçalho -> campo do Lead (os de endereço vêm de lead.endereco)
+COLUNAS_ENRIQUECIDAS = {
+    'Nome Fantasia': 'nome_fantasia',
+    'Razão Social': 'razao_social',
+    'CNPJ': 'cnpj',
+    'CNPJ Básico': 'cnpj_basico',
+    'Matriz/Filial': 'matriz_filial',
+    'CNAE': 'cnae_principal',
+    'Descrição CNAE': 'descricao_cnae',
+    'Telefone 1': 'telefone_principal',
+    'Telefone 2': 'telefone_secundario',
+    'E-mail': 'email',
+    'Logradouro': 'logradouro',
+    'Número': 'numero',
+    'Complemento': 'complemento',
+    'Bairro': 'bairro',
+    'CEP': 'cep',
+    'Cidade': 'cidade',
+    'UF': 'uf',
+    'Data Início Atividade': 'data_inicio_atividade',
+    'Anos de Atividade': 'anos_atividade',
+    'Link Google Maps': 'link_maps',
+}
+CAMPOS_ENDERECO = ['logradouro', 'numero', 'complemento', 'bairro', 'cep']
+CAMPOS_SCORE = ['score', 'segmento', 'reasons']
+
+# Acima disso a largura das colunas é medida numa amostra
+AMOSTRA_LARGURA = 100_000
+
+
+def _larguras_colunas(df: pd.DataFrame, maximo: int | None = 50,
+                      amostra: int = AMOSTRA_LARGURA) -> List[int]:
+    """
+    Largura de cada coluna (maior texto + 2), medida com os kernels do Arrow
+    (utf8_length) em vez de converter célula a célula para str.
+    """
+    if len(df) > amostra:
+        df = df.sample(amostra, random_state=0)
+    larguras = []
+    for col in df.columns:
+        try:
+            valores = pa.array(df[col], from_pandas=True)
+            if not pa.types.is_string(valores.type) and not pa.types.is_large_string(valores.type):
+                valores = pc.cast(valores, pa.string())
+            maior = pc.max(pc.utf8_length(valores)).as_py() or 0
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            # colunas com tipos misturados
+            maior = df[col].dropna().astype(str).str.len().max()
+            maior = 0 if pd.isna(maior) else int(maior)
+        largura = max(maior, len(str(col))) + 2
+        larguras.append(min(largura, maximo) if maximo else largura)
+    return larguras
+
+
+def _coluna(objetos: List[Any], campo: str, padrao: Any = '') -> List[Any]:
+    """Um campo de todos os objetos (dicts ou atributos) numa única passada."""
+    if objetos and isinstance(objetos[0], dict):
+        return [(o.get(campo) if o else None) or padrao for o in objetos]
+    return [getattr(o, campo, None) or padrao for o in objetos]
+
+
+def _frame_leads(leads: List[Any] | LeadBatch | pd.DataFrame | pa.Table) -> pd.DataFrame:
+    """
+    Campos dos leads em colunas. Aceita LeadBatch, lista de Lead/dict, DataFrame ou
+    tabela Arrow (ex: resultado de sql_leads_enriquecidos via .arrow()).
+    """
+    if isinstance(leads, LeadBatch):
+        return leads.com_derivados()
+    if isinstance(leads, pa.Table):
+        leads = leads.to_pandas()
+    if isinstance(leads, pd.DataFrame):
+        return LeadBatch(leads).com_derivados()
+
+    campos = [c for c in COLUNAS_ENRIQUECIDAS.values() if c not in CAMPOS_ENDERECO] + CAMPOS_SCORE
+    colunas = {campo: _coluna(leads, campo, None) for campo in campos}
+    enderecos = _coluna(leads, 'endereco', None)
+    for campo in CAMPOS_ENDERECO + ['formatado']:
+        colunas[campo] = _coluna(enderecos, campo, None)
+    return pd.DataFrame(colunas)
+
+
+def _texto_data(coluna: pd.Series) -> pd.Series:
+    datas = pd.to_datetime(coluna, errors='coerce')
+    return datas.dt.strftime('%Y-%m-%d').fillna('')
+
+
+def _escrever_aba(writer, df: pd.DataFrame, nome: str, maximo: int | None = 50) -> None:
+    df.to_excel(writer, index=False, sheet_name=nome)
+    worksheet = writer.sheets[nome]
+    formato = writer.book.add_format({'num_format': '@', 'align': 'left', 'valign': 'vcenter'})
+    for i, largura in enumerate(_larguras_colunas(df, maximo)):
+        worksheet.set_column(i, i, largura, formato)
+
+
+def gerar_excel_leads_enriquecidos(leads: List[Any] | LeadBatch | pd.DataFrame | pa.Table) -> bytes:
     """
     Gera Excel com leads enriquecidos (novos campos + link Google Maps).
     
     Args:
-        leads: Lista de objetos Lead ou LeadScored
+        leads: LeadBatch, lista de objetos Lead ou LeadScored, ou o resultado
+               colunar da consulta (DataFrame / tabela Arrow)
         
     Returns:
         Bytes do arquivo Excel
     """
     output = BytesIO()
-    
-    # Converte leads para dicionários
-    dados: List[Dict[str, Any]] = []
-    for lead in leads:
-        # suporta dicts ou objetos com atributos
-        def attr(o, name, default=''):
-            if isinstance(o, dict):
-                return o.get(name, default) or default
-            return getattr(o, name, default) or default
-
-        endereco = attr(lead, 'endereco', None)
-        linha: Dict[str, Any] = {
-            'Nome Fantasia': attr(lead, 'nome_fantasia'),
-            'Razão Social': attr(lead, 'razao_social'),
-            'CNPJ': attr(lead, 'cnpj'),
-            'CNPJ Básico': attr(lead, 'cnpj_basico'),
-            'Matriz/Filial': attr(lead, 'matriz_filial'),
-            'CNAE': attr(lead, 'cnae_principal'),
-            'Descrição CNAE': attr(lead, 'descricao_cnae'),
-            'Telefone 1': attr(lead, 'telefone_principal'),
-            'Telefone 2': attr(lead, 'telefone_secundario'),
-            'E-mail': attr(lead, 'email'),
-            'Logradouro': getattr(endereco, 'logradouro', '') if endereco else '',
-            'Número': getattr(endereco, 'numero', '') if endereco else '',
-            'Complemento': getattr(endereco, 'complemento', '') if endereco else '',
-            'Bairro': getattr(endereco, 'bairro', '') if endereco else '',
-            'CEP': getattr(endereco, 'cep', '') if endereco else '',
-            'Cidade': attr(lead, 'cidade'),
-            'UF': attr(lead, 'uf'),
-            'Data Início Atividade': getattr(attr(lead, 'data_inicio_atividade', None), 'isoformat', lambda: '')() if attr(lead, 'data_inicio_atividade', None) else '',
-            'Anos de Atividade': attr(lead, 'anos_atividade'),
-            'Link Google Maps': attr(lead, 'link_maps'),
-        }
+    base = _frame_leads(leads)
 
-        
-        score = attr(lead, 'score', None)
-        if score is not None:
-            linha['Score'] = score
-            linha['Segmento'] = attr(lead, 'segmento')
-            reasons = attr(lead, 'reasons', None)
-            if isinstance(reasons, (list, tuple)):
-                linha['Razões Score'] = ' | '.join(reasons)
-
-        dados.append(linha)
-    
-    df = pd.DataFrame(dados)
-    
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='Leads')
-        
-        workbook = writer.book
-        worksheet = writer.sheets['Leads']
-        
+    # Monta a planilha coluna a coluna
+    df = pd.DataFrame({
+        cabecalho: base[campo] if campo in base.columns else ''
+        for cabecalho, campo in COLUNAS_ENRIQUECIDAS.items()
+    })
+    df['Data Início Atividade'] = _texto_data(df['Data Início Atividade'])
 
-        formato = workbook.add_format({'num_format': '@', 'align': 'left', 'valign': 'vcenter'})
-        
-        for i, col in enumerate(df.columns):
-            max_len = max(
-                df[col].astype(str).map(len).max(),
-                len(col)
+    if 'score' in base.columns and base['score'].notna().any():
+        df['Score'] = base['score']
+        df['Segmento'] = base.get('segmento')
+        if 'reasons' in base.columns:
+            df['Razões Score'] = base['reasons'].map(
+                lambda r: ' | '.join(r) if isinstance(r, (list, tuple)) else ''
             )
-            
-            width = min(max_len + 2, 50)
-            worksheet.set_column(i, i, width, formato)
+
+    df = df.fillna('')
+    
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        _escrever_aba(writer, df, 'Leads')
     
     return output.getvalue()
 
@@ -169,80 +222,94 @@ def gerar_excel_roteiro(
     """
     output = BytesIO()
     
+    paradas = [(dia_plan.dia, stop) for dia_plan in route_plan.dias for stop in dia_plan.stops]
+    base = _frame_leads([stop.lead for _, stop in paradas])
+
+    df = pd.DataFrame({
+        'Dia': [dia for dia, _ in paradas],
+        'Ordem': [stop.ordem for _, stop in paradas],
+        'Empresa': base['nome_fantasia'],
+        'CNPJ': base['cnpj'],
+        'Endereço': base['formatado'],
+        'Cidade': base['cidade'],
+        'UF': base['uf'],
+        'Telefone': base['telefone_principal'],
+        'Email': base['email'],
+        'Score': base['score'].fillna(0),
+        'Segmento': base['segmento'],
+    })
+    if incluir_links:
+        df['Link Maps'] = base['link_maps']
+    observacoes = [getattr(stop, 'observacoes', None) for _, stop in paradas]
+    if any(observacoes):
+        df['Observações'] = observacoes
+    df = df.fillna('')
     
-    dados: List[Dict[str, Any]] = []
+    df_resumo = pd.DataFrame({
+        'Dia': [d.dia for d in route_plan.dias],
+        'Total Visitas': [d.total_visitas for d in route_plan.dias],
+        'Score Médio': [f"{d.score_medio:.1f}" for d in route_plan.dias],
+        'Link Rota Dia': [d.link_maps_rota if incluir_links else '' for d in route_plan.dias],
+    })
     
-    for dia_plan in route_plan.dias:
-        for stop in dia_plan.stops:
-            lead = stop.lead
-            
-            def a(o, name, default=''):
-                if isinstance(o, dict):
-                    return o.get(name, default) or default
-                return getattr(o, name, default) or default
-
-            linha: Dict[str, Any] = {
-                'Dia': dia_plan.dia,
-                'Ordem': stop.ordem,
-                'Empresa': a(lead, 'nome_fantasia'),
-                'CNPJ': a(lead, 'cnpj'),
-                'Endereço': getattr(a(lead, 'endereco', None), 'formatado', '') if a(lead, 'endereco', None) else '',
-                'Cidade': a(lead, 'cidade'),
-                'UF': a(lead, 'uf'),
-                'Telefone': a(lead, 'telefone_principal'),
-                'Email': a(lead, 'email'),
-                'Score': a(lead, 'score', 0),
-                'Segmento': a(lead, 'segmento', ''),
-            }
-            
-            if incluir_links:
-                linha['Link Maps'] = a(lead, 'link_maps')
-            
-            if getattr(stop, 'observacoes', None):
-                linha['Observações'] = stop.observacoes
-            
-            dados.append(linha)
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        _escrever_aba(writer, df, 'Roteiro')
+        _escrever_aba(writer, df_resumo, 'Resumo')
     
-    df = pd.DataFrame(dados)
+    return output.getvalue()
+
+
+def gerar_excel_streaming(cursor: Any, destino: str | BinaryIO,
+                          linhas_por_aba: int = LINHAS_POR_ABA,
+                          lote: int = LOTE_STREAMING) -> int:
+    """
+    Escreve o resultado de um cursor já executado (DuckDB/DB-API) direto no Excel,
+    lendo em blocos com fetchmany e usando o modo constant_memory do xlsxwriter:
+    cada linha vai para o disco assim que é escrita, então a memória não cresce com
+    o tamanho da lista. Ao chegar no limite de linhas do Excel abre outra aba (Leads_2, ...).
     
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='Roteiro')
-        
-        workbook = writer.book
-        worksheet = writer.sheets['Roteiro']
-        
-        # Formato texto
-        formato = workbook.add_format({'num_format': '@', 'align': 'left', 'valign': 'vcenter'})
-        
-        
-        for i, col in enumerate(df.columns):
-            max_len = max(
-                df[col].astype(str).map(len).max(),
-                len(col)
-            )
-            width = min(max_len + 2, 50)
-            worksheet.set_column(i, i, width, formato)
-        
-        
-        resumo_dados = []
-        for dia_plan in route_plan.dias:
-            resumo_dados.append({
-                'Dia': dia_plan.dia,
-                'Total Visitas': dia_plan.total_visitas,
-                'Score Médio': f"{dia_plan.score_medio:.1f}",
-                'Link Rota Dia': dia_plan.link_maps_rota if incluir_links else ''
-            })
-        
-        df_resumo = pd.DataFrame(resumo_dados)
-        df_resumo.to_excel(writer, index=False, sheet_name='Resumo')
+    Args:
+        cursor: Cursor com a consulta executada (colunas lidas de cursor.description)
+        destino: Caminho do arquivo ou arquivo binário aberto
         
-        worksheet_resumo = writer.sheets['Resumo']
-        for i, col in enumerate(df_resumo.columns):
-            max_len = max(
-                df_resumo[col].astype(str).map(len).max(),
-                len(col)
-            )
-            width = min(max_len + 2, 50)
-            worksheet_resumo.set_column(i, i, width, formato)
-    
-    return output.getvalue()
\ No newline at end of file
+    Returns:
+        Quantidade de linhas exportadas
+    """
+    nomes = [d[0] for d in cursor.description]
+    cabecalho = [MAPA_COLUNAS.get(n, n) for n in nomes]
+    bloco = cursor.fetchmany(lote)
+
+    # Largura pela amostra do primeiro bloco (o resto ainda não foi lido)
+    larguras = [len(c) for c in cabecalho]
+    for linha in bloco:
+        for i, valor in enumerate(linha):
+            if valor is not None:
+                larguras[i] = max(larguras[i], len(str(valor)))
+
+    workbook = xlsxwriter.Workbook(destino, {'constant_memory': True})
+    formato = workbook.add_format({'num_format': '@', 'align': 'left', 'valign': 'vcenter'})
+
+    def nova_aba(numero):
+        aba = workbook.add_worksheet('Leads' if numero == 1 else f'Leads_{numero}')
+        for i, largura in enumerate(larguras):
+            aba.set_column(i, i, min(largura + 2, 50), formato)
+        aba.write_row(0, 0, cabecalho)
+        return aba
+
+    abas = 1
+    aba = nova_aba(abas)
+    linha_atual = 1
+    total = 0
+    while bloco:
+        for linha in bloco:
+            if linha_atual == linhas_por_aba:
+                abas += 1
+                aba = nova_aba(abas)
+                linha_atual = 1
+            aba.write_row(linha_atual, 0, linha)
+            linha_atual += 1
+        total += len(bloco)
+        bloco = cursor.fetchmany(lote)
+
+    workbook.close()
+    return total
@@ -0,0 +1,103 @@
+"""
+Serviço de exportação direta do DuckDB (CSV, Parquet, JSONL).
+O COPY grava o resultado da consulta direto no arquivo, sem trazer as linhas para o Python.
+"""
+from __future__ import annotations
+
+import os
+import tempfile
+import time
+
+from src.database.connection import conexao
+from src.database.estabelecimentos_repository import sql_leads_enriquecidos
+from src.database.repository import sql_busca_empresas
+
+# formato -> (extensão, opções do COPY, mime)
+FORMATOS_EXPORTACAO = {
+    'CSV': ('csv', "FORMAT CSV, HEADER", 'text/csv'),
+    'Parquet': ('parquet', "FORMAT PARQUET, COMPRESSION ZSTD", 'application/vnd.apache.parquet'),
+    'JSONL': ('jsonl', "FORMAT JSON", 'application/x-ndjson'),
+}
+
+
+# Arquivos gerados para download ficam numa pasta só. O Streamlit não avisa quando
+# uma sessão termina, então os que passaram da validade são apagados a cada novo arquivo.
+PASTA_TEMPORARIOS = os.path.join(tempfile.gettempdir(), "hunter_exportacoes")
+VALIDADE_TEMPORARIOS = 6 * 60 * 60  # segundos
+
+
+def arquivo_temporario(extensao: str) -> str:
+    """Caminho de um arquivo novo (vazio) na pasta dos temporários, apagando os vencidos antes."""
+    os.makedirs(PASTA_TEMPORARIOS, exist_ok=True)
+    vencimento = time.time() - VALIDADE_TEMPORARIOS
+    for nome in os.listdir(PASTA_TEMPORARIOS):
+        caminho = os.path.join(PASTA_TEMPORARIOS, nome)
+        try:
+            if os.path.getmtime(caminho) < vencimento:
+                os.remove(caminho)
+        except OSError:
+            pass  # outro processo apagou antes
+    fd, caminho = tempfile.mkstemp(suffix=f".{extensao}", dir=PASTA_TEMPORARIOS)
+    os.close(fd)
+    return caminho
+
+
+def _copiar(con, query: str, params: list | dict, formato: str, destino: str | None) -> str:
+    extensao, opcoes, _ = FORMATOS_EXPORTACAO[formato]
+    if destino is None:
+        destino = arquivo_temporario(extensao)
+    caminho = destino.replace("'", "''")
+    con.execute(f"COPY ({query}) TO '{caminho}' ({opcoes})", params)
+    return destino
+
+
+def exportar_empresas(
+    lista_cnaes: list[str],
+    estado: str,
+    cidade: str = "TODAS",
+    formato: str = 'CSV',
+    destino: str | None = None,
+) -> str | None:
+    """
+    Exporta a busca do buscar_empresas_dto (mesmos filtros, sem o limite de 50k).
+
+    Args:
+        formato: 'CSV', 'Parquet' (zstd) ou 'JSONL'
+        destino: Caminho do arquivo (None = arquivo temporário)
+
+    Returns:
+        Caminho do arquivo gerado, ou None se não houver busca
+    """
+    with conexao() as con:
+        if not con:
+            return None
+        consulta = sql_busca_empresas(con, lista_cnaes, estado, cidade)
+        if consulta is None:
+            return None
+        query, params = consulta
+        return _copiar(con, query, params, formato, destino)
+
+
+def exportar_leads_enriquecidos(
+    lista_cnaes: list[str],
+    uf: str | None = None,
+    cidade: str | None = None,
+    somente_matriz: bool = False,
+    formato: str = 'CSV',
+    destino: str | None = None,
+) -> str | None:
+    """
+    Exporta a busca do buscar_leads_enriquecidos (mesmos filtros, sem limite),
+    com endereço, descrição do CNAE e data de início.
+
+    Returns:
+        Caminho do arquivo gerado, ou None se não houver busca
+    """
+    with conexao() as con:
+        if not con:
+            return None
+        consulta = sql_leads_enriquecidos(con, lista_cnaes, uf, cidade, somente_matriz)
+        if consulta is None:
+            return None
+        query, params = consulta
+        return _copiar(con, query, params, formato, destino)
@@ -1,6 +1,46 @@
+import pandas as pd
 import streamlit as st
 from src.ui.icons import Icons
-from src.database.crm_repository import buscar_meu_pipeline, atualizar_lead_crm, excluir_do_crm, atualizar_leads_em_lote, excluir_leads_em_lote
+from src.database.connection import versao_dados
+from src.database.schema import STATUS_CRM
+from src.database.crm_repository import (
+    ORDENS_PIPELINE,
+    buscar_meu_pipeline,
+    resumo_pipeline,
+    atualizar_leads_em_lote,
+    excluir_leads_em_lote,
+)
+
+COLUNAS_EDITAVEIS = ['status', 'valor', 'anotacao']
+STATUS_PIPELINE = STATUS_CRM
+
+
+def _normalizar_editaveis(df):
+    return df[COLUNAS_EDITAVEIS].assign(
+        status=df['status'].fillna('Novo').astype(str),
+        valor=pd.to_numeric(df['valor'], errors='coerce').fillna(0.0).round(2),
+        anotacao=df['anotacao'].fillna('').astype(str),
+    )
+
+
+def _calcular_alteracoes(df_original, df_editado):
+    """
+    Compara (de forma vetorizada) o editor com o pipeline carregado.
+    Retorna (cnpjs_excluir, updates) onde updates = [(cnpj, status, valor, anotacao), ...]
+    só das linhas que realmente mudaram.
+    """
+    excluir = df_editado['excluir'].fillna(False).astype(bool)
+    antes = _normalizar_editaveis(df_original.reindex(df_editado.index))
+    depois = _normalizar_editaveis(df_editado)
+    mudou = (antes != depois).any(axis=1) & ~excluir
+
+    cnpjs_excluir = df_editado.loc[excluir, 'cnpj'].tolist()
+    updates = list(
+        depois.loc[mudou].assign(cnpj=df_editado.loc[mudou, 'cnpj'])[['cnpj'] + COLUNAS_EDITAVEIS]
+        .itertuples(index=False, name=None)
+    )
+    return cnpjs_excluir, updates
+
 
 def render_tab_crm():
     """
@@ -21,42 +61,18 @@ def render_tab_crm():
             st.rerun()
     
    
-    if 'df_pipeline_cache' not in st.session_state:
-        with st.spinner("Carregando pipeline..."):
-            df_pipeline = buscar_meu_pipeline()
-            # Salva no cache
-            st.session_state.df_pipeline_cache = df_pipeline
-    else:
-        
-        df_pipeline = st.session_state.df_pipeline_cache.copy()
-    
-    if df_pipeline.empty:
-        
-        try:
-            st.write("DEBUG: amostra do df_pipeline", df_pipeline.head())
-            st.write("DEBUG: contagem de status", df_pipeline['status'].value_counts(dropna=False))
-        except Exception:
-            pass
+    resumo = resumo_pipeline()
+    if not resumo or resumo['total'] == 0:
         st.info("Sua carteira está vazia. Vá na aba 'Gerar Leads' e importe leads.")
         return
 
-    
-    total = len(df_pipeline)
-    valor_total = df_pipeline['valor'].sum()
-    
-    
-    status_upper = df_pipeline['status'].astype(str).str.upper()
-    vendas_mask = status_upper.str.contains('VENDID', na=False)
-    negociacao_mask = status_upper.str.contains('NEGOC', na=False)
-    novo_mask = status_upper.str.contains('NOVO', na=False)
-
-    vendas = int(vendas_mask.sum())
-    valor_vendas = float(df_pipeline.loc[vendas_mask, 'valor'].sum() if not df_pipeline.loc[vendas_mask, 'valor'].empty else 0.0)
-
-    
-    em_negociacao = int(negociacao_mask.sum())
-    valor_negociacao = float(df_pipeline.loc[negociacao_mask, 'valor'].sum() if not df_pipeline.loc[negociacao_mask, 'valor'].empty else 0.0)
-    
+    # KPIs do CRM inteiro (agregado no banco), independentes da página exibida
+    total = int(resumo['total'])
+    valor_total = float(resumo['valor_total'])
+    vendas = int(resumo['vendas'])
+    valor_vendas = float(resumo['valor_vendas'])
+    em_negociacao = int(resumo['em_negociacao'])
+    valor_negociacao = float(resumo['valor_negociacao'])
 
     c1, c2, c3, c4 = st.columns(4)
     c1.metric(f"{Icons.CHART} Total de Leads", total)
@@ -71,17 +87,75 @@ def render_tab_crm():
     c6.metric(f"{Icons.BRIEFCASE} Valor Negociação", f"R$ {valor_negociacao:,.2f}")
     taxa_conversao = (vendas / total * 100) if total > 0 else 0
     c7.metric(f"{Icons.CHART_UP} Taxa Conversão", f"{taxa_conversao:.1f}%", help="Vendas / Total de Leads")
-    c8.metric(f"{Icons.LOGO_PAGINA} Novos Leads", len(df_pipeline[df_pipeline['status'] == 'Novo']))
+    c8.metric(f"{Icons.LOGO_PAGINA} Novos Leads", int(resumo['novos']))
     
     st.divider()
 
+    # FILTROS E ORDENAÇÃO (aplicados no banco)
+    f1, f2, f3, f4 = st.columns([2, 1, 2, 1])
+    filtro_status = f1.multiselect("Fase", STATUS_PIPELINE, key="crm_filtro_status")
+    filtro_uf = f2.selectbox("UF", ["TODAS"] + resumo['ufs'], key="crm_filtro_uf")
+    filtro_texto = f3.text_input("Buscar (empresa, CNPJ, anotação, cidade)", key="crm_filtro_texto").strip()
+    ordem = f4.selectbox("Ordenar por", list(ORDENS_PIPELINE), key="crm_ordem")
+
+    # Mudou filtro/ordem: volta para a primeira página
+    chave_filtros = (tuple(filtro_status), filtro_uf, filtro_texto, ordem)
+    if st.session_state.get('crm_chave_filtros') != chave_filtros:
+        st.session_state.crm_chave_filtros = chave_filtros
+        st.session_state.crm_cursores = [None]
+        if 'df_pipeline_cache' in st.session_state:
+            del st.session_state.df_pipeline_cache
+
+    cursores = st.session_state.crm_cursores
+    pagina = len(cursores) - 1
+    # Chave por página/filtro: edições pendentes não passam para outra página
+    chave_editor = f"tabela_crm_editor_{abs(hash(chave_filtros))}_{pagina}"
+
+    # Outra sessão salvou no CRM (ou a base foi recriada): a página guardada ficou velha.
+    # Com edições pendentes não recarrega, senão elas se perdem; o aviso fica até salvar.
+    versao = versao_dados()
+    if st.session_state.get('crm_versao_cache') != versao and 'df_pipeline_cache' in st.session_state:
+        if st.session_state.get(chave_editor, {}).get('edited_rows'):
+            st.warning(f"{Icons.WARNING} O CRM foi alterado em outra sessão. Salve suas alterações para ver os dados atualizados.")
+        else:
+            del st.session_state.df_pipeline_cache
+
+    if 'df_pipeline_cache' not in st.session_state:
+        with st.spinner("Carregando pipeline..."):
+            df_pipeline, proximo = buscar_meu_pipeline(
+                filtro_status, filtro_uf, filtro_texto, ordem, apos=cursores[-1]
+            )
+            # Salva no cache
+            st.session_state.df_pipeline_cache = df_pipeline
+            st.session_state.crm_proximo = proximo
+            st.session_state.crm_versao_cache = versao
+    else:
+        
+        df_pipeline = st.session_state.df_pipeline_cache.copy()
+    proximo = st.session_state.get('crm_proximo')
+
+    # PAGINAÇÃO
+    p1, p2, p3 = st.columns([1, 2, 1])
+    if p1.button("◀ Anterior", disabled=pagina == 0, width='stretch'):
+        cursores.pop()
+        del st.session_state.df_pipeline_cache
+        st.rerun()
+    p2.caption(f"Página {pagina + 1} · {len(df_pipeline)} leads nesta página · {total:,} no CRM")
+    if p3.button("Próxima ▶", disabled=proximo is None, width='stretch'):
+        cursores.append(proximo)
+        del st.session_state.df_pipeline_cache
+        st.rerun()
+
+    if df_pipeline.empty:
+        st.info("Nenhum lead encontrado com esses filtros.")
+        return
     
     config_colunas = {
         "cnpj": st.column_config.TextColumn("CNPJ", disabled=True),
         "nome_fantasia": st.column_config.TextColumn("Empresa", disabled=True),
         "status": st.column_config.SelectboxColumn(
             "Fase",
-            options=["Novo", "Tentativa", "Em Negociação", "Vendido", "Perdido"],
+            options=STATUS_PIPELINE,
             required=True
         ),
         "valor": st.column_config.NumberColumn("Valor (R$)", format="R$ %.2f"),
@@ -99,44 +173,32 @@ def render_tab_crm():
         hide_index=True,
         column_config=config_colunas,
         num_rows="fixed",
-        key="tabela_crm_editor"
+        key=chave_editor
     )
 
    
     if st.button(f"{Icons.SAVE_EMOJI} SALVAR ALTERAÇÕES", type="primary", width='stretch'):
-        alteracoes = 0
-        cnpjs_excluir = []
-        updates_lote = []
-        
-        
-        for index, row in df_editado.iterrows():
-            cnpj = row['cnpj']
-            
-            
-            if row.get('excluir', False):
-                cnpjs_excluir.append(cnpj)
-                alteracoes += 1
-            else:
-                
-                status = row.get('status', 'Novo')
-                valor = row.get('valor', 0.0)
-                anotacao = row.get('anotacao', '') or ''
-                updates_lote.append((cnpj, status, valor, anotacao))
-                alteracoes += 1
-        
+        # Só grava o que mudou: compara o editor com o pipeline carregado
+        cnpjs_excluir, updates_lote = _calcular_alteracoes(
+            st.session_state.df_pipeline_cache, df_editado
+        )
+        alteracoes = len(cnpjs_excluir) + len(updates_lote)
         
-        if cnpjs_excluir:
-            excluir_leads_em_lote(cnpjs_excluir)
+        if alteracoes == 0:
+            st.info("Nenhuma alteração para salvar.")
         
+        salvou = True
+        if cnpjs_excluir and not excluir_leads_em_lote(cnpjs_excluir):
+            salvou = False
+            st.error(f"{Icons.CROSS} Erro ao excluir {len(cnpjs_excluir)} lead(s). Tente novamente.")
         
-        if updates_lote:
-            if atualizar_leads_em_lote(updates_lote):
-                st.success(f"{Icons.CHECK} {alteracoes} alterações salvas com sucesso!")
-            else:
-                st.error(f"{Icons.CROSS} Erro ao salvar algumas alterações. Tente novamente.")
-        
-        if alteracoes > 0:
-            
+        if updates_lote and not atualizar_leads_em_lote(updates_lote):
+            salvou = False
+            st.error(f"{Icons.CROSS} Erro ao salvar algumas alterações. Tente novamente.")
+
+        # Com erro não recarrega: a mensagem e as edições pendentes continuam na tela
+        if alteracoes > 0 and salvou:
+            st.success(f"{Icons.CHECK} {alteracoes} alterações salvas com sucesso!")
             if 'df_pipeline_cache' in st.session_state:
                 del st.session_state.df_pipeline_cache
             st.rerun()
\ No newline at end of file
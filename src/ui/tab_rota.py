@@ -1,10 +1,13 @@
-import streamlit as st
-import pandas as pd
 from urllib.parse import quote_plus
+
+import pandas as pd
+import streamlit as st
+
 from src.ui.icons import Icons
 
 # CONEXÃO BANCO DE DADOS
 try:
+    from src.database.municipios import separar_rotulo
     from src.database.repository import (
         buscar_leads_por_cidade_e_cnae,
         listar_cidades_disponiveis,
@@ -129,6 +132,12 @@ def _higienizar_endereco(row) -> str:
     return endereco_limpo if len(endereco_limpo) > 5 else None
 
 
+def _local_geo(rotulo: str) -> str:
+    """'NOME - UF' -> 'NOME, UF', formato usado na geocodificação e na origem do Maps."""
+    nome, uf = separar_rotulo(rotulo)
+    return f"{nome}, {uf}" if uf else nome
+
+
 def gerar_link_google_maps(origem: str, leads_df: pd.DataFrame) -> str:
     """
     Gera o link oficial de navegação (DIR) usando endereços higienizados.
@@ -207,7 +216,7 @@ def render_tab_rota():
                 
                 with form:
                     todas_cidades = listar_cidades_disponiveis() or []
-                    idx_padrao = todas_cidades.index("FEIRA DE SANTANA") if "FEIRA DE SANTANA" in todas_cidades else 0
+                    idx_padrao = todas_cidades.index("FEIRA DE SANTANA - BA") if "FEIRA DE SANTANA - BA" in todas_cidades else 0
                     
                     cidade_partida = st.selectbox(f"{Icons.PIN} Ponto de Partida", options=todas_cidades, index=idx_padrao)
                     
@@ -268,14 +277,18 @@ def render_tab_rota():
                     
                     link_maps = "#"
                     if cidade_partida:
-                        origem_maps = f"{cidade_partida}, BA"
+                        origem_maps = _local_geo(cidade_partida)
                         link_maps = gerar_link_google_maps(origem_maps, df_rota)
 
                     st.markdown(f"##### {Icons.LISTA} Lista de Paradas")
                     col_cidade = 'municipio' if 'municipio' in df_rota.columns else 'cidade'
 
                     for cidade in cidades_selecionadas:
-                        df_cidade = df_rota[df_rota[col_cidade] == cidade]
+                        nome_cidade, uf_cidade = separar_rotulo(cidade)
+                        no_municipio = df_rota[col_cidade].str.strip().str.upper() == nome_cidade
+                        if uf_cidade:
+                            no_municipio &= df_rota['uf'] == uf_cidade
+                        df_cidade = df_rota[no_municipio]
 
                         if not df_cidade.empty:
                             with st.expander(f"{Icons.PIN} {cidade} ({len(df_cidade)} clientes)", expanded=False):
@@ -307,7 +320,7 @@ def render_tab_rota():
             
             with st.spinner("Desenhando mapa panorâmico..."):
                 for cid in cidades_selecionadas:
-                    coord = geocode_place(f"{cid}, BA")
+                    coord = geocode_place(_local_geo(cid))
                     if coord: cidade_coords.append((cid, coord))
                     else: cidades_nao_geo.append(cid)
 
@@ -0,0 +1,56 @@
+"""
+Teste de carga local do modo serviço (HUNTER_SOMENTE_LEITURA=1).
+Abre N processos lendo o mesmo hunter_leads.db em read_only e mede quantas
+buscas por segundo o conjunto atende.
+
+Uso: python teste_carga_leitura.py --cnae 4711302 --uf BA --processos 1 2 4 8
+"""
+import argparse
+import os
+import time
+from multiprocessing import get_context
+
+
+def _worker(cnae, uf, segundos, fila):
+    # Precisa valer antes de importar os módulos do app
+    os.environ["HUNTER_SOMENTE_LEITURA"] = "1"
+    # Mede o banco, não o cache de resultados (as buscas se repetem)
+    os.environ["HUNTER_CACHE_MB"] = "0"
+    from src.database.repository import buscar_dados_dashboard_executivo, buscar_empresas_dto
+
+    buscas = 0
+    fim = time.perf_counter() + segundos
+    while time.perf_counter() < fim:
+        buscar_empresas_dto([cnae], uf)
+        buscar_dados_dashboard_executivo([uf], None, [cnae])
+        buscas += 2
+    fila.put(buscas)
+
+
+def medir(processos, cnae, uf, segundos):
+    ctx = get_context("spawn")
+    fila = ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(cnae, uf, segundos, fila)) for _ in range(processos)]
+    for p in procs:
+        p.start()
+    total = sum(fila.get() for _ in procs)
+    for p in procs:
+        p.join()
+    return total / segundos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mede buscas/s com vários processos lendo o banco.")
+    parser.add_argument('--cnae', default='4711302')
+    parser.add_argument('--uf', default='SP')
+    parser.add_argument('--segundos', type=float, default=10)
+    parser.add_argument('--processos', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    print(f"{'Processos':>10} {'Buscas/s':>10}")
+    for n in args.processos:
+        print(f"{n:>10} {medir(n, args.cnae, args.uf, args.segundos):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
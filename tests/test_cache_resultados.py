@@ -0,0 +1,75 @@
+import pandas as pd
+import pytest
+
+from src.database import cache_resultados as cache
+
+
+@pytest.fixture(autouse=True)
+def cache_limpo():
+    cache.limpar_cache()
+    yield
+    cache.limpar_cache()
+
+
+def _df(linhas=100):
+    return pd.DataFrame({'cnpj': [f'{i:014d}' for i in range(linhas)]})
+
+
+def test_reaproveita_resultado_da_mesma_chave():
+    chamadas = []
+
+    def calcular():
+        chamadas.append(1)
+        return _df()
+
+    primeiro = cache.buscar_em_cache(1, 'a', calcular)
+    segundo = cache.buscar_em_cache(1, 'a', calcular)
+
+    assert primeiro is segundo
+    assert len(chamadas) == 1
+    stats = cache.estatisticas_cache()
+    assert (stats['acertos'], stats['falhas'], stats['itens']) == (1, 1, 1)
+
+
+def test_descarta_o_menos_usado_ao_passar_do_limite(monkeypatch):
+    tamanho = cache._tamanho(_df())
+    monkeypatch.setattr(cache, 'LIMITE_BYTES', tamanho * 2)
+
+    cache.buscar_em_cache(1, 'a', _df)
+    cache.buscar_em_cache(1, 'b', _df)
+    cache.buscar_em_cache(1, 'a', _df)  # 'a' passa a ser o mais usado
+    cache.buscar_em_cache(1, 'c', _df)  # não cabe: sai 'b'
+
+    assert list(cache._itens) == ['a', 'c']
+    stats = cache.estatisticas_cache()
+    assert stats['descartes'] == 1
+    assert stats['bytes'] == tamanho * 2 <= stats['limite_bytes']
+
+
+def test_resultado_maior_que_o_limite_nao_entra(monkeypatch):
+    monkeypatch.setattr(cache, 'LIMITE_BYTES', cache._tamanho(_df()) - 1)
+
+    resultado = cache.buscar_em_cache(1, 'a', _df)
+
+    assert len(resultado) == 100
+    assert cache.estatisticas_cache()['itens'] == 0
+
+
+def test_nova_versao_descarta_tudo():
+    cache.buscar_em_cache(1, 'a', _df)
+    cache.buscar_em_cache(1, 'b', _df)
+
+    cache.buscar_em_cache(2, 'a', _df)
+
+    assert list(cache._itens) == ['a']
+    assert cache.estatisticas_cache()['falhas'] == 3
+
+
+def test_erro_no_calculo_nao_guarda_nada():
+    def falhar():
+        raise RuntimeError('banco fora')
+
+    with pytest.raises(RuntimeError):
+        cache.buscar_em_cache(1, 'a', falhar)
+
+    assert cache.estatisticas_cache()['itens'] == 0
@@ -0,0 +1,65 @@
+from contextlib import contextmanager
+
+import duckdb
+import pytest
+
+from src.database import crm_repository
+
+
+@pytest.fixture
+def crm(monkeypatch):
+    """CRM em memória com 7 leads, 3 deles com data_atualizacao nula (CRM antigo)."""
+    con = duckdb.connect()
+    con.execute("ATTACH ':memory:' AS crm_db")
+    con.execute("""
+        CREATE TABLE crm_db.crm (
+            cnpj VARCHAR PRIMARY KEY, status VARCHAR, anotacao VARCHAR, valor DECIMAL(10,2),
+            data_criacao TIMESTAMP, data_atualizacao TIMESTAMP
+        )
+    """)
+    con.execute("""
+        INSERT INTO crm_db.crm VALUES
+            ('01', 'Novo', '', 10, '2024-01-01', '2024-03-01'),
+            ('02', 'Novo', '', 20, '2024-01-01', '2024-02-01'),
+            ('03', 'Novo', '', NULL, '2024-01-01', '2024-02-01'),
+            ('04', 'Novo', '', 40, '2024-01-15', NULL),
+            ('05', 'Novo', '', 50, NULL, NULL),
+            ('06', 'Novo', '', 60, NULL, NULL),
+            ('07', 'Novo', '', 70, '2024-01-01', '2024-04-01')
+    """)
+    con.execute("""
+        CREATE TABLE crm_db.crm_enriched (
+            cnpj VARCHAR, nome_fantasia VARCHAR, uf VARCHAR, telefone VARCHAR, email VARCHAR, local VARCHAR
+        )
+    """)
+
+    @contextmanager
+    def conexao_falsa():
+        yield con
+
+    monkeypatch.setattr(crm_repository, 'conexao_crm', conexao_falsa)
+    monkeypatch.setattr(crm_repository, 'inicializar_crm', lambda: None)
+    yield con
+    con.close()
+
+
+def _todas_as_paginas(ordem, tamanho=2):
+    cnpjs, apos = [], None
+    while True:
+        df, apos = crm_repository._buscar_pipeline_interno.__wrapped__(
+            0, ordem=ordem, apos=apos, tamanho=tamanho
+        )
+        cnpjs += df['cnpj'].tolist()
+        if apos is None:
+            return cnpjs
+
+
+@pytest.mark.parametrize('ordem', list(crm_repository.ORDENS_PIPELINE))
+def test_paginacao_traz_todos_os_leads_mesmo_com_datas_nulas(crm, ordem):
+    cnpjs = _todas_as_paginas(ordem)
+    assert sorted(cnpjs) == ['01', '02', '03', '04', '05', '06', '07']
+
+
+def test_ordem_por_data_usa_a_criacao_quando_falta_a_atualizacao(crm):
+    assert _todas_as_paginas("Mais recentes") == ['07', '01', '03', '02', '04', '06', '05']
+    assert _todas_as_paginas("Mais antigos") == ['05', '06', '04', '02', '03', '01', '07']
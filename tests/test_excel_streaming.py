@@ -0,0 +1,55 @@
+import openpyxl
+
+from src.services.excel_service import LINHAS_POR_ABA, gerar_excel_streaming
+
+
+class CursorFalso:
+    """Imita o cursor do DuckDB: description + fetchmany."""
+
+    def __init__(self, linhas):
+        self.description = [('cnpj',), ('uf',)]
+        self._linhas = list(linhas)
+
+    def fetchmany(self, n):
+        bloco, self._linhas = self._linhas[:n], self._linhas[n:]
+        return bloco
+
+
+def _linhas(n):
+    return [(f'{i:014d}', 'BA') for i in range(n)]
+
+
+def test_limite_padrao_e_o_do_excel():
+    assert LINHAS_POR_ABA == 1_048_576
+
+
+def test_abre_outra_aba_ao_chegar_no_limite(tmp_path):
+    destino = tmp_path / 'leads.xlsx'
+
+    # 4 linhas por aba = cabeçalho + 3 de dados; lote menor que a aba cruza os blocos
+    total = gerar_excel_streaming(CursorFalso(_linhas(7)), str(destino), linhas_por_aba=4, lote=2)
+
+    assert total == 7
+    livro = openpyxl.load_workbook(destino, read_only=True)
+    assert livro.sheetnames == ['Leads', 'Leads_2', 'Leads_3']
+    abas = [list(livro[nome].values) for nome in livro.sheetnames]
+    assert all(aba[0] == ('CNPJ', 'UF') for aba in abas)
+    assert [len(aba) - 1 for aba in abas] == [3, 3, 1]
+    dados = [linha for aba in abas for linha in aba[1:]]
+    assert dados == _linhas(7)
+
+
+def test_aba_cheia_sem_sobra_nao_cria_aba_vazia(tmp_path):
+    destino = tmp_path / 'leads.xlsx'
+
+    gerar_excel_streaming(CursorFalso(_linhas(6)), str(destino), linhas_por_aba=4)
+
+    assert openpyxl.load_workbook(destino, read_only=True).sheetnames == ['Leads', 'Leads_2']
+
+
+def test_cursor_vazio_gera_so_o_cabecalho(tmp_path):
+    destino = tmp_path / 'leads.xlsx'
+
+    assert gerar_excel_streaming(CursorFalso([]), str(destino)) == 0
+    livro = openpyxl.load_workbook(destino, read_only=True)
+    assert list(livro['Leads'].values) == [('CNPJ', 'UF')]
@@ -0,0 +1,16 @@
+import os
+
+from src.services import export_service
+
+
+def test_arquivo_temporario_apaga_so_os_vencidos(tmp_path, monkeypatch):
+    monkeypatch.setattr(export_service, 'PASTA_TEMPORARIOS', str(tmp_path / 'exportacoes'))
+    vencido = export_service.arquivo_temporario('csv')
+    recente = export_service.arquivo_temporario('csv')
+    os.utime(vencido, (0, 0))
+
+    novo = export_service.arquivo_temporario('xlsx')
+
+    assert not os.path.exists(vencido)
+    assert os.path.exists(recente)
+    assert novo.endswith('.xlsx') and os.path.dirname(novo) == export_service.PASTA_TEMPORARIOS
@@ -0,0 +1,53 @@
+import duckdb
+import pytest
+
+from src.database import municipios
+
+
+@pytest.fixture
+def con(monkeypatch):
+    # Base mínima: BOM JESUS existe na BA e em MG (homônimos separados pela UF do cubo)
+    con = duckdb.connect()
+    con.execute("CREATE TABLE municipios (codigo INTEGER, descricao VARCHAR)")
+    con.execute("""
+        INSERT INTO municipios VALUES
+            (1, 'BOM JESUS'), (2, 'BOM JESUS'), (3, 'FEIRA DE SANTANA'), (4, 'SEM EMPRESAS')
+    """)
+    con.execute("CREATE TABLE cubo_mercado (municipio INTEGER, uf VARCHAR, total BIGINT)")
+    con.execute("INSERT INTO cubo_mercado VALUES (1, 'BA', 10), (2, 'MG', 5), (2, 'SP', 1), (3, 'BA', 50)")
+    monkeypatch.setattr(municipios, '_indice', None)
+    monkeypatch.setattr(municipios, '_chave_indice', None)
+    yield con
+    con.close()
+
+
+def test_rotulo_com_uf_escolhe_um_homonimo(con):
+    assert municipios.resolver_municipios(con, ['BOM JESUS - MG']) == [2]
+    assert municipios.resolver_municipios(con, ['bom jesus - ba']) == [1]
+
+
+def test_nome_sem_uf_traz_todos_os_homonimos(con):
+    assert municipios.resolver_municipios(con, ['Bom Jesus']) == [1, 2]
+    assert municipios.resolver_municipios(con, ['BOM JESUS'], ufs=['ba']) == [1]
+
+
+def test_uf_do_codigo_e_a_com_mais_empresas(con):
+    # o código 2 tem uma empresa em SP, mas é de MG
+    assert municipios.resolver_municipios(con, ['BOM JESUS - SP']) == []
+
+
+def test_ignora_desconhecidas_e_repetidas(con):
+    cidades = ['FEIRA DE SANTANA - BA', 'FEIRA DE SANTANA', 'NAO EXISTE', 'BOM JESUS - PI']
+    assert municipios.resolver_municipios(con, cidades) == [3]
+
+
+def test_rotulos_separam_homonimos(con):
+    assert municipios.rotulos_municipios(con) == [
+        'BOM JESUS - BA', 'BOM JESUS - MG', 'FEIRA DE SANTANA - BA', 'SEM EMPRESAS'
+    ]
+    assert municipios.nomes_municipios(con, 'BA') == ['BOM JESUS', 'FEIRA DE SANTANA']
+
+
+def test_separar_rotulo():
+    assert municipios.separar_rotulo('Feira de Santana - ba') == ('FEIRA DE SANTANA', 'BA')
+    assert municipios.separar_rotulo('SANTA RITA DO PASSA-QUATRO') == ('SANTA RITA DO PASSA-QUATRO', None)
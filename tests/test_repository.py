@@ -0,0 +1,84 @@
+import duckdb
+import pandas as pd
+import pytest
+
+from src.database import cache_resultados
+from src.database.repository import _em_cache
+
+
+@pytest.fixture
+def con():
+    cache_resultados.limpar_cache()
+    con = duckdb.connect()
+    yield con
+    con.close()
+    cache_resultados.limpar_cache()
+
+
+def test_ordem_e_repeticao_dos_filtros_usam_a_mesma_entrada(con):
+    chamadas = []
+
+    def calcular():
+        chamadas.append(1)
+        return pd.DataFrame({'total': [1]})
+
+    primeiro = _em_cache(con, 'dashboard', {'cnaes': [4711302, 4712100], 'ufs': ['BA', 'SP']}, calcular)
+    segundo = _em_cache(con, 'dashboard', {'ufs': ['SP', 'BA', 'BA'], 'cnaes': [4712100, 4711302]}, calcular)
+
+    assert segundo is primeiro
+    assert len(chamadas) == 1
+
+
+def test_filtros_diferentes_nao_se_misturam(con):
+    def calcular():
+        return pd.DataFrame({'total': [1]})
+
+    _em_cache(con, 'dashboard', {'cnaes': [4711302], 'ufs': None}, calcular)
+    _em_cache(con, 'dashboard', {'cnaes': [4711302], 'ufs': ['BA']}, calcular)
+    _em_cache(con, 'top_cidades', {'cnaes': [4711302], 'ufs': None}, calcular)
+
+    assert cache_resultados.estatisticas_cache()['itens'] == 3
+
+
+@pytest.fixture
+def base(monkeypatch):
+    """Cubo, municípios e CNAEs mínimos no lugar do banco da Receita."""
+    from contextlib import contextmanager
+
+    from src.database import municipios, repository
+
+    cache_resultados.limpar_cache()
+    con = duckdb.connect()
+    con.execute("CREATE TABLE municipios AS SELECT * FROM (VALUES ('0003701', 'FEIRA DE SANTANA')) t(codigo, descricao)")
+    con.execute("CREATE TABLE cnaes AS SELECT * FROM (VALUES (4711302, 'MERCADO')) t(codigo, descricao)")
+    con.execute("""
+        CREATE TABLE cubo_mercado AS SELECT * FROM (VALUES
+            ('BA', '0003701', 4711302, 'MATRIZ', true, false, 7)
+        ) t(uf, municipio, cnae_principal, matriz_filial, tem_telefone, tem_email, total)
+    """)
+
+    @contextmanager
+    def conexao_falsa():
+        yield con
+
+    monkeypatch.setattr(repository, 'conexao', conexao_falsa)
+    monkeypatch.setattr(repository, '_consultas', {})
+    monkeypatch.setattr(municipios, '_indice', None)
+    yield repository
+    con.close()
+    cache_resultados.limpar_cache()
+
+
+def test_dashboard_com_cnaes_todos_invalidos_fica_vazio(base):
+    assert base.buscar_dados_dashboard_executivo(lista_cnaes=None)['kpis']['total_empresas'].iloc[0] == 7
+
+    dados = base.buscar_dados_dashboard_executivo(lista_cnaes=['abc', 'comércio'])
+
+    assert dados['kpis']['total_empresas'].iloc[0] == 0
+    assert dados['mapa'].empty and dados['distribuicao_uf'].empty
+
+
+def test_dashboard_com_cidade_desconhecida_fica_vazio(base):
+    dados = base.buscar_dados_dashboard_executivo(lista_cidades=['NAO EXISTE'])
+
+    assert dados['kpis']['total_empresas'].iloc[0] == 0
@@ -0,0 +1,45 @@
+import duckdb
+import pytest
+
+from src.database.schema import SITUACAO_ATIVA, relatorio_row_groups
+
+LINHAS_ROW_GROUP = 122880
+
+
+@pytest.fixture
+def con(tmp_path):
+    # 3 row groups: só BA | AC e SP intercalados (faixa AC..SP cobre BA sem ter BA) | MG
+    con = duckdb.connect(str(tmp_path / 'rg.db'))
+    con.execute("SET threads = 1")
+    con.execute(f"""
+        CREATE TABLE estabelecimentos AS
+        SELECT
+            CAST({SITUACAO_ATIVA} AS UTINYINT) AS situacao_cadastral,
+            CASE
+                WHEN i < {LINHAS_ROW_GROUP} THEN 'BA'
+                WHEN i < {2 * LINHAS_ROW_GROUP} THEN CASE WHEN i % 2 = 0 THEN 'AC' ELSE 'SP' END
+                ELSE 'MG'
+            END AS uf,
+            4711302 AS cnae_principal,
+            '0003701' AS municipio
+        FROM range({2 * LINHAS_ROW_GROUP + 50000}) t(i)
+        ORDER BY i
+    """)
+    con.execute("CHECKPOINT")
+    yield con
+    con.close()
+
+
+def test_conta_row_groups_que_o_zone_map_nao_pula(con):
+    relatorio = {nome.split(' (')[0]: (lidos, total) for nome, lidos, total in relatorio_row_groups(con)}
+
+    # BA está só no primeiro, mas a faixa AC..SP do segundo também não pode ser pulada
+    assert relatorio['UF inteira'] == (2, 3)
+    assert relatorio['UF + CNAE'] == (2, 3)
+    assert relatorio['CNAE no Brasil'] == (3, 3)
+
+
+def test_base_vazia_nao_gera_relatorio(tmp_path):
+    con = duckdb.connect(str(tmp_path / 'vazio.db'))
+    con.execute("CREATE TABLE estabelecimentos (situacao_cadastral UTINYINT, uf VARCHAR, cnae_principal INTEGER, municipio VARCHAR)")
+    assert relatorio_row_groups(con) == []
@@ -0,0 +1,51 @@
+import pandas as pd
+
+from src.ui.tab_crm import _calcular_alteracoes
+
+
+def _pipeline():
+    return pd.DataFrame({
+        'cnpj': ['1', '2', '3'],
+        'nome_fantasia': ['A', 'B', 'C'],
+        'status': ['Novo', 'Tentativa', 'Novo'],
+        'valor': [0.0, 10.0, None],
+        'anotacao': ['', None, 'ligar'],
+    })
+
+
+def _editor(df):
+    return df.assign(excluir=False)
+
+
+def test_sem_edicao_nao_gera_alteracoes():
+    original = _pipeline()
+    assert _calcular_alteracoes(original, _editor(original)) == ([], [])
+
+
+def test_nulos_e_vazios_equivalentes_nao_contam_como_mudanca():
+    original = _pipeline()
+    editado = _editor(original).assign(anotacao=['', '', 'ligar'], valor=[0.0, 10.0, 0.0])
+    assert _calcular_alteracoes(original, editado) == ([], [])
+
+
+def test_retorna_so_as_linhas_alteradas():
+    original = _pipeline()
+    editado = _editor(original)
+    editado.loc[1, 'status'] = 'Vendido'
+    editado.loc[2, 'valor'] = 123.456
+
+    excluir, updates = _calcular_alteracoes(original, editado)
+
+    assert excluir == []
+    assert updates == [('2', 'Vendido', 10.0, ''), ('3', 'Novo', 123.46, 'ligar')]
+
+
+def test_linha_marcada_para_excluir_nao_vira_update():
+    original = _pipeline()
+    editado = _editor(original)
+    editado.loc[0, ['excluir', 'anotacao']] = [True, 'mudou']
+
+    excluir, updates = _calcular_alteracoes(original, editado)
+
+    assert excluir == ['1']
+    assert updates == []
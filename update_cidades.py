@@ -3,6 +3,9 @@ import pandas as pd
 import os
 import zipfile
 
+from src.config.settings import DB_FILE
+from src.database.schema import incrementar_versao
+
 print("---  ATUALIZAÇÃO VIA PANDAS (MODO ULTRA ROBUSTO) ---")
 
 caminho_zip = "dados/MUNICCSV.zip"
@@ -40,11 +43,16 @@ try:
 
     # 3. Inserção no DuckDB
     print("🔌 3. Salvando no Banco de Dados...")
-    con = duckdb.connect('hunter_leads.db')
+    con = duckdb.connect(DB_FILE)
+    con.execute("BEGIN TRANSACTION")
     con.execute("DROP TABLE IF EXISTS municipios")
     
     
-    con.execute("CREATE TABLE municipios AS SELECT * FROM df")
+    # Código com 7 dígitos, igual à coluna estabelecimentos.municipio
+    con.execute("CREATE TABLE municipios AS SELECT LPAD(TRIM(codigo), 7, '0') AS codigo, descricao FROM df")
+    # Nova versão: o índice de municípios e o cache de resultados dos processos abertos recarregam
+    incrementar_versao(con, 'main')
+    con.execute("COMMIT")
     
     print(" SUCESSO TOTAL! Tabela criada.")
     